@@ -0,0 +1,61 @@
+"""
+Measure how long it takes to get the trees of a large salt tree with an empty
+and with a warm disk cache.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_disk_cache.py [--files 3000] [--states 10]
+"""
+
+import argparse
+import gc
+import os
+import tempfile
+import time
+from typing import List, Optional
+
+from bench_parser import generate_sls
+
+from salt_lsp.disk_cache import DiskTreeCache
+from salt_lsp.indexer import CHUNK_SIZE, parse_files
+from salt_lsp.parser import PARSE_CACHE
+
+
+def load_all(paths: List[str], cache_dir: str) -> float:
+    """
+    Return the time it took to read and parse the files in seconds, like the
+    indexer of a freshly started server does in its workers.
+    """
+    PARSE_CACHE.clear()
+    # a new server does not start with the trees of the previous run
+    gc.collect()
+    cache = DiskTreeCache(cache_dir)
+    trees = []
+    start = time.perf_counter()
+    for i in range(0, len(paths), CHUNK_SIZE):
+        trees += parse_files(paths[i : i + CHUNK_SIZE], cache)
+    return time.perf_counter() - start
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=3000)
+    parser.add_argument("--states", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = []
+        for i in range(args.files):
+            paths.append(os.path.join(tmp_dir, f"file_{i}.sls"))
+            with open(paths[-1], "w") as sls_file:
+                # distinct contents, identical ones are only parsed once
+                sls_file.write(f"# file {i}\n" + generate_sls(args.states))
+
+        cache_dir = os.path.join(tmp_dir, "cache")
+        print(f"files:       {args.files}")
+        print(f"first run:   {load_all(paths, cache_dir):.2f}s")
+        print(f"warm cache:  {load_all(paths, cache_dir):.2f}s")
+
+
+if __name__ == "__main__":
+    main()
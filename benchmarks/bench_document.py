@@ -0,0 +1,72 @@
+"""
+Measure applying typed characters to a large document and converting
+positions to offsets.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_document.py [--states 5000]
+"""
+
+import argparse
+import timeit
+from typing import List, Optional, Type
+
+from bench_parser import generate_sls
+from lsprotocol.types import (
+    Position,
+    Range,
+    TextDocumentContentChangeEvent_Type1,
+)
+from pygls.workspace import TextDocument
+
+from salt_lsp.utils import position_to_index
+from salt_lsp.workspace import SlsTextDocument
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--states", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    source = generate_sls(args.states)
+    line = source.count("\n") // 2
+    print(f"lines:                   {source.count(chr(10))}")
+
+    document_class: Type[TextDocument]
+    for document_class in (TextDocument, SlsTextDocument):
+        document = document_class("file:///srv/salt/big.sls", source)
+        column = 0
+
+        def type_character() -> None:
+            nonlocal column
+            position = Position(line=line, character=column)
+            document.apply_change(
+                TextDocumentContentChangeEvent_Type1(
+                    range=Range(start=position, end=position), text="x"
+                )
+            )
+            column += 1
+
+        position = Position(line=line, character=4)
+        name = document_class.__name__
+        elapsed = min(timeit.repeat(type_character, number=1, repeat=50))
+        print(f"{name + ' type':<24} {elapsed * 1000:.3f} ms")
+        elapsed = min(
+            timeit.repeat(
+                lambda: document.offset_at_position(position),
+                number=1,
+                repeat=50,
+            )
+        )
+        print(f"{name + ' offset':<24} {elapsed * 1000:.3f} ms")
+
+    elapsed = min(
+        timeit.repeat(
+            lambda: position_to_index(source, line, 4), number=1, repeat=10
+        )
+    )
+    print(f"position_to_index        {elapsed * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
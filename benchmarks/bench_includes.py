@@ -0,0 +1,111 @@
+"""
+Measure resolving the includes of a chain of SLS files including each other.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_includes.py [--depth 500]
+"""
+
+import argparse
+import tempfile
+import time
+import timeit
+from pathlib import Path
+from typing import List, Optional
+
+from lsprotocol.types import (
+    TextDocumentContentChangeEvent_Type2,
+    TextDocumentItem,
+    VersionedTextDocumentIdentifier,
+    WorkspaceFolder,
+)
+
+from salt_lsp.base_types import SLS_LANGUAGE_ID
+from salt_lsp.include_graph import IncludeGraph
+from salt_lsp.workspace import SlsFileWorkspace
+
+
+def chain_file(i: int, depth: int, extra: str = "") -> str:
+    """
+    Returns the content of the i-th file of the chain, which includes the
+    next one.
+    """
+    includes = f"include:\n  - file_{i + 1}\n{extra}\n" if i < depth else ""
+    return f"{includes}state_{i}:\n  test.nop: []\n"
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--depth", type=int, default=500)
+    args = parser.parse_args(argv)
+
+    graph = IncludeGraph()
+    uris = [f"file:///srv/salt/file_{i}.sls" for i in range(args.depth + 1)]
+    for uri, include in zip(uris, uris[1:]):
+        graph.set_includes(uri, [include])
+    elapsed = timeit.timeit(lambda: graph[uris[0]], number=1)
+    print(f"depth:                   {args.depth}")
+    print(f"closure of the head:     {elapsed * 1000:.2f} ms")
+    elapsed = timeit.timeit(
+        lambda: [graph[uri] for uri in uris[1:-1]], number=1
+    )
+    print(f"closures of all others:  {elapsed * 1000:.2f} ms")
+
+    def change_tail() -> None:
+        graph.set_includes(uris[-2], [uris[-1], uris[0]])
+        graph.set_includes(uris[-2], [uris[-1]])
+        graph.get(uris[0])
+
+    elapsed = min(timeit.repeat(change_tail, number=1, repeat=10))
+    print(f"change the tail twice:   {elapsed * 1000:.2f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        for i in range(args.depth + 1):
+            (root / f"file_{i}.sls").write_text(chain_file(i, args.depth))
+        (root / "top.sls").write_text("base:\n  '*':\n    - file_0\n")
+
+        workspace = SlsFileWorkspace(
+            {},
+            root.as_uri(),
+            workspace_folders=[
+                WorkspaceFolder(uri=root.as_uri(), name="bench")
+            ],
+        )
+        head = (root / "file_0.sls").as_uri()
+        start = time.perf_counter()
+        workspace.put_text_document(
+            TextDocumentItem(
+                uri=head,
+                language_id=SLS_LANGUAGE_ID,
+                version=0,
+                text=chain_file(0, args.depth),
+            )
+        )
+        elapsed = time.perf_counter() - start
+        print(f"open the head:           {elapsed * 1000:.1f} ms")
+        print(f"included files:          {len(workspace.includes[head])}")
+
+        version = 0
+
+        def edit(uri: str, i: int) -> None:
+            nonlocal version
+            version += 1
+            workspace.update_text_document(
+                VersionedTextDocumentIdentifier(uri=uri, version=version),
+                TextDocumentContentChangeEvent_Type2(
+                    text=chain_file(i, args.depth, f"# {version}")
+                ),
+            )
+            workspace.includes.get(head)
+
+        for i in (0, args.depth // 2, args.depth - 1):
+            uri = (root / f"file_{i}.sls").as_uri()
+            elapsed = min(
+                timeit.repeat(lambda: edit(uri, i), number=1, repeat=10)
+            )
+            print(f"edit file_{i:<14} {elapsed * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Report how much memory the AST of a large generated SLS file uses per node.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_memory.py [--states 5000] [--pkgs 10]
+"""
+
+import argparse
+from dataclasses import fields
+import gc
+import tracemalloc
+from typing import List, Optional, Tuple
+
+from bench_parser import generate_sls
+
+from salt_lsp.parser import AstNode, Parser, Tree
+
+
+def generate_pkgs_sls(states: int, pkgs: int) -> str:
+    """
+    Generate a SLS file with the given number of ``pkg.installed`` states,
+    each installing ``pkgs`` packages.
+    """
+    return "".join(
+        f"packages_{i}:\n"
+        "  pkg.installed:\n"
+        "    - pkgs:\n"
+        + "".join(f"      - package_{i}_{j}\n" for j in range(pkgs))
+        + "\n"
+        for i in range(states)
+    )
+
+
+def count_nodes(node: AstNode) -> int:
+    """
+    Count the node and all its descendants, including the nodes of the
+    parameter values.
+    """
+    count = 1
+    for fld in fields(node):
+        if fld.name == "parent":
+            continue
+        value = getattr(node, fld.name)
+        if isinstance(value, AstNode):
+            count += count_nodes(value)
+        elif isinstance(value, list):
+            count += sum(
+                count_nodes(item)
+                for item in value
+                if isinstance(item, AstNode)
+            )
+    return count
+
+
+def measure(document: str, lazy_values: bool) -> Tuple[Tree, int]:
+    """
+    Parse the document and return the AST with the bytes allocated for it.
+    """
+    # parse once to exclude the memory allocated by the first import of
+    # lazily loaded modules and caches
+    Parser(document, lazy_values=lazy_values).parse()
+    gc.collect()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = Parser(document, lazy_values=lazy_values).parse()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return tree, size
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--states", type=int, default=5000)
+    parser.add_argument(
+        "--pkgs",
+        type=int,
+        default=10,
+        help="packages installed by each of the additional pkg.installed "
+        "states, 0 to not add them",
+    )
+    args = parser.parse_args(argv)
+
+    document = generate_sls(args.states)
+    if args.pkgs:
+        document += generate_pkgs_sls(args.states, args.pkgs)
+
+    tree, eager_size = measure(document, False)
+    _, lazy_size = measure(document, True)
+
+    # counting the nodes builds the lazy values, so count the eager ones
+    nodes = count_nodes(tree)
+    print(f"states:          {args.states}")
+    print(f"nodes:           {nodes}")
+    for name, size in (("eager", eager_size), ("lazy", lazy_size)):
+        print(
+            f"{name + ' values:':<16} {size / 2**20:.1f} MiB, "
+            f"{size / nodes:.0f} bytes per node"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measure listing the SLS modules of a root directory for include completion.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_module_index.py [--files 20000]
+"""
+
+import argparse
+import os
+import tempfile
+import timeit
+from pathlib import Path
+from typing import List, Optional
+
+from salt_lsp.include_graph import ModuleIndex
+from salt_lsp.utils import get_sls_includes
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=20000)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = Path(tmp_dir)
+        (root / "top.sls").write_text("")
+        for i in range(args.files):
+            directory = root / f"formula_{i // 100}" / f"part_{i // 10 % 10}"
+            directory.mkdir(parents=True, exist_ok=True)
+            (directory / f"state_{i}.sls").write_text("")
+        # modified long enough ago for the index to trust them
+        for directory, _, _ in os.walk(root):
+            os.utime(directory, ns=(0, 0))
+        print(f"files:                  {args.files}")
+
+        elapsed = min(
+            timeit.repeat(lambda: get_sls_includes(tmp_dir), number=1)
+        )
+        print(f"walk the root:          {elapsed * 1000:.1f} ms")
+
+        index = ModuleIndex()
+        elapsed = timeit.timeit(lambda: index.modules(tmp_dir), number=1)
+        print(f"build the index:        {elapsed * 1000:.1f} ms")
+        for validate in (True, False):
+            index.validate = validate
+            label = "validated" if validate else "watched"
+            elapsed = min(
+                timeit.repeat(lambda: index.modules(tmp_dir), number=1)
+            )
+            print(f"all modules, {label:<10} {elapsed * 1000:.2f} ms")
+            elapsed = min(
+                timeit.repeat(
+                    lambda: index.modules(tmp_dir, "formula_42.part_3."),
+                    number=1,
+                )
+            )
+            print(f"prefix query, {label:<9} {elapsed * 1000:.3f} ms")
+
+        near = str(root / "formula_42" / "part_3" / "state_4230.sls")
+        elapsed = min(
+            timeit.repeat(
+                lambda: index.modules(tmp_dir, near=near, limit=101),
+                number=1,
+            )
+        )
+        print(f"closest 101 modules:    {elapsed * 1000:.3f} ms")
+
+        new_file = root / "formula_0" / "part_0" / "new.sls"
+        new_file.write_text("")
+        elapsed = timeit.timeit(
+            lambda: index.invalidate(str(new_file)), number=1
+        )
+        print(f"add a file:             {elapsed * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
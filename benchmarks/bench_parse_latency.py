@@ -0,0 +1,89 @@
+"""
+Measure how long the event loop is blocked while a large document is parsed
+and how soon a small document edited at the same time is parsed.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_parse_latency.py [--states 2000]
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from bench_parser import generate_sls
+from lsprotocol.types import (
+    TextDocumentContentChangeEvent_Type2,
+    TextDocumentItem,
+    VersionedTextDocumentIdentifier,
+)
+
+from salt_lsp.base_types import SLS_LANGUAGE_ID
+from salt_lsp.workspace import SlsFileWorkspace
+
+BIG = "file:///srv/salt/big.sls"
+SMALL = "file:///srv/salt/small.sls"
+
+
+async def run(states: int, executor: Optional[ThreadPoolExecutor]) -> None:
+    workspace = SlsFileWorkspace(
+        {}, "file:///srv/salt", parse_executor=executor
+    )
+    for uri, text in ((BIG, generate_sls(states)), (SMALL, generate_sls(2))):
+        workspace.put_text_document(
+            TextDocumentItem(
+                uri=uri, language_id=SLS_LANGUAGE_ID, version=0, text=text
+            )
+        )
+    await workspace.wait_parsed()
+
+    max_stall = 0.0
+    done = False
+
+    async def tick() -> None:
+        nonlocal max_stall
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            max_stall = max(max_stall, time.perf_counter() - start)
+
+    ticker = asyncio.create_task(tick())
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    for uri, text in (
+        (BIG, generate_sls(states + 1)),
+        (SMALL, generate_sls(3)),
+    ):
+        workspace.update_text_document(
+            VersionedTextDocumentIdentifier(uri=uri, version=1),
+            TextDocumentContentChangeEvent_Type2(text=text),
+        )
+    await workspace.wait_parsed(SMALL)
+    small = time.perf_counter() - start
+    await workspace.wait_parsed(BIG)
+    big = time.perf_counter() - start
+    done = True
+    await ticker
+
+    name = "executor" if executor is not None else "inline"
+    print(
+        f"{name:9} small parsed after {small * 1000:7.1f} ms, "
+        f"big after {big * 1000:7.1f} ms, "
+        f"event loop blocked for {max_stall * 1000:7.1f} ms"
+    )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--states", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    asyncio.run(run(args.states, None))
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        asyncio.run(run(args.states, executor))
+
+
+if __name__ == "__main__":
+    main()
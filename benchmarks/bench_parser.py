@@ -0,0 +1,94 @@
+"""
+Compare the libyaml and the pure Python tokenizer backends of the SLS parser
+on large generated SLS files and measure how many tokens per second the parser
+processes once the document has been scanned.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_parser.py [--states 1000 10000] [--repeat 5]
+"""
+
+import argparse
+import timeit
+from typing import List, Optional
+
+import yaml
+
+from salt_lsp.parser import LIBYAML_AVAILABLE, Parser
+
+
+def generate_sls(states: int) -> str:
+    """
+    Generate a SLS file with the given number of ``file.managed`` states.
+    """
+    return "".join(
+        f"state_{i}:\n"
+        "  file.managed:\n"
+        f"    - name: /etc/foo/{i}.conf\n"
+        f"    - source: salt://foo/{i}.conf\n"
+        "    - mode: '0644'\n"
+        "    - require:\n"
+        f"      - pkg: package_{i}\n"
+        f"      - file: /etc/foo/{i - 1}.d\n"
+        "\n"
+        for i in range(states)
+    )
+
+
+def bench(document: str, use_libyaml: bool, repeat: int) -> float:
+    """
+    Return the fastest time it took to parse the document in seconds.
+    """
+    return min(
+        timeit.repeat(
+            lambda: Parser(document, use_libyaml=use_libyaml).parse(),
+            number=1,
+            repeat=repeat,
+        )
+    )
+
+
+def bench_tokens(document: str, repeat: int) -> float:
+    """
+    Return the number of tokens per second processed by the parser, excluding
+    the time spent in the scanner.
+    """
+    tokens = list(yaml.scan(document))
+
+    def process() -> None:
+        parser = Parser(document)
+        for token in tokens:
+            parser._process_token(token)  # pylint: disable=protected-access
+
+    return len(tokens) / min(timeit.repeat(process, number=1, repeat=repeat))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--states", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if not LIBYAML_AVAILABLE:
+        print("PyYAML was built without libyaml, only benchmarking Python")
+
+    print(
+        f"{'states':>8} {'lines':>8} {'tokens/s':>10} {'python':>10} "
+        f"{'libyaml':>10}"
+    )
+    for states in args.states:
+        document = generate_sls(states)
+        python = bench(document, False, args.repeat)
+        tokens = bench_tokens(document, args.repeat)
+        line = (
+            f"{states:>8} {document.count(chr(10)):>8} {tokens:>10.0f} "
+            f"{python:>9.3f}s"
+        )
+        if LIBYAML_AVAILABLE:
+            libyaml = bench(document, True, args.repeat)
+            line += f" {libyaml:>9.3f}s ({python / libyaml:.1f}x)"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Measure the workspace symbol queries on a workspace with about 100k symbols.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_symbols.py [--files 5000] [--states 10]
+"""
+
+import argparse
+import timeit
+from typing import List, Optional
+
+from bench_parser import generate_sls
+
+from salt_lsp.index import WorkspaceSymbolIndex
+from salt_lsp.parser import Parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--files", type=int, default=5000)
+    parser.add_argument("--states", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    trees = [
+        Parser(
+            generate_sls(args.states).replace("state_", f"file_{i}_state_")
+        ).parse()
+        for i in range(args.files)
+    ]
+    index = WorkspaceSymbolIndex()
+    for i, tree in enumerate(trees):
+        index.update(f"file:///srv/salt/file_{i}.sls", tree)
+    elapsed = timeit.timeit(lambda: index.search("nothing"), number=1)
+    print(f"initial indexing: {elapsed * 1000:.1f} ms")
+
+    queries = ("file_4", "file_4711_", "te_5", "_state_7", "le.m", "e", "xyz")
+    for query in queries:
+        # the first query builds the results, the following ones reuse them
+        first = timeit.timeit(lambda: index.search(query), number=1)
+        elapsed = min(
+            timeit.repeat(lambda: index.search(query), number=1, repeat=20)
+        )
+        print(
+            f"query {query!r:14} first {first * 1000:.3f} ms, "
+            f"then {elapsed * 1000:.3f} ms"
+        )
+    print(f"symbols:          {len(index.search('', limit=10**9))}")
+
+    def update() -> None:
+        index.update("file:///srv/salt/file_0.sls", trees[1])
+        index.search("file_0")
+
+    elapsed = min(timeit.repeat(update, number=1, repeat=20))
+    print(f"update and query: {elapsed * 1000:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""
+Measure the lookups of UriDict by URI, path and FileUri.
+
+Run it from the repository root via::
+
+    python benchmarks/bench_uri_dict.py [--uris 5000]
+"""
+
+import argparse
+import timeit
+from typing import List, Optional
+
+from salt_lsp.utils import FileUri, UriDict
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uris", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    paths = [f"/srv/salt/state_{i}/init.sls" for i in range(args.uris)]
+    uris = [f"file://{path}" for path in paths]
+    file_uris = [FileUri(uri) for uri in uris]
+    missing = [f"file:///srv/pillar/pillar_{i}.sls" for i in range(args.uris)]
+    uri_dict: UriDict[int] = UriDict()
+
+    def set_all() -> None:
+        for i, uri in enumerate(uris):
+            uri_dict[uri] = i
+
+    operations = {
+        "set by URI": set_all,
+        "get by URI": lambda: [uri_dict[uri] for uri in uris],
+        "get by path": lambda: [uri_dict[path] for path in paths],
+        "get by FileUri": lambda: [uri_dict[uri] for uri in file_uris],
+        "contains (missing)": lambda: [uri in uri_dict for uri in missing],
+        "get (missing)": lambda: [uri_dict.get(uri) for uri in missing],
+    }
+    for name, operation in operations.items():
+        elapsed = min(timeit.repeat(operation, number=1, repeat=10))
+        print(f"{name:20} {elapsed / args.uris * 1e9:8.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ from typing import Dict
 
 from salt_lsp.server import SaltServer, setup_salt_server_capabilities
 from salt_lsp.base_types import StateNameCompletion
+from salt_lsp.disk_cache import DiskTreeCache
 
 
 LOG_LEVEL_DICT: Dict[str, int] = {
@@ -55,6 +56,35 @@ def add_arguments(parser: argparse.ArgumentParser) -> None:
         nargs=1,
         help="Logging verbosity",
     )
+    parser.add_argument(
+        "--cache-dir",
+        help="Cache the parsed SLS files in this directory instead of "
+        "$XDG_CACHE_HOME/salt_lsp",
+    )
+    parser.add_argument(
+        "--no-disk-cache",
+        action="store_true",
+        help="Do not cache the parsed SLS files on the disk",
+    )
+    parser.add_argument(
+        "--no-index",
+        action="store_true",
+        help="Do not parse all SLS files of the workspace in the background",
+    )
+    parser.add_argument(
+        "--parse-delay",
+        type=int,
+        default=150,
+        help="Parse a changed document once it has not been changed for "
+        "this many milliseconds or when a request needs it",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="Evict the least recently used SLS files that are not open in "
+        "the editor once they take about this many MiB, they are read again "
+        "when they are needed",
+    )
     parser.add_argument(
         "--integration-tests",
         action="store_true",
@@ -81,7 +111,15 @@ def main() -> None:
 
     salt_server = SaltServer()
     setup_salt_server_capabilities(salt_server, log_level)
-    salt_server.post_init(states, log_level, args.integration_tests)
+    salt_server.post_init(
+        states,
+        log_level,
+        args.integration_tests,
+        None if args.no_disk_cache else DiskTreeCache(args.cache_dir),
+        not args.no_index,
+        args.parse_delay / 1000,
+        None if args.memory_budget is None else args.memory_budget * 2**20,
+    )
 
     if args.stop_after_init:
         return
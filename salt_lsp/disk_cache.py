@@ -0,0 +1,187 @@
+"""
+Persistent cache of the Abstract Syntax Trees of the SLS files, so that the
+files do not need to be parsed again every time the server starts.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import os.path
+import pickle
+import sys
+import tempfile
+from typing import IO, Any, Optional
+
+from salt_lsp import __version__, parser
+from salt_lsp.parser import AST_VERSION, Parser, Tree
+
+log = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> str:
+    """
+    Returns the directory of the cache following the XDG base directory
+    specification: ``$XDG_CACHE_HOME/salt_lsp`` or ``~/.cache/salt_lsp``.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME", "")
+    if not os.path.isabs(cache_home):
+        cache_home = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "salt_lsp")
+
+
+def _digest(data: str) -> bytes:
+    return hashlib.blake2b(
+        data.encode("utf-8", "surrogatepass"), digest_size=16
+    ).digest()
+
+
+class _TreePickler(pickle.Pickler):
+    """
+    Pickler storing a reference to the document instead of its content, the
+    lazy parameter values of the tree hold it.
+    """
+
+    def __init__(self: _TreePickler, file: IO[bytes], document: str) -> None:
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._document = document
+
+    def persistent_id(self: _TreePickler, obj: Any) -> Optional[str]:
+        return "document" if obj is self._document else None
+
+
+class _TreeUnpickler(pickle.Unpickler):
+    """
+    Unpickler for the trees pickled by :py:class:`_TreePickler`.
+    """
+
+    def __init__(self: _TreeUnpickler, file: IO[bytes], document: str) -> None:
+        super().__init__(file)
+        self._document = document
+
+    def persistent_load(self: _TreeUnpickler, pid: Any) -> str:
+        if pid != "document":
+            raise pickle.UnpicklingError(f"unknown persistent id {pid!r}")
+        return self._document
+
+
+class DiskTreeCache:
+    """
+    Cache storing the tree of each SLS file in a pickle file.
+
+    An entry is only used if the path, modification time and size of the file
+    as well as the digest of its content match. The entries are stored in a
+    subdirectory per version of the server and of the AST, so that an update
+    never loads trees in an outdated format.
+    """
+
+    def __init__(self: DiskTreeCache, directory: Optional[str] = None) -> None:
+        """
+        :param directory: the base directory of the cache, defaults to
+            :py:func:`default_cache_dir`
+        """
+        self.directory = os.path.join(
+            directory or default_cache_dir(),
+            f"trees-{__version__}-{AST_VERSION}-"
+            f"py{sys.version_info[0]}{sys.version_info[1]}",
+        )
+        #: number of trees loaded from the disk
+        self.hits = 0
+        #: number of trees that had to be parsed
+        self.misses = 0
+
+    def _entry_path(self: DiskTreeCache, path: str) -> str:
+        return os.path.join(self.directory, _digest(path).hex() + ".pickle")
+
+    def load(self: DiskTreeCache, path: str, document: str) -> Optional[Tree]:
+        """
+        Returns the cached tree of the file or None if there is no valid
+        entry for it.
+
+        :param path: the path to the SLS file
+        :param document: the content of the file
+        """
+        try:
+            stat = os.stat(path)
+            with open(self._entry_path(path), "rb") as entry_file:
+                entry = _TreeUnpickler(entry_file, document).load()
+        except FileNotFoundError:
+            return None
+        # a corrupted entry can raise about any exception
+        except Exception as err:  # pylint: disable=broad-except
+            log.debug("Cannot load the cached tree of '%s': %s", path, err)
+            return None
+
+        if entry[:4] != (
+            path,
+            stat.st_mtime_ns,
+            stat.st_size,
+            _digest(document),
+        ):
+            return None
+        return entry[4]
+
+    def store(
+        self: DiskTreeCache, path: str, document: str, tree: Tree
+    ) -> None:
+        """
+        Store the tree of the file, errors are only logged.
+
+        :param path: the path to the SLS file
+        :param document: the content of the file that was parsed
+        :param tree: the AST of the document
+        """
+        try:
+            stat = os.stat(path)
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            entry_file = tempfile.NamedTemporaryFile(
+                dir=self.directory, delete=False
+            )
+            try:
+                with entry_file:
+                    _TreePickler(entry_file, document).dump(
+                        (
+                            path,
+                            stat.st_mtime_ns,
+                            stat.st_size,
+                            _digest(document),
+                            tree,
+                        )
+                    )
+                # replace the entry at once as other servers may read it
+                os.replace(entry_file.name, self._entry_path(path))
+            except BaseException:
+                os.unlink(entry_file.name)
+                raise
+        except (OSError, pickle.PicklingError, RecursionError) as err:
+            log.debug("Cannot cache the tree of '%s': %s", path, err)
+
+    def load_or_parse(self: DiskTreeCache, path: str, document: str) -> Tree:
+        """
+        Returns the tree of the file from the disk or parses it and stores
+        the result.
+
+        :param path: the path to the SLS file
+        :param document: the content of the file
+        """
+        tree = self.load(path, document)
+        if tree is not None:
+            self.hits += 1
+            return tree
+        self.misses += 1
+        tree = Parser(document).parse()
+        self.store(path, document, tree)
+        return tree
+
+    def parse(self: DiskTreeCache, path: str, document: str) -> Tree:
+        """
+        Returns the tree of the file from the in-memory cache of the parser,
+        from the disk or by parsing it, in this order.
+
+        :param path: the path to the SLS file
+        :param document: the content of the file
+        """
+        return parser.PARSE_CACHE.get_or_parse(
+            document, lambda: self.load_or_parse(path, document)
+        )
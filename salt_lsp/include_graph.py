@@ -0,0 +1,645 @@
+"""
+Graph of the includes between the SLS files of the workspace, the
+resolution of the included SLS modules to their files and the index of the
+modules to complete includes.
+"""
+
+from __future__ import annotations
+
+import os
+import os.path
+import time
+from itertools import chain, islice
+from typing import (
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from salt_lsp.parser import IncludeNode
+from salt_lsp.utils import FileUri, canonical_uri
+
+#: the directories modified within this many nanoseconds are not trusted
+_RACY_NS = 1_000_000_000
+
+
+def _unique(uris: Iterable[str]) -> List[str]:
+    """
+    Returns the URIs without duplicates, keeping the first occurrences.
+    """
+    return list(dict.fromkeys(uris))
+
+
+class IncludeGraph(Mapping[Union[str, FileUri], List[FileUri]]):
+    """
+    Directed graph of the includes with forward and reverse edges.
+
+    Maps the URI of every document whose includes were set to the transitive
+    closure of its includes: its direct includes first, followed by the
+    includes of each of them in turn. The closures are computed on demand and
+    memoized. Changing the includes of a document only invalidates the
+    closures of the documents including it, found along the reverse edges.
+
+    Include cycles are allowed, the documents of a cycle include each other
+    but never themselves.
+    """
+
+    def __init__(self: IncludeGraph) -> None:
+        #: the direct includes of each document
+        self._forward: Dict[str, List[str]] = {}
+        #: the documents directly including each document
+        self._reverse: Dict[str, Set[str]] = {}
+        #: the memoized transitive closures, the closure of a document is
+        #: only memoized together with the closures of all its includes
+        self._closures: Dict[str, List[str]] = {}
+        #: the closures as FileUris, built when they are first looked up
+        self._closure_uris: Dict[str, List[FileUri]] = {}
+        #: the documents of the include cycle of each memoized document
+        self._cycles: Dict[str, List[str]] = {}
+        self._file_uris: Dict[str, FileUri] = {}
+
+    def set_includes(
+        self: IncludeGraph,
+        uri: Union[str, FileUri],
+        includes: Iterable[Union[str, FileUri]],
+    ) -> None:
+        """
+        Replace the direct includes of a document.
+        """
+        key = canonical_uri(uri)
+        file_uris = [FileUri(include) for include in includes]
+        new_includes = _unique(str(include) for include in file_uris)
+        for file_uri in file_uris:
+            self._file_uris.setdefault(str(file_uri), file_uri)
+        self._file_uris.setdefault(key, FileUri(uri))
+
+        old_includes = self._forward.get(key)
+        if old_includes == new_includes:
+            return
+        for include in old_includes or ():
+            self._reverse[include].discard(key)
+        for include in new_includes:
+            self._reverse.setdefault(include, set()).add(key)
+        self._forward[key] = new_includes
+        self._invalidate(key)
+
+    def remove(self: IncludeGraph, uri: Union[str, FileUri]) -> None:
+        """
+        Drop the includes of a document, the edges of the documents including
+        it are kept.
+        """
+        key = canonical_uri(uri)
+        for include in self._forward.pop(key, ()):
+            self._reverse[include].discard(key)
+        self._invalidate(key)
+
+    def included_by(self: IncludeGraph, uri: Union[str, FileUri]) -> Set[str]:
+        """
+        Returns the URIs of the documents directly including a document.
+        """
+        return set(self._reverse.get(canonical_uri(uri), ()))
+
+    def cycle(self: IncludeGraph, uri: Union[str, FileUri]) -> List[str]:
+        """
+        Returns the URIs of the documents in the include cycle of a document
+        in alphabetical order, or an empty list if it is not part of one.
+        """
+        key = canonical_uri(uri)
+        if key not in self._forward:
+            return []
+        self._closure(key)
+        return self._cycles.get(key, [])
+
+    def _invalidate(self: IncludeGraph, uri: str) -> None:
+        stack = [uri]
+        while stack:
+            node = stack.pop()
+            if self._closures.pop(node, None) is None:
+                # nothing including it can be memoized either
+                continue
+            self._closure_uris.pop(node, None)
+            self._cycles.pop(node, None)
+            stack.extend(self._reverse.get(node, ()))
+
+    def _closure(self: IncludeGraph, uri: str) -> List[str]:
+        if (closure := self._closures.get(uri)) is None:
+            self._compute(uri)
+            closure = self._closures[uri]
+        return closure
+
+    def _compute(self: IncludeGraph, root: str) -> None:
+        """
+        Memoize the closures of the document and of all its includes.
+
+        This is Tarjan's algorithm for strongly connected components, the
+        documents of a component, i.e. of an include cycle, include the same
+        documents. The depth first search is iterative, as include chains can
+        be longer than the recursion limit.
+        """
+        index: Dict[str, int] = {}
+        low: Dict[str, int] = {}
+        components: List[str] = []
+        on_stack: Set[str] = set()
+        dfs: List[Tuple[str, Iterator[str]]] = []
+
+        def visit(node: str) -> None:
+            index[node] = low[node] = len(index)
+            components.append(node)
+            on_stack.add(node)
+            dfs.append((node, iter(self._forward.get(node, ()))))
+
+        visit(root)
+        while dfs:
+            node, includes = dfs[-1]
+            for include in includes:
+                if include in self._closures:
+                    continue
+                if include not in index:
+                    visit(include)
+                    break
+                if include in on_stack:
+                    low[node] = min(low[node], index[include])
+            else:
+                dfs.pop()
+                if dfs:
+                    parent = dfs[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    members = [components.pop()]
+                    while members[-1] != node:
+                        members.append(components.pop())
+                    on_stack.difference_update(members)
+                    self._memoize(members[::-1])
+
+    def _memoize(self: IncludeGraph, members: List[str]) -> None:
+        """
+        Memoize the closures of the documents of a strongly connected
+        component, once the closures of all the documents that it includes
+        are memoized.
+        """
+        if len(members) == 1 and members[0] not in self._forward.get(
+            members[0], ()
+        ):
+            node = members[0]
+            includes = self._forward.get(node, [])
+            self._closures[node] = _unique(
+                chain(
+                    includes,
+                    *(self._closures[include] for include in includes),
+                )
+            )
+            return
+
+        in_cycle = set(members)
+        reachable = _unique(
+            chain.from_iterable(
+                chain(
+                    self._forward.get(member, ()),
+                    *(
+                        self._closures[include]
+                        for include in self._forward.get(member, ())
+                        if include not in in_cycle
+                    ),
+                )
+                for member in members
+            )
+        )
+        cycle = sorted(members)
+        for member in members:
+            self._closures[member] = [
+                uri
+                for uri in _unique(
+                    chain(self._forward.get(member, ()), reachable)
+                )
+                if uri != member
+            ]
+            self._cycles[member] = cycle
+
+    def __getitem__(
+        self: IncludeGraph, uri: Union[str, FileUri]
+    ) -> List[FileUri]:
+        key = canonical_uri(uri)
+        if key not in self._forward:
+            raise KeyError(uri)
+        if (closure := self._closure_uris.get(key)) is None:
+            closure = self._closure_uris[key] = [
+                self._file_uris[include] for include in self._closure(key)
+            ]
+        return closure
+
+    def __iter__(self: IncludeGraph) -> Iterator[str]:
+        return iter(self._forward)
+
+    def __len__(self: IncludeGraph) -> int:
+        return len(self._forward)
+
+
+def _mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class IncludeResolver:
+    """
+    Cache of the files that the included SLS modules resolve to, per top
+    directory.
+
+    Without validation, the cached files are only dropped by
+    :py:meth:`invalidate`, which must be called for every created, changed or
+    deleted file, e.g. on ``workspace/didChangeWatchedFiles`` notifications.
+    Resolving a cached module then does not touch the file system at all.
+    With validation, a cached file is only used while the modification times
+    of the two directories that the module can resolve in are unchanged.
+    """
+
+    def __init__(self: IncludeResolver, validate: bool = True) -> None:
+        #: whether the cached files are checked against the directories
+        self.validate = validate
+        #: the top directory of each top path
+        self._top_dirs: Dict[str, str] = {}
+        #: the file of each module and the modification times of its
+        #: directories, by the top directory
+        self._files: Dict[
+            str,
+            Dict[str, Tuple[Optional[str], Tuple[Optional[int], ...]]],
+        ] = {}
+
+    def _top_dir(self: IncludeResolver, top_path: str) -> str:
+        if (top_dir := self._top_dirs.get(top_path)) is None:
+            abs_top_path = os.path.abspath(top_path)
+            top_dir = self._top_dirs[top_path] = (
+                abs_top_path
+                if os.path.isdir(abs_top_path)
+                else os.path.dirname(abs_top_path)
+            )
+        return top_dir
+
+    @staticmethod
+    def _mtimes(top_dir: str, module: str) -> Tuple[Optional[int], ...]:
+        # module.sls and module/init.sls are in these directories
+        dest = os.path.join(top_dir, *module.split("."))
+        return _mtime(os.path.dirname(dest)), _mtime(dest)
+
+    def resolve(
+        self: IncludeResolver, top_path: str, module: Optional[str]
+    ) -> Optional[str]:
+        """
+        Returns the path of the file of an included module like
+        :py:meth:`IncludeNode.get_file` does.
+
+        :param top_path: the path to the top states folder or to a file in it
+        :param module: the dotted name of the included module
+        """
+        if module is None:
+            return None
+        top_dir = self._top_dir(top_path)
+        files = self._files.setdefault(top_dir, {})
+        if (cached := files.get(module)) is not None and (
+            not self.validate or cached[1] == self._mtimes(top_dir, module)
+        ):
+            return cached[0]
+
+        # read the modification times first, so that a change made while
+        # resolving the file is noticed by the next call
+        mtimes = self._mtimes(top_dir, module) if self.validate else ()
+        path = IncludeNode(value=module).get_file(top_dir)
+        # the timestamps of the file system are coarse, so a directory that
+        # was just modified can be modified again without changing its time
+        racy = time.time_ns() - _RACY_NS
+        if all(mtime is None or mtime < racy for mtime in mtimes):
+            files[module] = (path, mtimes)
+        return path
+
+    def invalidate(self: IncludeResolver, path: str) -> None:
+        """
+        Drop the cached files that a created, changed or deleted file or
+        directory may affect.
+        """
+        for top_dir, files in self._files.items():
+            if not path.startswith(top_dir + os.sep):
+                continue
+            relpath = os.path.relpath(path, top_dir)
+            module, ext = os.path.splitext(relpath)
+            if ext == ".sls":
+                if os.path.basename(module) == "init":
+                    module = os.path.dirname(module)
+                files.pop(module.replace(os.sep, "."), None)
+                continue
+            parts = relpath.split(os.sep)
+            if os.path.isfile(path) or any("." in part for part in parts):
+                # the dotted names of the modules do not lead below it
+                continue
+            # a created or deleted directory with any number of modules in it
+            prefix = ".".join(parts)
+            for module in [
+                module
+                for module in files
+                if module == prefix or module.startswith(prefix + ".")
+            ]:
+                del files[module]
+
+    def clear(self: IncludeResolver) -> None:
+        """
+        Drop all cached files.
+        """
+        self._top_dirs.clear()
+        self._files.clear()
+
+
+#: the path of a directory or the dotted name of a module as components
+_Parts = Tuple[str, ...]
+
+
+class _ModuleNode:
+    __slots__ = ("children", "files")
+
+    def __init__(self: _ModuleNode) -> None:
+        self.children: Dict[str, _ModuleNode] = {}
+        #: number of files of the module, module.sls and module/init.sls
+        self.files = 0
+
+
+class _RootModules:
+    """
+    The modules of a root directory in a trie of their dotted components and
+    the scanned directories.
+    """
+
+    def __init__(self: _RootModules, root: str) -> None:
+        self.root = root
+        self.trie = _ModuleNode()
+        #: the modification time, the modules of the SLS files and the
+        #: subdirectories of each scanned directory, the modification time
+        #: is None while it cannot be trusted
+        self.dirs: Dict[
+            _Parts, Tuple[Optional[int], Set[_Parts], Set[str]]
+        ] = {}
+
+    def _add_module(self: _RootModules, module: _Parts) -> None:
+        node = self.trie
+        for part in module:
+            node = node.children.setdefault(part, _ModuleNode())
+        node.files += 1
+
+    def _remove_module(self: _RootModules, module: _Parts) -> None:
+        nodes = [self.trie]
+        for part in module:
+            nodes.append(nodes[-1].children[part])
+        nodes[-1].files -= 1
+        # prune the nodes that lead to no module anymore
+        for part, parent, node in zip(
+            reversed(module), reversed(nodes[:-1]), reversed(nodes)
+        ):
+            if node.files or node.children:
+                break
+            del parent.children[part]
+
+    def _drop(self: _RootModules, directory: _Parts) -> None:
+        _, modules, subdirs = self.dirs.pop(directory, (None, set(), set()))
+        for module in modules:
+            self._remove_module(module)
+        for name in subdirs:
+            self._drop(directory + (name,))
+
+    def scan(self: _RootModules, directory: _Parts) -> None:
+        """
+        Update the modules of a directory and of its new subdirectories.
+        """
+        path = os.path.join(self.root, *directory)
+        # read the modification time first, so that a change made while
+        # scanning the directory is noticed by the next validation
+        mtime = _mtime(path)
+        modules: Set[_Parts] = set()
+        subdirs: Set[str] = set()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.add(entry.name)
+                    elif entry.name.endswith(".sls"):
+                        module = (
+                            directory + (entry.name[:-4],)
+                            if entry.name != "init.sls"
+                            else directory
+                        )
+                        if module:
+                            modules.add(module)
+        except OSError:
+            # the directory is gone
+            mtime = None
+            modules.clear()
+            subdirs.clear()
+
+        _, old_modules, old_subdirs = self.dirs.pop(
+            directory, (None, set(), set())
+        )
+        for module in old_modules - modules:
+            self._remove_module(module)
+        for module in modules - old_modules:
+            self._add_module(module)
+        for name in old_subdirs - subdirs:
+            self._drop(directory + (name,))
+        if mtime is None:
+            return
+        if mtime >= time.time_ns() - _RACY_NS:
+            mtime = None
+        self.dirs[directory] = (mtime, modules, subdirs)
+        for name in subdirs - old_subdirs:
+            self.scan(directory + (name,))
+
+    def validate(self: _RootModules, directory: _Parts) -> None:
+        """
+        Scan the directory, its parents and its subdirectories again if they
+        changed.
+        """
+        for parts, (mtime, _, _) in list(self.dirs.items()):
+            if (
+                (
+                    parts[: len(directory)] == directory
+                    or directory[: len(parts)] == parts
+                )
+                and parts in self.dirs
+                and (
+                    mtime is None
+                    or mtime != _mtime(os.path.join(self.root, *parts))
+                )
+            ):
+                self.scan(parts)
+
+    def invalidate(self: _RootModules, parts: _Parts) -> None:
+        """
+        Scan the closest known directory of a created or deleted path again.
+        """
+        directory = parts[:-1]
+        while directory and directory not in self.dirs:
+            directory = directory[:-1]
+        if directory in self.dirs:
+            self.scan(directory)
+
+    def _children(
+        self: _RootModules,
+        node: _ModuleNode,
+        module: _Parts,
+        partial: str = "",
+        skip: Optional[str] = None,
+    ) -> Iterator[str]:
+        """
+        Yields the modules below a node in alphabetical order, only below the
+        children whose names start with partial and not below skip.
+        """
+        stack = [
+            (module + (name,), node.children[name])
+            for name in sorted(node.children, reverse=True)
+            if name.startswith(partial) and name != skip
+        ]
+        while stack:
+            parts, node = stack.pop()
+            if node.files:
+                yield ".".join(parts)
+            stack.extend(
+                (parts + (name,), node.children[name])
+                for name in sorted(node.children, reverse=True)
+            )
+
+    def _node(self: _RootModules, module: _Parts) -> Optional[_ModuleNode]:
+        node: Optional[_ModuleNode] = self.trie
+        for part in module:
+            if node is None:
+                break
+            node = node.children.get(part)
+        return node
+
+    def find(
+        self: _RootModules, prefix: str, directory: _Parts
+    ) -> Iterator[str]:
+        """
+        Yields the modules starting with the prefix, the modules below the
+        directory first, then those below each of its parents in turn.
+        Modules at the same distance are in alphabetical order.
+        """
+        *complete, partial = prefix.split(".")
+        start = tuple(complete)
+        for depth in range(len(directory), -1, -1):
+            parent = directory[:depth]
+            # the modules below it were yielded for the previous depth
+            skip = directory[depth] if depth < len(directory) else None
+            if depth <= len(start):
+                if start[:depth] != parent:
+                    continue
+                if depth < len(start):
+                    if skip == start[depth]:
+                        continue
+                    skip = None
+                if (node := self._node(start)) is None:
+                    return
+                yield from self._children(node, start, partial, skip)
+            elif (
+                parent[: len(start)] == start
+                and parent[len(start)].startswith(partial)
+                and (node := self._node(parent)) is not None
+            ):
+                if node.files:
+                    yield ".".join(parent)
+                yield from self._children(node, parent, "", skip)
+
+
+class ModuleIndex:
+    """
+    Index of the dotted names of the SLS modules of root directories for the
+    completion of includes.
+
+    The modules of a root directory are scanned on its first query and kept
+    in a trie of their components, which answers prefix queries. Without
+    validation, the index is only updated by :py:meth:`invalidate`, which
+    must be called for every created or deleted file or directory, e.g. on
+    ``workspace/didChangeWatchedFiles`` notifications. With validation, the
+    directories that a query can find modules in are scanned again when
+    their modification times changed.
+    """
+
+    def __init__(self: ModuleIndex, validate: bool = True) -> None:
+        #: whether the directories are checked for changes on every query
+        self.validate = validate
+        #: the modules of each root directory
+        self._roots: Dict[str, _RootModules] = {}
+
+    def modules(
+        self: ModuleIndex,
+        root: str,
+        prefix: str = "",
+        near: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[str]:
+        """
+        Returns the dotted names of the modules of a root directory in
+        alphabetical order, like :py:func:`salt_lsp.utils.get_sls_includes`
+        does.
+
+        :param root: the top directory or the root of the git repository
+        :param prefix: only the modules starting with it are returned
+        :param near: the path of a file in the root, the modules in its
+            directory come first, then those in each of its parents in turn,
+            the module of the file itself is left out
+        :param limit: the maximum number of modules to return
+        """
+        root = os.path.abspath(root)
+        if (root_modules := self._roots.get(root)) is None:
+            root_modules = self._roots[root] = _RootModules(root)
+            root_modules.scan(())
+        elif self.validate:
+            root_modules.validate(tuple(prefix.split(".")[:-1]))
+
+        directory: _Parts = ()
+        own_module = None
+        if near is not None and os.path.abspath(near).startswith(
+            root + os.sep
+        ):
+            *dirs, name = os.path.relpath(near, root).split(os.sep)
+            directory = tuple(dirs)
+            own_module = ".".join(
+                dirs
+                if name == "init.sls"
+                else (*dirs, os.path.splitext(name)[0])
+            )
+        return list(
+            islice(
+                (
+                    module
+                    for module in root_modules.find(prefix, directory)
+                    if module != own_module
+                ),
+                limit,
+            )
+        )
+
+    def invalidate(self: ModuleIndex, path: str) -> None:
+        """
+        Update the modules that a created, changed or deleted file or
+        directory may affect.
+        """
+        for root, root_modules in self._roots.items():
+            if not path.startswith(root + os.sep):
+                continue
+            parts = tuple(os.path.relpath(path, root).split(os.sep))
+            # a deleted directory can only be told from a file if it was
+            # scanned
+            if (
+                path.endswith(".sls")
+                or parts in root_modules.dirs
+                or os.path.isdir(path)
+            ):
+                root_modules.invalidate(parts)
+
+    def clear(self: ModuleIndex) -> None:
+        """
+        Drop all scanned root directories.
+        """
+        self._roots.clear()
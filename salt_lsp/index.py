@@ -0,0 +1,463 @@
+"""
+Indexes over the symbols of all documents in the workspace.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, insort
+from dataclasses import replace
+from itertools import islice
+from typing import (
+    Collection,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+
+from lsprotocol import types
+
+from salt_lsp.parser import AstNode, RequisiteNode, Tree
+from salt_lsp.utils import FileUri, ast_node_to_range, canonical_uri
+
+#: maximum number of symbols returned by a workspace symbol query
+MAX_WORKSPACE_SYMBOLS = 100
+
+#: number of names above which the sorted names are rebuilt instead of being
+#: updated one by one
+_BULK_CHANGE = 64
+
+#: a substring query whose rarest trigram is in more than one of this many
+#: names scans all names in order until it has enough matches instead of
+#: sorting the names that contain all of its trigrams
+_DENSE_TRIGRAM = 16
+
+
+class _Symbol(NamedTuple):
+    name: str
+    kind: types.SymbolKind
+    range: types.Range
+    container: Optional[str]
+
+
+def _tree_symbols(tree: Tree) -> Dict[str, List[_Symbol]]:
+    """
+    Returns the state IDs, state calls and includes of the tree by their name
+    in lower case.
+
+    Only the ranges of the nodes are kept, so that the index does not keep
+    the tree alive once the workspace drops it.
+    """
+    symbols: Dict[str, List[_Symbol]] = {}
+
+    def add(
+        name: str,
+        kind: types.SymbolKind,
+        node: AstNode,
+        container: Optional[str] = None,
+    ) -> None:
+        if (lsp_range := ast_node_to_range(node)) is not None:
+            symbols.setdefault(name.lower(), []).append(
+                _Symbol(name, kind, lsp_range, container)
+            )
+
+    if tree.includes is not None:
+        for include in tree.includes.includes:
+            if include.value:
+                add(include.value, types.SymbolKind.String, include)
+    for identifier, states in tree.state_ids.items():
+        for state in states:
+            add(identifier, types.SymbolKind.Object, state)
+            for call in state.states:
+                if call.name:
+                    add(call.name, types.SymbolKind.Object, call, identifier)
+    return symbols
+
+
+def _trigrams(name: str) -> Set[str]:
+    return {name[i : i + 3] for i in range(len(name) - 2)}
+
+
+def _short_grams(trigram: str) -> Set[str]:
+    return {
+        trigram[i:j] for i in range(3) for j in range(i + 1, min(i + 3, 4))
+    }
+
+
+class WorkspaceSymbolIndex:
+    """
+    Index of the state IDs, state calls and includes of all documents for
+    ``workspace/symbol`` requests.
+
+    The distinct names are kept sorted for prefix queries and in a trigram
+    index for substring queries. Both are only touched for the names that
+    appear in or disappear from the workspace. Updated documents are indexed
+    on the next query, so that editing a document does not pay for it.
+
+    The results of each name are built up to the limit on their first query
+    and kept until the name changes, so that refining a query does not build
+    them again.
+    """
+
+    def __init__(self: WorkspaceSymbolIndex) -> None:
+        #: symbols of each name in lower case, by the URI of their document
+        self._symbols: Dict[str, Dict[str, List[_Symbol]]] = {}
+        #: the number of symbols of each name
+        self._counts: Dict[str, int] = {}
+        #: the names of each indexed document
+        self._names: Dict[str, Set[str]] = {}
+        #: all names in lower case
+        self._sorted_names: List[str] = []
+        #: the names containing each trigram
+        self._trigrams: Dict[str, Set[str]] = {}
+        #: the trigrams containing each string of one or two characters
+        self._short_grams: Dict[str, Set[str]] = {}
+        #: the names that are too short to have a trigram
+        self._short_names: Set[str] = set()
+        #: the results of the names that were queried
+        self._results: Dict[str, List[types.SymbolInformation]] = {}
+        #: trees that have not been indexed yet, None for removed documents
+        self._pending: Dict[str, Optional[Tree]] = {}
+        #: names that are not yet in or still in the sorted names
+        self._added: Set[str] = set()
+        self._removed: Set[str] = set()
+
+    def update(
+        self: WorkspaceSymbolIndex, uri: Union[str, FileUri], tree: Tree
+    ) -> None:
+        """
+        Index the tree of a document, replacing its previous symbols.
+        """
+        self._pending[canonical_uri(uri)] = tree
+
+    def remove(self: WorkspaceSymbolIndex, uri: Union[str, FileUri]) -> None:
+        """
+        Drop the symbols of a document.
+        """
+        self._pending[canonical_uri(uri)] = None
+
+    def flush(self: WorkspaceSymbolIndex, uri: Union[str, FileUri]) -> None:
+        """
+        Index the pending tree of a document right away, so that the index
+        does not keep it alive.
+        """
+        key = canonical_uri(uri)
+        if key in self._pending:
+            self._index(key, self._pending.pop(key))
+
+    def _add_name(self: WorkspaceSymbolIndex, name: str) -> None:
+        if name in self._removed:
+            self._removed.discard(name)
+        else:
+            self._added.add(name)
+        if len(name) < 3:
+            self._short_names.add(name)
+        for trigram in _trigrams(name):
+            if trigram not in self._trigrams:
+                self._trigrams[trigram] = set()
+                for gram in _short_grams(trigram):
+                    self._short_grams.setdefault(gram, set()).add(trigram)
+            self._trigrams[trigram].add(name)
+
+    def _remove_name(self: WorkspaceSymbolIndex, name: str) -> None:
+        if name in self._added:
+            self._added.discard(name)
+        else:
+            self._removed.add(name)
+        self._short_names.discard(name)
+        for trigram in _trigrams(name):
+            names = self._trigrams[trigram]
+            names.discard(name)
+            if not names:
+                del self._trigrams[trigram]
+                for gram in _short_grams(trigram):
+                    trigrams = self._short_grams[gram]
+                    trigrams.discard(trigram)
+                    if not trigrams:
+                        del self._short_grams[gram]
+
+    def _index(
+        self: WorkspaceSymbolIndex, uri: str, tree: Optional[Tree]
+    ) -> None:
+        symbols = _tree_symbols(tree) if tree is not None else {}
+        old_names = self._names.pop(uri, set())
+        for name in old_names.union(symbols):
+            self._results.pop(name, None)
+        for name in old_names.difference(symbols):
+            by_uri = self._symbols[name]
+            self._counts[name] -= len(by_uri.pop(uri))
+            if not by_uri:
+                del self._symbols[name]
+                del self._counts[name]
+                self._remove_name(name)
+        for name, name_symbols in symbols.items():
+            if name not in self._symbols:
+                self._symbols[name] = {}
+                self._counts[name] = 0
+                self._add_name(name)
+            old_symbols = self._symbols[name].get(uri, ())
+            self._counts[name] += len(name_symbols) - len(old_symbols)
+            self._symbols[name][uri] = name_symbols
+        if symbols:
+            self._names[uri] = set(symbols)
+
+    def _flush(self: WorkspaceSymbolIndex) -> None:
+        """
+        Index the pending trees.
+        """
+        pending, self._pending = self._pending, {}
+        for uri, tree in pending.items():
+            self._index(uri, tree)
+
+        # a few names are inserted one by one, many at once, e.g. when the
+        # workspace has just been indexed
+        if len(self._removed) > _BULK_CHANGE:
+            self._sorted_names = [
+                name
+                for name in self._sorted_names
+                if name not in self._removed
+            ]
+        else:
+            for name in self._removed:
+                del self._sorted_names[bisect_left(self._sorted_names, name)]
+        if len(self._added) > _BULK_CHANGE:
+            self._sorted_names.extend(self._added)
+            self._sorted_names.sort()
+        else:
+            for name in self._added:
+                insort(self._sorted_names, name)
+        self._added.clear()
+        self._removed.clear()
+
+    def _matching_names(
+        self: WorkspaceSymbolIndex, query: str, limit: int
+    ) -> List[str]:
+        """
+        Returns the names starting with the query in alphabetical order
+        followed by the other names containing it in alphabetical order,
+        until the names have at least ``limit`` symbols.
+        """
+        names: List[str] = []
+        count = 0
+
+        def add(name: str) -> None:
+            nonlocal count
+            names.append(name)
+            count += self._counts[name]
+
+        i = bisect_left(self._sorted_names, query)
+        while (
+            count < limit
+            and i < len(self._sorted_names)
+            and self._sorted_names[i].startswith(query)
+        ):
+            add(self._sorted_names[i])
+            i += 1
+
+        if count >= limit or not query:
+            return names
+        for name in self._substring_candidates(query):
+            if count >= limit:
+                break
+            if query in name and not name.startswith(query):
+                add(name)
+        return names
+
+    def _substring_candidates(
+        self: WorkspaceSymbolIndex, query: str
+    ) -> Iterable[str]:
+        """
+        Returns the names that may contain the query in alphabetical order.
+
+        Many names may contain the query, so all names are scanned in order
+        until there are enough matches, unless its trigrams are rare.
+        """
+        dense = len(self._sorted_names) // _DENSE_TRIGRAM
+        if len(query) >= 3:
+            smallest, *others = sorted(
+                (
+                    self._trigrams.get(trigram, set())
+                    for trigram in _trigrams(query)
+                ),
+                key=len,
+            )
+            if len(smallest) > dense:
+                return self._sorted_names
+            return sorted(smallest.intersection(*others))
+
+        # all names of a trigram containing the query contain it as well, a
+        # name may be counted for several trigrams before the scan is chosen
+        trigrams = [
+            self._trigrams[trigram]
+            for trigram in self._short_grams.get(query, ())
+        ]
+        if sum(map(len, trigrams)) > dense:
+            return self._sorted_names
+        matches = {name for name in self._short_names if query in name}
+        return sorted(matches.union(*trigrams))
+
+    def _name_results(
+        self: WorkspaceSymbolIndex, name: str, limit: int
+    ) -> List[types.SymbolInformation]:
+        """
+        Returns the first ``limit`` results of a name, or all of them.
+        """
+        results = self._results.get(name, [])
+        if len(results) < min(limit, self._counts[name]):
+            symbols: Iterable[Tuple[str, _Symbol]] = (
+                (uri, symbol)
+                for uri, symbols in self._symbols[name].items()
+                for symbol in symbols
+            )
+            if self._counts[name] > limit:
+                symbols = islice(symbols, limit)
+            results = self._results[name] = [
+                types.SymbolInformation(
+                    name=symbol.name,
+                    kind=symbol.kind,
+                    location=types.Location(uri=uri, range=symbol.range),
+                    container_name=symbol.container,
+                )
+                for uri, symbol in symbols
+            ]
+        return results[:limit]
+
+    def search(
+        self: WorkspaceSymbolIndex,
+        query: str,
+        limit: int = MAX_WORKSPACE_SYMBOLS,
+    ) -> List[types.SymbolInformation]:
+        """
+        Returns the symbols whose name contains the query, ignoring the case.
+        Names starting with the query come first.
+
+        :param query: the text to search for, an empty query matches all
+            symbols
+        :param limit: the maximum number of symbols to return
+        """
+        self._flush()
+
+        result: List[types.SymbolInformation] = []
+        for name in self._matching_names(query.lower(), limit):
+            result.extend(self._name_results(name, limit - len(result)))
+        return result
+
+
+def _tree_requisites(
+    tree: Tree,
+) -> Dict[str, Dict[Optional[str], List[RequisiteNode]]]:
+    """
+    Returns the requisites of the tree by their reference and module.
+
+    The requisites are detached copies without a parent, so that the index
+    does not keep the tree alive once the workspace drops it.
+    """
+    requisites: Dict[str, Dict[Optional[str], List[RequisiteNode]]] = {}
+    for state in tree.states:
+        for call in state.states:
+            for requisites_node in call.requisites:
+                for requisite in requisites_node.requisites:
+                    if requisite.reference is None:
+                        continue
+                    requisites.setdefault(requisite.reference, {}).setdefault(
+                        requisite.module, []
+                    ).append(replace(requisite, parent=None))
+    return requisites
+
+
+class RequisiteIndex:
+    """
+    Reverse index from the target of each requisite, its reference and
+    module, to the requisites referring to it in all documents.
+
+    Like the :class:`WorkspaceSymbolIndex`, updated documents are indexed on
+    the next lookup and only the entries of those documents are replaced.
+    """
+
+    def __init__(self: RequisiteIndex) -> None:
+        #: the requisites by their reference, module and document URI
+        self._requisites: Dict[
+            str, Dict[Optional[str], Dict[str, List[RequisiteNode]]]
+        ] = {}
+        #: the references and modules of each indexed document
+        self._keys: Dict[str, Set[Tuple[str, Optional[str]]]] = {}
+        #: trees that have not been indexed yet, None for removed documents
+        self._pending: Dict[str, Optional[Tree]] = {}
+
+    def update(
+        self: RequisiteIndex, uri: Union[str, FileUri], tree: Tree
+    ) -> None:
+        """
+        Index the requisites of a document, replacing its previous ones.
+        """
+        self._pending[canonical_uri(uri)] = tree
+
+    def remove(self: RequisiteIndex, uri: Union[str, FileUri]) -> None:
+        """
+        Drop the requisites of a document.
+        """
+        self._pending[canonical_uri(uri)] = None
+
+    def flush(self: RequisiteIndex, uri: Union[str, FileUri]) -> None:
+        """
+        Index the pending tree of a document right away, so that the index
+        does not keep it alive.
+        """
+        key = canonical_uri(uri)
+        if key in self._pending:
+            self._index(key, self._pending.pop(key))
+
+    def _index(self: RequisiteIndex, uri: str, tree: Optional[Tree]) -> None:
+        for reference, module in self._keys.pop(uri, set()):
+            by_module = self._requisites[reference]
+            by_uri = by_module[module]
+            del by_uri[uri]
+            if not by_uri:
+                del by_module[module]
+                if not by_module:
+                    del self._requisites[reference]
+
+        if tree is None:
+            return
+        keys = set()
+        for reference, tree_modules in _tree_requisites(tree).items():
+            for module, requisites in tree_modules.items():
+                self._requisites.setdefault(reference, {}).setdefault(
+                    module, {}
+                )[uri] = requisites
+                keys.add((reference, module))
+        if keys:
+            self._keys[uri] = keys
+
+    def _flush(self: RequisiteIndex) -> None:
+        pending, self._pending = self._pending, {}
+        for uri, tree in pending.items():
+            self._index(uri, tree)
+
+    def find(
+        self: RequisiteIndex,
+        reference: str,
+        modules: Optional[Collection[Optional[str]]] = None,
+    ) -> List[Tuple[str, RequisiteNode]]:
+        """
+        Returns the requisites referring to a state.
+
+        :param reference: the ID or name of the state
+        :param modules: only return the requisites with one of these modules,
+            ``None`` stands for the requisites without a module like
+            ``- require: [some_id]``, all requisites are returned if not set
+        :return: the URI of the document and the node of each requisite
+        """
+        self._flush()
+
+        result: List[Tuple[str, RequisiteNode]] = []
+        for module, by_uri in self._requisites.get(reference, {}).items():
+            if modules is not None and module not in modules:
+                continue
+            for uri, requisites in by_uri.items():
+                result.extend((uri, requisite) for requisite in requisites)
+        return result
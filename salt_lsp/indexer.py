@@ -0,0 +1,246 @@
+"""
+Background indexing of all SLS files in the workspace.
+
+The files are parsed in a pool of worker processes and the resulting trees
+are merged into the workspace on the event loop, so that the requests of the
+editor are still answered while the workspace is indexed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import gc
+import logging
+import multiprocessing
+import os
+import os.path
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from lsprotocol.types import (
+    ProgressToken,
+    WorkDoneProgressBegin,
+    WorkDoneProgressEnd,
+    WorkDoneProgressReport,
+)
+from pygls.progress import Progress
+
+from salt_lsp.disk_cache import DiskTreeCache
+from salt_lsp.parser import Parser, Tree
+from salt_lsp.utils import canonical_uri
+from salt_lsp.workspace import SlsFileWorkspace
+
+log = logging.getLogger(__name__)
+
+#: number of files that a worker parses per job
+CHUNK_SIZE = 32
+
+
+def find_sls_files(roots: Iterable[str]) -> List[str]:
+    """
+    Returns the paths of all SLS files below the given directories, hidden
+    directories like ``.git`` are skipped.
+    """
+    paths: List[str] = []
+    seen: Set[str] = set()
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                if filename.endswith(".sls") and path not in seen:
+                    seen.add(path)
+                    paths.append(path)
+    return paths
+
+
+def _lower_priority() -> None:
+    # the editor's requests to the server take precedence over the indexing
+    if hasattr(os, "nice"):
+        os.nice(10)
+
+
+@contextmanager
+def _paused_gc() -> Iterator[None]:
+    """
+    Pause the cyclic garbage collector, unless it is disabled already.
+
+    Loading or parsing trees allocates many objects that stay alive, each of
+    them would be traversed by the collections of the young generations
+    before ending up in the oldest one. The objects allocated meanwhile are
+    moved to the oldest generation at once instead.
+    """
+    if not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.freeze()
+        gc.unfreeze()
+        gc.enable()
+
+
+def parse_files(
+    paths: List[str], tree_cache: Optional[DiskTreeCache] = None
+) -> List[Tuple[str, str, Tree]]:
+    """
+    Reads and parses the files, this runs in the worker processes.
+
+    The garbage collector is paused for the whole chunk, which more than
+    halves the time to load the trees from the disk cache.
+
+    :param paths: the paths to the SLS files
+    :param tree_cache: the disk cache to load the trees from and to store
+        them in
+    :return: the path, content and tree of every file that could be parsed
+    """
+    with _paused_gc():
+        return _parse_files(paths, tree_cache)
+
+
+def _parse_files(
+    paths: List[str], tree_cache: Optional[DiskTreeCache]
+) -> List[Tuple[str, str, Tree]]:
+    results = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as sls_file:
+                document = sls_file.read(-1)
+            tree = (
+                Parser(document).parse()
+                if tree_cache is None
+                else tree_cache.load_or_parse(path, document)
+            )
+        # a single broken file must not stop the indexing of all others
+        except Exception as err:  # pylint: disable=broad-except
+            log.debug("Cannot index '%s': %s", path, err)
+            continue
+        results.append((path, document, tree))
+    return results
+
+
+class WorkspaceIndexer:
+    """
+    Parses every SLS file in the state trees of the workspace and adds it to
+    the workspace.
+
+    Documents that are already tracked by the workspace, e.g. because they
+    have been opened in the meantime, are left untouched.
+    """
+
+    def __init__(
+        self: WorkspaceIndexer,
+        workspace: SlsFileWorkspace,
+        tree_cache: Optional[DiskTreeCache] = None,
+        progress: Optional[Progress] = None,
+        token: ProgressToken = "salt_lsp/indexing",
+        executor: Optional[Executor] = None,
+    ) -> None:
+        """
+        :param workspace: the workspace to index
+        :param tree_cache: the disk cache used by the workers
+        :param progress: reports the progress to the client if set, the
+            token must have been created already
+        :param token: the work done progress token
+        :param executor: the executor running the workers, defaults to a
+            process pool that is shut down once the indexing is finished
+        """
+        self._workspace = workspace
+        self._tree_cache = tree_cache
+        self._progress = progress
+        self._token = token
+        self._executor = executor
+
+    def _report(self: WorkspaceIndexer, done: int, total: int) -> None:
+        if self._progress is not None:
+            self._progress.report(
+                self._token,
+                WorkDoneProgressReport(
+                    message=f"{done}/{total} files",
+                    percentage=done * 100 // max(total, 1),
+                ),
+            )
+
+    async def _merge(
+        self: WorkspaceIndexer, results: List[Tuple[str, str, Tree]]
+    ) -> List[str]:
+        indexed = []
+        for path, document, tree in results:
+            uri = canonical_uri(path)
+            if self._workspace.put_indexed_document(uri, document, tree):
+                indexed.append(uri)
+            # let the requests of the editor through between the documents
+            await asyncio.sleep(0)
+        return indexed
+
+    async def run(self: WorkspaceIndexer) -> int:
+        """
+        Indexes the workspace.
+
+        :return: the number of documents that were added to the workspace
+        """
+        if self._progress is not None:
+            self._progress.begin(
+                self._token,
+                WorkDoneProgressBegin(
+                    title="Indexing SLS files", percentage=0
+                ),
+            )
+        loop = asyncio.get_running_loop()
+        indexed: List[str] = []
+        executor = self._executor or ProcessPoolExecutor(
+            # forking a process running an event loop is not safe
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_lower_priority,
+        )
+        try:
+            paths = await loop.run_in_executor(
+                None, find_sls_files, self._workspace.sls_roots
+            )
+            chunks = iter(
+                [
+                    paths[i : i + CHUNK_SIZE]
+                    for i in range(0, len(paths), CHUNK_SIZE)
+                ]
+            )
+            # only submit a few jobs ahead, so that the results do not pile
+            # up and little work is left behind if the task is cancelled
+            max_jobs = 2 * (os.cpu_count() or 1)
+            jobs: Dict[asyncio.Future, int] = {}
+            done = 0
+            while True:
+                while len(jobs) < max_jobs and (chunk := next(chunks, None)):
+                    job = loop.run_in_executor(
+                        executor, parse_files, chunk, self._tree_cache
+                    )
+                    jobs[job] = len(chunk)
+                if not jobs:
+                    break
+
+                finished, _ = await asyncio.wait(
+                    jobs, return_when=asyncio.FIRST_COMPLETED
+                )
+                for job in finished:
+                    done += jobs.pop(job)
+                    indexed += await self._merge(job.result())
+                self._report(done, len(paths))
+
+            # all files below the roots are tracked now, only included files
+            # outside of them are read, in the parse executor
+            for uri in indexed:
+                await self._workspace.resolve_includes(uri)
+                await asyncio.sleep(0)
+        finally:
+            if self._executor is None:
+                executor.shutdown(wait=False)
+            if self._progress is not None:
+                self._progress.end(
+                    self._token,
+                    WorkDoneProgressEnd(
+                        message=f"Indexed {len(indexed)} files"
+                    ),
+                )
+        return len(indexed)
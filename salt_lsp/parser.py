@@ -3,11 +3,33 @@ Module defining and building an AST from the SLS file.
 """
 from __future__ import annotations
 
+import hashlib
 import logging
+import re
+import sys
+import threading
 from abc import ABC, abstractmethod
-from dataclasses import dataclass, field
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from copy import copy
+from dataclasses import dataclass, field, fields
+from itertools import islice
 from os.path import abspath, dirname, exists, isdir, join
-from typing import Any, Callable, List, Optional, Sequence, Tuple, Union, cast
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+    cast,
+)
 
 from lsprotocol import types
 import yaml
@@ -16,9 +38,15 @@ from yaml.tokens import BlockEndToken, ScalarToken
 
 log = logging.getLogger(__name__)
 
+#: True if PyYAML has been built with the bindings to the libyaml C library
+LIBYAML_AVAILABLE = hasattr(yaml, "CBaseLoader")
 
-@dataclass
-class Position:
+#: Version of the AST, to be increased with every change to the nodes or to
+#: the trees the parser builds, as it invalidates the trees cached on the disk
+AST_VERSION = 2
+
+
+class Position(NamedTuple):
     """
     Describes a position in the document
     """
@@ -26,35 +54,75 @@ class Position:
     line: int
     col: int
 
-    def __lt__(self, other):
-        if not isinstance(other, Position):
-            return NotImplemented
-        return (
-            self.line < other.line
-            or self.line == other.line
-            and self.col < other.col
-        )
+    def to_lsp_pos(self) -> types.Position:
+        """Convert this position to pygls' native Position type."""
+        return types.Position(line=self.line, character=self.col)
 
-    def __gt__(self, other):
-        if not isinstance(other, Position):
-            return NotImplemented
-        return (
-            self.line > other.line
-            or self.line == other.line
-            and self.col > other.col
-        )
 
-    def __le__(self, other):
-        return self < other or self == other
+_REQUISITES = (
+    "require",
+    "onchanges",
+    "watch",
+    "listen",
+    "prereq",
+    "onfail",
+    "use",
+)
 
-    def __ge__(self, other):
-        return self > other or self == other
+#: all keywords of the requisites, including the ``_any`` and ``_in`` forms
+_REQUISITES_KEYS = frozenset(
+    _REQUISITES
+    + tuple(k + "_any" for k in _REQUISITES)
+    + tuple(k + "_in" for k in _REQUISITES)
+)
+
+
+def _remove_node(nodes: List[Any], node: AstNode) -> None:
+    """
+    Remove the node from the list, comparing by identity.
+
+    The nodes to remove are usually the last ones that were added, so the list
+    is searched from its end.
+    """
+    for i in range(len(nodes) - 1, -1, -1):
+        if nodes[i] is node:
+            del nodes[i]
+            return
+    raise ValueError(f"{node!r} is not in the list")
+
+
+_T = TypeVar("_T")
 
-    def to_lsp_pos(self) -> types.Position:
-        """Convert this position to pygls' native Position type."""
-        return types.Position(line=self.line, character=self.col)
 
+def _slotted(cls: Type[_T]) -> Type[_T]:
+    """
+    Recreate a dataclass with ``__slots__`` holding its fields, which is what
+    ``dataclass(slots=True)`` does starting with Python 3.10.
 
+    Methods of the slotted classes cannot call ``super()`` without arguments,
+    as it would refer to the class before it got recreated.
+    """
+    inherited = {
+        slot
+        for base in cls.__mro__[1:]
+        for slot in getattr(base, "__slots__", ())
+    }
+    slots = tuple(
+        fld.name for fld in fields(cast(Any, cls)) if fld.name not in inherited
+    )
+    namespace = {
+        key: value
+        for key, value in cls.__dict__.items()
+        if key not in slots and key not in ("__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = slots
+    metaclass: Any = type(cls)
+    slotted = metaclass(cls.__name__, cls.__bases__, namespace)
+    slotted.__qualname__ = cls.__qualname__
+    return cast(Type[_T], slotted)
+
+
+@_slotted
 @dataclass
 class AstNode(ABC):
     """
@@ -78,6 +146,8 @@ class AstMapNode(AstNode, ABC):
     Base class for all nodes that are mappings
     """
 
+    __slots__ = ()
+
     @abstractmethod
     def add(self: AstMapNode) -> AstNode:
         """
@@ -102,6 +172,7 @@ class AstMapNode(AstNode, ABC):
                 child.visit(visitor)
 
 
+@_slotted
 @dataclass
 class IncludeNode(AstNode):
     """
@@ -136,6 +207,7 @@ class IncludeNode(AstNode):
         return None
 
 
+@_slotted
 @dataclass
 class IncludesNode(AstNode):
     """
@@ -152,6 +224,7 @@ class IncludesNode(AstNode):
         return self.includes[-1]
 
 
+@_slotted
 @dataclass
 class StateParameterNode(AstNode):
     """
@@ -168,28 +241,48 @@ class StateParameterNode(AstNode):
 
         :return: the node that finally got the name
         """
-        requisites_keys = [
-            "require",
-            "onchanges",
-            "watch",
-            "listen",
-            "prereq",
-            "onfail",
-            "use",
-        ]
-        all_requisites_keys = (
-            requisites_keys
-            + [k + "_any" for k in requisites_keys]
-            + [k + "_in" for k in requisites_keys]
-        )
-        if key in all_requisites_keys and isinstance(
-            self.parent, StateCallNode
-        ):
+        if key in _REQUISITES_KEYS and isinstance(self.parent, StateCallNode):
             return self.parent.convert(self, key)
         self.name = key
         return self
 
+    def __getstate__(self: StateParameterNode) -> Tuple[None, Dict[str, Any]]:
+        """
+        Pickle the value as is, without building it if it is lazy.
+        """
+        return None, {
+            "start": self.start,
+            "end": self.end,
+            "parent": self.parent,
+            "name": self.name,
+            "value": _PARAMETER_VALUE.__get__(self),
+        }
+
+
+#: the slot storing the value of :py:class:`StateParameterNode`, which may be
+#: a :py:class:`_LazyValue` that is not built yet
+_PARAMETER_VALUE: Any = cast(Any, StateParameterNode).value
+
+
+def _get_parameter_value(node: StateParameterNode) -> Any:
+    """
+    Returns the value of the parameter, building it first if it is lazy.
+    """
+    value = _PARAMETER_VALUE.__get__(node)
+    if isinstance(value, _LazyValue):
+        value = value.build(node)
+        _PARAMETER_VALUE.__set__(node, value)
+    return value
 
+
+setattr(
+    StateParameterNode,
+    "value",
+    property(_get_parameter_value, _PARAMETER_VALUE.__set__),
+)
+
+
+@_slotted
 @dataclass
 class RequisiteNode(AstNode):
     """
@@ -210,6 +303,7 @@ class RequisiteNode(AstNode):
         return self
 
 
+@_slotted
 @dataclass
 class RequisitesNode(AstMapNode):
     """
@@ -245,6 +339,7 @@ class RequisitesNode(AstMapNode):
         return self.requisites
 
 
+@_slotted
 @dataclass
 class StateCallNode(AstMapNode):
     """
@@ -293,7 +388,7 @@ class StateCallNode(AstMapNode):
         """
         Convert a parameter entry to a requisite one
         """
-        self.parameters.remove(param)
+        _remove_node(self.parameters, param)
         self.requisites.append(RequisitesNode(kind=name, parent=self))
         self.requisites[-1].start = param.start
         return self.requisites[-1]
@@ -307,6 +402,7 @@ class StateCallNode(AstMapNode):
         )
 
 
+@_slotted
 @dataclass
 class StateNode(AstMapNode):
     """
@@ -351,6 +447,7 @@ class StateNode(AstMapNode):
         return self.states
 
 
+@_slotted
 @dataclass
 class ExtendNode(AstMapNode):
     """
@@ -375,6 +472,7 @@ class ExtendNode(AstMapNode):
         return self.states
 
 
+@_slotted
 @dataclass
 class Tree(AstMapNode):
     """
@@ -385,6 +483,15 @@ class Tree(AstMapNode):
     extend: Optional[ExtendNode] = None
     states: List[StateNode] = field(default_factory=list)
 
+    #: False if the scanner failed and the tree was built by error recovery
+    complete: bool = field(compare=False, default=True, repr=False)
+
+    #: the state nodes of each ID in the order of the document, more than one
+    #: node means that the ID is declared multiple times
+    state_ids: Dict[str, List[StateNode]] = field(
+        compare=False, default_factory=dict, repr=False
+    )
+
     def add(self: Tree) -> AstNode:
         """
         Add a key token to the tree, the value will come later
@@ -405,7 +512,7 @@ class Tree(AstMapNode):
         :return: the state node if no change was needed or the newly created
             node
         """
-        self.states.remove(state)
+        _remove_node(self.states, state)
 
         if name == "include":
             self.includes = IncludesNode(parent=self)
@@ -418,6 +525,15 @@ class Tree(AstMapNode):
             return self.extend
         return self
 
+    def index_state_ids(self: Tree) -> None:
+        """
+        Build :py:attr:`state_ids` from the states of the tree.
+        """
+        self.state_ids = {}
+        for state in self.states:
+            if state.identifier is not None:
+                self.state_ids.setdefault(state.identifier, []).append(state)
+
     def get_children(self: Tree) -> Sequence[AstNode]:
         """
         Returns all the children nodes
@@ -432,6 +548,7 @@ class Tree(AstMapNode):
         )
 
 
+@_slotted
 @dataclass(init=False, eq=False)
 class TokenNode(AstNode):
     """
@@ -440,13 +557,19 @@ class TokenNode(AstNode):
 
     token: yaml.Token = field(default_factory=lambda: yaml.Token(0, 0))
 
-    def __init__(self: TokenNode, token: yaml.Token) -> None:
-        super().__init__(
-            start=Position(
+    def __init__(
+        self: TokenNode,
+        token: yaml.Token,
+        start: Optional[Position] = None,
+        end: Optional[Position] = None,
+    ) -> None:
+        if start is None:
+            start = Position(
                 line=token.start_mark.line, col=token.start_mark.column
-            ),
-            end=Position(line=token.end_mark.line, col=token.end_mark.column),
-        )
+            )
+        if end is None:
+            end = Position(line=token.end_mark.line, col=token.end_mark.column)
+        AstNode.__init__(self, start=start, end=end)
         self.token = token
 
     def __eq__(self, other):
@@ -457,7 +580,204 @@ class TokenNode(AstNode):
 
         is_scalar = isinstance(self.token, yaml.ScalarToken)
         scalar_equal = is_scalar and self.token.value == other.token.value
-        return super().__eq__(other) and (scalar_equal or not is_scalar)
+        return AstNode.__eq__(self, other) and (scalar_equal or not is_scalar)
+
+
+#: block scalar header directly followed by a comment, which only libyaml
+#: accepts
+_BLOCK_SCALAR_HEADER_COMMENT = re.compile(r"[|>][-+0-9]*#")
+
+
+class _LibyamlMismatch(Exception):
+    """
+    Raised when libyaml's scanner would not produce the same tokens as the pure
+    Python scanner of PyYAML.
+    """
+
+
+def _scan_with_libyaml(document: str) -> Iterator[yaml.Token]:
+    """
+    Scan the document using libyaml, yielding the same tokens as
+    :py:func:`yaml.scan`.
+
+    :raises _LibyamlMismatch: if the tokens would differ from the ones of the
+        pure Python scanner, including all scanner errors, as their marks
+        drive the error recovery of the parser.
+    """
+    if any(
+        char in document
+        for char in ("\t", "\ufeff", "\x85", "\u2028", "\u2029")
+    ):
+        # libyaml accepts tabs in places where PyYAML rejects them and counts
+        # the other characters differently when computing the marks
+        raise _LibyamlMismatch("unsupported whitespace character")
+
+    # libyaml puts the end of a document without a final line break at the
+    # start of the next line
+    end = len(document)
+    end_mark = None
+    if document and document[-1] not in "\r\n":
+        line_start = max(document.rfind("\n"), document.rfind("\r")) + 1
+        end_mark = yaml.Mark(
+            "<unicode string>",
+            end,
+            document.count("\n")
+            + document.count("\r")
+            - document.count("\r\n"),
+            end - line_start,
+            None,
+            0,
+        )
+
+    flow_level = 0
+    loader = yaml.CBaseLoader(document)
+    try:
+        token = loader.get_token()
+        while token is not None:
+            if isinstance(
+                token,
+                (yaml.FlowSequenceStartToken, yaml.FlowMappingStartToken),
+            ):
+                flow_level += 1
+            elif isinstance(
+                token, (yaml.FlowSequenceEndToken, yaml.FlowMappingEndToken)
+            ):
+                if flow_level == 0:
+                    raise _LibyamlMismatch("unbalanced flow collection end")
+                flow_level -= 1
+            elif isinstance(token, yaml.ScalarToken) and token.plain:
+                # PyYAML ends plain scalars in flow collections at a '?'
+                if flow_level and "?" in token.value:
+                    raise _LibyamlMismatch("'?' in a plain flow scalar")
+                token.style = None
+            elif isinstance(
+                token, yaml.ScalarToken
+            ) and _BLOCK_SCALAR_HEADER_COMMENT.match(
+                document, token.start_mark.index
+            ):
+                raise _LibyamlMismatch("comment in a block scalar header")
+            if end_mark is not None:
+                if token.start_mark.index == end:
+                    token.start_mark = end_mark
+                if token.end_mark.index == end:
+                    token.end_mark = end_mark
+            yield token
+            token = loader.get_token()
+    except yaml.scanner.ScannerError as err:
+        raise _LibyamlMismatch(str(err)) from err
+    finally:
+        loader.dispose()
+
+
+def _splits_lines_at_lf(document: str) -> bool:
+    """
+    Returns True if all the line breaks of the document are ``\\n`` or
+    ``\\r\\n``, i.e. if :py:func:`_line_offset` finds the same lines as the
+    scanner.
+    """
+    return document.count("\r") == document.count("\r\n") and not any(
+        brk in document for brk in ("\x85", "\u2028", "\u2029")
+    )
+
+
+class _LazyValue:
+    """
+    Value of a :py:class:`StateParameterNode` that has not been converted to
+    :py:class:`TokenNode` objects yet.
+
+    It only stores where the tokens of the value are in the document: the
+    top level block containing them starts with a key at the first column,
+    so scanning the lines of this block on their own yields the same tokens
+    as scanning the whole document.
+    """
+
+    __slots__ = ("document", "line", "first", "stop", "end_line")
+
+    def __init__(
+        self: _LazyValue,
+        document: str,
+        line: int,
+        first: int,
+        stop: int,
+        end_line: int,
+    ) -> None:
+        """
+        :param document: the document containing the value
+        :param line: the line of the key starting the top level block
+        :param first: the index of the first token of the value among the
+            tokens of the block scanned on its own
+        :param stop: the index of the token following the value
+        :param end_line: the line of the end of the value, relative to
+            ``line``
+        """
+        self.document = document
+        self.line = line
+        self.first = first
+        self.stop = stop
+        self.end_line = end_line
+
+    def build(self: _LazyValue, parent: AstNode) -> List[TokenNode]:
+        """
+        Scan the block again and wrap the tokens of the value.
+
+        :param parent: the parameter node owning the value
+        :return: the nodes of the value
+        """
+        offset = _line_offset(self.document, self.line)
+        end = _line_offset(self.document, self.line + self.end_line + 1)
+        block = self.document[offset:end]
+        tokens = None
+        if LIBYAML_AVAILABLE:
+            try:
+                tokens = list(
+                    islice(_scan_with_libyaml(block), self.first, self.stop)
+                )
+            except _LibyamlMismatch:
+                pass
+        if tokens is None:
+            tokens = list(islice(yaml.scan(block), self.first, self.stop))
+        if len(tokens) != self.stop - self.first:
+            raise ValueError("the document does not contain the value")
+
+        nodes = []
+        for token in tokens:
+            token.start_mark = self._shifted(token.start_mark, offset)
+            token.end_mark = self._shifted(token.end_mark, offset)
+            node = TokenNode(token=token)
+            node.parent = parent
+            nodes.append(node)
+        return nodes
+
+    def _shifted(self: _LazyValue, mark: yaml.Mark, offset: int) -> yaml.Mark:
+        return yaml.Mark(
+            mark.name,
+            mark.index + offset,
+            mark.line + self.line,
+            mark.column,
+            None,
+            0,
+        )
+
+    def moved(self: _LazyValue, document: str, lines: int) -> _LazyValue:
+        """
+        Returns the same value in the edited ``document`` where the value
+        moved by ``lines`` lines.
+        """
+        return _LazyValue(
+            document, self.line + lines, self.first, self.stop, self.end_line
+        )
+
+
+#: signature of the methods of :py:class:`Parser` handling a token with its
+#: start and end positions
+_TokenHandler = Callable[..., Any]
+
+_BlockStartToken = Union[
+    yaml.BlockMappingStartToken,
+    yaml.BlockSequenceStartToken,
+    yaml.FlowSequenceStartToken,
+    yaml.FlowMappingStartToken,
+]
 
 
 class Parser:
@@ -465,226 +785,394 @@ class Parser:
     SLS file parser class
     """
 
-    def __init__(self: Parser, document: str) -> None:
+    def __init__(
+        self: Parser,
+        document: str,
+        use_libyaml: Optional[bool] = None,
+        lazy_values: bool = True,
+    ) -> None:
         """
         Create a parser object for an SLS file.
 
         :param document: the content of the SLS file to parse
+        :param use_libyaml: whether to tokenize the document with libyaml's
+            scanner, defaults to True if it is available
+        :param lazy_values: whether to only build the nodes of the parameter
+            values when they are first accessed
         """
         self.document = document
+        self._use_libyaml = LIBYAML_AVAILABLE and use_libyaml is not False
+        self._lazy_values = lazy_values and _splits_lines_at_lf(document)
+        self._reset()
+
+    def _reset(self: Parser) -> None:
+        """
+        Reset the parser to the state before processing the first token
+        """
         self._tree = Tree()
         self._breadcrumbs: List[AstNode] = [self._tree]
-        self._block_starts: List[
-            Tuple[
-                Union[
-                    yaml.BlockMappingStartToken,
-                    yaml.BlockSequenceStartToken,
-                    yaml.FlowSequenceStartToken,
-                    yaml.FlowMappingStartToken,
-                ],
-                AstNode,
-            ],
-        ] = []
+        self._block_starts: List[Tuple[_BlockStartToken, AstNode]] = []
         self._next_scalar_as_key = False
         #: flag for _process_token that the preceding token was a ValueToken
         #: => if applicable, the next token will be a value, unless a block is
         #:    started
         self._next_token_is_value = False
-        self._unprocessed_tokens: Optional[List[TokenNode]] = None
+        #: the tokens of the parameter value being collected, the block starts
+        #: are wrapped in a TokenNode as they are pushed to the breadcrumbs
+        self._unprocessed_tokens: Optional[
+            List[Union[yaml.Token, TokenNode]]
+        ] = None
+        #: index of the first token of the value being collected
+        self._unprocessed_first = 0
+        #: True if the nodes of the value being collected have been modified
+        #: and thus cannot be built again from the document
+        self._unprocessed_modified = False
+        #: index and line of the last key starting a top level block that can
+        #: be scanned on its own, see _LazyValue
+        self._block_key: Optional[Tuple[int, int]] = None
+        #: number of tokens processed so far, i.e. the index of the token
+        #: being processed
+        self._token_count = 0
         self._last_start: Optional[Position] = None
+        self._last_position = Position(line=0, col=0)
 
     def _process_token(self: Parser, token: yaml.Token) -> None:
         """
         Process one token
+
+        The parser is a state machine with two states: either it builds the
+        AST from the tokens or it collects the tokens of a parameter value
+        (``self._unprocessed_tokens`` is set). Each state has its own table
+        mapping the token type to its handler.
         """
-        token_start = Position(
-            line=token.start_mark.line, col=token.start_mark.column
-        )
-        token_end = Position(
-            line=token.end_mark.line, col=token.end_mark.column
-        )
-        if isinstance(token, yaml.StreamStartToken):
-            self._tree.start = token_start
-        if isinstance(token, yaml.StreamEndToken):
-            self._tree.end = token_end
+        # consecutive tokens often share a position: reuse the last one
+        start = self._last_position
+        mark = token.start_mark
+        if start.line != mark.line or start.col != mark.column:
+            start = Position(line=mark.line, col=mark.column)
+        end = start
+        mark = token.end_mark
+        if end.line != mark.line or end.col != mark.column:
+            end = Position(line=mark.line, col=mark.column)
+        self._last_position = end
+
+        if self._unprocessed_tokens is None:
+            handler = self._HANDLERS.get(type(token))
+        else:
+            handler = self._COLLECTING_HANDLERS.get(
+                type(token), Parser._collect_token
+            )
+        if handler is not None:
+            handler(self, token, start, end)
+        self._token_count += 1
+
+    # pylint: disable=unused-argument
+
+    def _start_stream(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        self._tree.start = start
+
+    def _end_stream(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        self._tree.end = end
+
+    def _start_block(
+        self: Parser, token: _BlockStartToken, start: Position, end: Position
+    ) -> None:
+        # Store which block start corresponds to what breadcrumb to help
+        # handling end block tokens
+        self._block_starts.append((token, self._breadcrumbs[-1]))
+        # a block is starting, so the next token cannot be a value, it will
+        # be a complex type instead
+        self._next_token_is_value = False
 
-        if isinstance(
-            token,
-            (
-                yaml.BlockMappingStartToken,
-                yaml.BlockSequenceStartToken,
-                yaml.FlowSequenceStartToken,
-                yaml.FlowMappingStartToken,
-            ),
+    def _value(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        self._next_token_is_value = True
+        if isinstance(self._breadcrumbs[-1], StateParameterNode):
+            # We don't need to do anything else with this token, just flag
+            # the next tokens to be simply collected
+            self._unprocessed_tokens = []
+            self._unprocessed_first = self._token_count + 1
+            self._unprocessed_modified = False
+
+    def _end_block(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> bool:
+        """
+        Close the nodes of the block ending with the token.
+
+        :return: False if there was no block to close
+        """
+        if len(self._block_starts) == 0 or len(self._breadcrumbs) == 0:
+            log.error(
+                "Reached a %s but either no block starts "
+                "(len(self._block_starts) = %d) or no breadcrumbs "
+                "(len(self._breadcrumbs) = %d) are present",
+                type(token).__name__,
+                len(self._block_starts),
+                len(self._breadcrumbs),
+            )
+            return False
+        last_start = self._block_starts.pop()
+        last = self._breadcrumbs.pop()
+        # pop breadcrumbs until we match the block starts
+        closed = last
+        while len(self._breadcrumbs) > 0 and closed is not last_start[1]:
+            closed = self._breadcrumbs.pop()
+            closed.end = end
+            if isinstance(closed, TokenNode):
+                self._unprocessed_modified = True
+        if not isinstance(last, TokenNode):
+            last.end = end
+        if (
+            isinstance(last, StateParameterNode)
+            and self._unprocessed_tokens is not None
         ):
-            # Store which block start corresponds to what breadcrumb to help
-            # handling end block tokens
-            self._block_starts.append((token, self._breadcrumbs[-1]))
-            # a block is starting, so the next token cannot be a value, it will
-            # be a complex type instead
-            self._next_token_is_value = False
+            last.value = self._collected_value(last)
+            self._unprocessed_tokens = None
+        return True
 
-        if isinstance(token, yaml.ValueToken):
-            self._next_token_is_value = True
-        if isinstance(token, yaml.ValueToken) and isinstance(
-            self._breadcrumbs[-1], StateParameterNode
+    def _collected_value(self: Parser, parameter: StateParameterNode) -> Any:
+        """
+        Returns the value of the parameter from the collected tokens: a plain
+        string for a single scalar, otherwise the list of their nodes or a
+        :py:class:`_LazyValue` building it.
+        """
+        unprocessed = cast(
+            List[Union[yaml.Token, TokenNode]], self._unprocessed_tokens
+        )
+        if len(unprocessed) == 1 and isinstance(
+            unprocessed[0], yaml.ScalarToken
         ):
-            if not self._unprocessed_tokens:
-                self._unprocessed_tokens = []
-                # We don't need to do anything else with this token,
-                # just flag the next tokens to be simply collected
-                return
-
-        if self._unprocessed_tokens is not None:
-            if not isinstance(
-                self._breadcrumbs[-1], StateParameterNode
-            ) or not isinstance(token, yaml.BlockEndToken):
-                self._unprocessed_tokens.append(TokenNode(token=token))
-            if isinstance(
-                token,
-                (
-                    yaml.BlockMappingStartToken,
-                    yaml.BlockSequenceStartToken,
-                    yaml.FlowSequenceStartToken,
-                    yaml.FlowMappingStartToken,
-                ),
-            ):
-                self._breadcrumbs.append(self._unprocessed_tokens[-1])
-                # a block is starting, so the next token cannot be a value, it
-                # will be a complex type instead
-                self._next_token_is_value = False
+            return unprocessed[0].value
+
+        if (
+            unprocessed
+            and self._lazy_values
+            and self._block_key is not None
+            and not self._unprocessed_modified
+            # the value must be the tokens preceding the current one
+            and len(unprocessed) == self._token_count - self._unprocessed_first
+        ):
+            key_index, key_line = self._block_key
+            last = unprocessed[-1]
+            if isinstance(last, TokenNode):
+                last = last.token
+            # the block scanned on its own starts with a StreamStartToken and
+            # a BlockMappingStartToken before its key
+            return _LazyValue(
+                self.document,
+                key_line,
+                self._unprocessed_first - key_index + 2,
+                self._token_count - key_index + 2,
+                last.end_mark.line - key_line,
+            )
 
+        nodes = [
+            item if isinstance(item, TokenNode) else TokenNode(token=item)
+            for item in unprocessed
+        ]
+        for node in nodes:
+            node.parent = parameter
+        return nodes
+
+    def _key(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        self._next_scalar_as_key = True
+        if (
+            start.col == 0
+            and len(self._block_starts) == 1
+            and isinstance(
+                self._block_starts[0][0], yaml.BlockMappingStartToken
+            )
+        ):
+            # the scanner is in the same state as at the start of a document
+            # starting with this key
+            self._block_key = (self._token_count, start.line)
+        if isinstance(self._breadcrumbs[-1], AstMapNode) and not isinstance(
+            self._breadcrumbs[-1], (RequisiteNode, StateParameterNode)
+        ):
+            self._breadcrumbs.append(self._breadcrumbs[-1].add())
+            if self._last_start:
+                self._breadcrumbs[-1].start = self._last_start
+                self._last_start = None
+            else:
+                self._breadcrumbs[-1].start = start
+
+    def _block_entry(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        # Create the state parameter, include and requisite before the dict
+        # since those are dicts in lists
+        same_level = (
+            len(self._breadcrumbs) > 0
+            and self._breadcrumbs[-1].start
+            and self._breadcrumbs[-1].start.col == start.col
+        )
+        if same_level:
+            self._breadcrumbs.pop().end = start
         if isinstance(
-            token,
-            (
-                yaml.BlockEndToken,
-                yaml.FlowSequenceEndToken,
-                yaml.FlowMappingEndToken,
-            ),
+            self._breadcrumbs[-1],
+            (StateCallNode, IncludesNode, RequisitesNode),
         ):
-            if len(self._block_starts) == 0 or len(self._breadcrumbs) == 0:
-                log.error(
-                    "Reached a %s but either no block starts "
-                    "(len(self._block_starts) = %d) or no breadcrumbs "
-                    "(len(self._breadcrumbs) = %d) are present",
-                    type(token).__name__,
-                    len(self._block_starts),
-                    len(self._breadcrumbs),
-                )
-                return
-            last_start = self._block_starts.pop()
-            last = self._breadcrumbs.pop()
-            # pop breadcrumbs until we match the block starts
-            closed = last
-            while len(self._breadcrumbs) > 0 and closed != last_start[1]:
-                closed = self._breadcrumbs.pop()
-                closed.end = token_end
-            if not isinstance(last, TokenNode):
-                last.end = token_end
+            self._breadcrumbs.append(self._breadcrumbs[-1].add())
+            self._breadcrumbs[-1].start = start
+
+    def _scalar(
+        self: Parser, token: yaml.ScalarToken, start: Position, end: Position
+    ) -> None:
+        if self._next_scalar_as_key and getattr(
+            self._breadcrumbs[-1], "set_key"
+        ):
+            # keys like the state and parameter names repeat a lot, share them
+            changed = getattr(self._breadcrumbs[-1], "set_key")(
+                sys.intern(token.value)
+            )
+            # If the changed node isn't the same than the one we called the
+            # function on, that means that the node had to be converted and
+            # we need to update the breadcrumbs too.
+            if changed is not self._breadcrumbs[-1]:
+                old = self._breadcrumbs.pop()
+                self._breadcrumbs.append(changed)
+                # only the blocks started since the old node was pushed, i.e.
+                # the last ones, can belong to it
+                i = len(self._block_starts) - 1
+                while i >= 0 and self._block_starts[i][1] is old:
+                    self._block_starts[i] = (self._block_starts[i][0], changed)
+                    i -= 1
+
+            self._next_scalar_as_key = False
+        else:
+            if isinstance(self._breadcrumbs[-1], IncludeNode):
+                self._breadcrumbs[-1].value = token.value
+                self._breadcrumbs[-1].end = end
+                self._breadcrumbs.pop()
+            if isinstance(self._breadcrumbs[-1], RequisiteNode):
+                self._breadcrumbs[-1].reference = token.value
+            # If the user hasn't typed the ':' yet, then the state
+            # parameter will come as a scalar
             if (
-                isinstance(last, StateParameterNode)
-                and self._unprocessed_tokens is not None
+                isinstance(self._breadcrumbs[-1], StateParameterNode)
+                and self._breadcrumbs[-1].name is None
             ):
-                if len(self._unprocessed_tokens) == 1 and isinstance(
-                    self._unprocessed_tokens[0].token, yaml.ScalarToken
-                ):
-                    last.value = self._unprocessed_tokens[0].token.value
-                else:
-                    for unprocessed in self._unprocessed_tokens:
-                        unprocessed.parent = last
-                    last.value = self._unprocessed_tokens
-                self._unprocessed_tokens = None
-
-        if self._unprocessed_tokens is not None:
-            # If self._unprocessed_tokens is set then we don't have
-            # Salt-specific data token to process
-            # reset the flag that the next token is a value, as the current
-            # token has now been put into self._unprocessed_tokens and will be
-            # taken care of in the next sweep
-            self._next_token_is_value = False
-            return
+                self._breadcrumbs[-1].name = token.value
+            if isinstance(self._breadcrumbs[-1], (StateNode, Tree)):
+                new_node = self._breadcrumbs[-1].add()
+                new_node.start = start
+                new_node.end = end
+                if getattr(new_node, "set_key"):
+                    getattr(new_node, "set_key")(token.value)
+
+                # this scalar token is actually the plain value of the
+                # previous key and "a new thing" starts with the next token
+                # => pop the current breadcrumb as it is now processed
+                if self._next_token_is_value:
+                    last = self._breadcrumbs.pop()
+                    if last.end is None:
+                        last.end = end
 
-        if isinstance(token, yaml.KeyToken):
-            self._next_scalar_as_key = True
-            if isinstance(
-                self._breadcrumbs[-1], AstMapNode
-            ) and not isinstance(
-                self._breadcrumbs[-1], (RequisiteNode, StateParameterNode)
-            ):
-                self._breadcrumbs.append(self._breadcrumbs[-1].add())
-                if self._last_start:
-                    self._breadcrumbs[-1].start = self._last_start
-                    self._last_start = None
-                else:
-                    self._breadcrumbs[-1].start = token_start
-
-        if isinstance(token, yaml.BlockEntryToken):
-            # Create the state parameter, include and requisite before the dict
-            # since those are dicts in lists
-            same_level = (
-                len(self._breadcrumbs) > 0
-                and self._breadcrumbs[-1].start
-                and self._breadcrumbs[-1].start.col == token.start_mark.column
-            )
-            if same_level:
-                self._breadcrumbs.pop().end = token_start
-            if isinstance(
-                self._breadcrumbs[-1],
-                (StateCallNode, IncludesNode, RequisitesNode),
-            ):
-                self._breadcrumbs.append(self._breadcrumbs[-1].add())
-                self._breadcrumbs[-1].start = token_start
+        self._next_token_is_value = False
 
-        if isinstance(token, yaml.ScalarToken):
-            if self._next_scalar_as_key and getattr(
-                self._breadcrumbs[-1], "set_key"
-            ):
-                changed = getattr(self._breadcrumbs[-1], "set_key")(
-                    token.value
-                )
-                # If the changed node isn't the same than the one we called the
-                # function on, that means that the node had to be converted and
-                # we need to update the breadcrumbs too.
-                if changed != self._breadcrumbs[-1]:
-                    old = self._breadcrumbs.pop()
-                    self._breadcrumbs.append(changed)
-                    self._block_starts = [
-                        (block[0], changed) if block[1] == old else block
-                        for block in self._block_starts
-                    ]
-
-                self._next_scalar_as_key = False
-            else:
-                if isinstance(self._breadcrumbs[-1], IncludeNode):
-                    self._breadcrumbs[-1].value = token.value
-                    self._breadcrumbs[-1].end = token_end
-                    self._breadcrumbs.pop()
-                if isinstance(self._breadcrumbs[-1], RequisiteNode):
-                    self._breadcrumbs[-1].reference = token.value
-                # If the user hasn't typed the ':' yet, then the state
-                # parameter will come as a scalar
-                if (
-                    isinstance(self._breadcrumbs[-1], StateParameterNode)
-                    and self._breadcrumbs[-1].name is None
-                ):
-                    self._breadcrumbs[-1].name = token.value
-                if isinstance(self._breadcrumbs[-1], (StateNode, Tree)):
-                    new_node = self._breadcrumbs[-1].add()
-                    new_node.start = token_start
-                    new_node.end = token_end
-                    if getattr(new_node, "set_key"):
-                        getattr(new_node, "set_key")(token.value)
-
-                    # this scalar token is actually the plain value of the
-                    # previous key and "a new thing" starts with the next token
-                    # => pop the current breadcrumb as it is now processed
-                    if self._next_token_is_value:
-                        last = self._breadcrumbs.pop()
-                        if last.end is None:
-                            last.end = token_end
+    def _collect_token(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        """
+        Add the token to the value of the current parameter.
+        """
+        assert self._unprocessed_tokens is not None
+        self._unprocessed_tokens.append(token)
+        # reset the flag that the next token is a value, as the current token
+        # has now been put into self._unprocessed_tokens and will be taken
+        # care of in the next sweep
+        self._next_token_is_value = False
 
+    def _collect_stream_start(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        self._start_stream(token, start, end)
+        self._collect_token(token, start, end)
+
+    def _collect_stream_end(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        self._end_stream(token, start, end)
+        self._collect_token(token, start, end)
+
+    def _collect_block_start(
+        self: Parser, token: _BlockStartToken, start: Position, end: Position
+    ) -> None:
+        assert self._unprocessed_tokens is not None
+        self._start_block(token, start, end)
+        node = TokenNode(token=token, start=start, end=end)
+        self._unprocessed_tokens.append(node)
+        self._breadcrumbs.append(node)
+
+    def _collect_value(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        if not self._unprocessed_tokens and isinstance(
+            self._breadcrumbs[-1], StateParameterNode
+        ):
+            self._value(token, start, end)
+        else:
+            self._collect_token(token, start, end)
+
+    def _collect_block_end(
+        self: Parser, token: yaml.Token, start: Position, end: Position
+    ) -> None:
+        assert self._unprocessed_tokens is not None
+        # the block end of the parameter itself is not part of the value
+        if not isinstance(self._breadcrumbs[-1], StateParameterNode) or (
+            not isinstance(token, yaml.BlockEndToken)
+        ):
+            self._unprocessed_tokens.append(token)
+        if (
+            self._end_block(token, start, end)
+            and self._unprocessed_tokens is not None
+        ):
             self._next_token_is_value = False
 
+    # pylint: enable=unused-argument
+
+    _BLOCK_STARTS = (
+        yaml.BlockMappingStartToken,
+        yaml.BlockSequenceStartToken,
+        yaml.FlowSequenceStartToken,
+        yaml.FlowMappingStartToken,
+    )
+    _BLOCK_ENDS = (
+        yaml.BlockEndToken,
+        yaml.FlowSequenceEndToken,
+        yaml.FlowMappingEndToken,
+    )
+
+    #: token handlers while building the AST
+    _HANDLERS: Dict[type, _TokenHandler] = {
+        yaml.StreamStartToken: _start_stream,
+        yaml.StreamEndToken: _end_stream,
+        **dict.fromkeys(_BLOCK_STARTS, _start_block),
+        yaml.ValueToken: _value,
+        **dict.fromkeys(_BLOCK_ENDS, _end_block),
+        yaml.KeyToken: _key,
+        yaml.BlockEntryToken: _block_entry,
+        yaml.ScalarToken: _scalar,
+    }
+
+    #: token handlers while collecting the tokens of a parameter value, any
+    #: other token is just collected
+    _COLLECTING_HANDLERS: Dict[type, _TokenHandler] = {
+        yaml.StreamStartToken: _collect_stream_start,
+        yaml.StreamEndToken: _collect_stream_end,
+        **dict.fromkeys(_BLOCK_STARTS, _collect_block_start),
+        yaml.ValueToken: _collect_value,
+        **dict.fromkeys(_BLOCK_ENDS, _collect_block_end),
+    }
+
     def parse(self) -> Tree:
         """
         Generate the Abstract Syntax Tree for a ``jinja|yaml`` rendered SLS
@@ -693,6 +1181,20 @@ class Parser:
         :return: the generated AST
         :raises ValueException: for any other renderer but ``jinja|yaml``
         """
+        tree = self._parse()
+        tree.index_state_ids()
+        return tree
+
+    def _parse(self) -> Tree:
+        if self._use_libyaml:
+            try:
+                for libyaml_token in _scan_with_libyaml(self.document):
+                    log.debug(libyaml_token)
+                    self._process_token(libyaml_token)
+                return self._tree
+            except _LibyamlMismatch as err:
+                log.debug("Falling back to the pure Python scanner: %s", err)
+                self._reset()
 
         tokens = yaml.scan(self.document)
         token = None
@@ -702,6 +1204,9 @@ class Parser:
                 self._process_token(token)
         except yaml.scanner.ScannerError as err:
             log.debug(err)
+            self._tree.complete = False
+            # the values closed by the recovery tokens cannot be scanned again
+            self._lazy_values = False
             if token:
                 # Properly close the opened blocks
                 for node in reversed(self._breadcrumbs):
@@ -747,13 +1252,418 @@ class Parser:
             return self._tree
         return self._tree
 
+    def parse_blocks(self) -> Optional[Tree]:
+        """
+        Generate the Abstract Syntax Tree for a part of an SLS file that
+        consists of complete top level blocks.
+
+        :return: the generated AST or None if the document is not a block
+            mapping or if its blocks cannot be parsed independently from the
+            rest of the file.
+        """
+        if self._use_libyaml:
+            try:
+                return self._parse_blocks(_scan_with_libyaml(self.document))
+            except _LibyamlMismatch as err:
+                log.debug("Falling back to the pure Python scanner: %s", err)
+                self._reset()
+        try:
+            return self._parse_blocks(yaml.scan(self.document))
+        except yaml.scanner.ScannerError as err:
+            log.debug(err)
+            return None
+
+    def _parse_blocks(self, tokens: Iterator[yaml.Token]) -> Optional[Tree]:
+        previous: Optional[yaml.Token] = None
+        started = False
+        for token in tokens:
+            if previous is not None:
+                if not started and not isinstance(
+                    previous,
+                    (
+                        yaml.StreamStartToken,
+                        yaml.DirectiveToken,
+                        yaml.DocumentStartToken,
+                    ),
+                ):
+                    if not isinstance(previous, yaml.BlockMappingStartToken):
+                        return None
+                    started = True
+                # the last token closes the top level mapping, everything
+                # else must be closed by now, otherwise the next block of the
+                # file would not start at the top level
+                if isinstance(token, yaml.StreamEndToken) and (
+                    self._unprocessed_tokens is not None
+                    or len(self._breadcrumbs) != 1
+                    or self._breadcrumbs[0] is not self._tree
+                ):
+                    return None
+                self._process_token(previous)
+            previous = token
+
+        if previous is not None:
+            self._process_token(previous)
+        if self._block_starts or self._unprocessed_tokens is not None:
+            return None
+        return self._tree
+
+
+class ParseCache:
+    """
+    Least recently used cache of the Abstract Syntax Trees of documents, keyed
+    by a digest of their content.
+
+    The cached trees are shared by everyone parsing the same content, so they
+    must not be modified. The cache can be used from several threads.
+    """
+
+    def __init__(self: ParseCache, maxsize: int = 256) -> None:
+        """
+        :param maxsize: the number of trees to keep
+        """
+        self.maxsize = maxsize
+        #: number of lookups that found a cached tree
+        self.hits = 0
+        #: number of lookups that had to parse the document
+        self.misses = 0
+        self._trees: OrderedDict[bytes, Tree] = OrderedDict()
+        # the documents are parsed off the event loop as well
+        self._lock = threading.Lock()
+
+    def __len__(self: ParseCache) -> int:
+        return len(self._trees)
+
+    def get_or_parse(
+        self: ParseCache, document: str, parse_document: Callable[[], Tree]
+    ) -> Tree:
+        """
+        Returns the cached tree of the document or parses it and caches the
+        result.
+
+        :param document: the content of the SLS file
+        :param parse_document: function generating the AST of the document
+        :return: the AST of the document
+        """
+        key = hashlib.blake2b(
+            document.encode("utf-8", "surrogatepass"), digest_size=16
+        ).digest()
+        with self._lock:
+            tree = self._trees.get(key)
+            if tree is not None:
+                self.hits += 1
+                self._trees.move_to_end(key)
+                return tree
+            self.misses += 1
+
+        tree = parse_document()
+        with self._lock:
+            self._trees[key] = tree
+            if len(self._trees) > self.maxsize:
+                self._trees.popitem(last=False)
+        return tree
+
+    def clear(self: ParseCache) -> None:
+        """
+        Remove all cached trees and reset the counters.
+        """
+        with self._lock:
+            self._trees.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+#: cache of the trees returned by :py:func:`parse` and :py:func:`reparse`
+PARSE_CACHE = ParseCache()
+
 
 def parse(document: str) -> Tree:
     """
     Generate the Abstract Syntax Tree for a ``jinja|yaml`` rendered SLS file.
 
+    The tree is shared with the other callers parsing the same content, see
+    :py:data:`PARSE_CACHE`.
+
     :param document: the content of the SLS file to parse
     :return: the generated AST
     :raises ValueException: for any other renderer but ``jinja|yaml``
     """
-    return Parser(document).parse()
+    return PARSE_CACHE.get_or_parse(document, Parser(document).parse)
+
+
+#: Lines that may precede the first top level key of a block mapping document
+_PREAMBLE = re.compile(r"(?:(?:[ \t]*|%.*|---[ \t]*)(?:#.*)?\r?\n)*")
+
+#: Document start and end markers
+_DOCUMENT_MARKER = re.compile(r"^(?:---|\.\.\.)", re.MULTILINE)
+
+
+def _line_offset(document: str, line: int, offset: int = 0) -> int:
+    """
+    Returns the index of the first character of ``line`` in ``document`` or
+    the length of the document if it has less lines.
+
+    :param offset: the index of a line start that the line is counted from
+    """
+    for _ in range(line):
+        offset = document.find("\n", offset) + 1
+        if offset == 0:
+            return len(document)
+    return offset
+
+
+def _top_level_nodes(tree: Tree) -> List[AstNode]:
+    """
+    Returns the direct children of ``tree`` ordered by their position or an
+    empty list if any of them is not a block starting at the first column.
+    """
+    nodes = cast(List[AstNode], tree.states)
+    if tree.includes is not None or tree.extend is not None:
+        nodes = [node for node in (tree.includes, tree.extend) if node] + nodes
+    for node in nodes:
+        if node.start is None or node.end is None or node.start.col != 0:
+            return []
+    return sorted(nodes, key=lambda node: cast(Position, node.start).line)
+
+
+#: names of the fields of each node type that can hold child nodes
+_CHILD_FIELDS: Dict[type, Tuple[str, ...]] = {}
+
+
+class _Shift:
+    """
+    Moves the nodes copied by :py:func:`_moved` to their position in the
+    edited document.
+    """
+
+    __slots__ = ("document", "lines", "delta", "line", "offset")
+
+    def __init__(
+        self: _Shift,
+        document: str,
+        lines: int,
+        delta: Optional[int] = None,
+        line: int = 0,
+        offset: int = 0,
+    ) -> None:
+        """
+        :param document: the edited document
+        :param lines: the number of lines the nodes moved by
+        :param delta: the number of characters the nodes moved by, None to
+            compute it from the first mark moved
+        :param line: a line of the edited document preceding the nodes
+        :param offset: the index of the first character of ``line``
+        """
+        self.document = document
+        self.lines = lines
+        self.delta = delta
+        self.line = line
+        self.offset = offset
+
+    def mark(self: _Shift, mark: yaml.Mark) -> yaml.Mark:
+        """
+        Returns the mark of a token at its new position.
+        """
+        if self.delta is None:
+            line_start = _line_offset(
+                self.document, mark.line + self.lines - self.line, self.offset
+            )
+            self.delta = line_start + mark.column - mark.index
+        if not self.lines and not self.delta:
+            return mark
+        return yaml.Mark(
+            mark.name,
+            mark.index + self.delta,
+            mark.line + self.lines,
+            mark.column,
+            None,
+            0,
+        )
+
+    def token(self: _Shift, token: yaml.Token) -> yaml.Token:
+        """
+        Returns the token or a copy of it at its new position, the tokens
+        are shared with the original tree.
+        """
+        start_mark = self.mark(token.start_mark)
+        end_mark = self.mark(token.end_mark)
+        if start_mark is token.start_mark and end_mark is token.end_mark:
+            return token
+        moved = copy(token)
+        moved.start_mark = start_mark
+        moved.end_mark = end_mark
+        return moved
+
+
+def _moved(node: AstNode, parent: AstNode, shift: _Shift) -> AstNode:
+    """
+    Returns a copy of ``node`` and of all its children with every position
+    shifted by ``shift`` and attached to ``parent``.
+
+    The lazy parameter values are not built but point to their new position
+    in the edited document.
+    """
+    lines = shift.lines
+    node_type = type(node)
+    moved = node_type.__new__(node_type)
+    moved.parent = parent
+    moved.start = node.start
+    moved.end = node.end
+    if lines:
+        if node.start is not None:
+            moved.start = Position(
+                line=node.start.line + lines, col=node.start.col
+            )
+        if node.end is not None:
+            moved.end = Position(line=node.end.line + lines, col=node.end.col)
+
+    if (child_fields := _CHILD_FIELDS.get(node_type)) is None:
+        child_fields = _CHILD_FIELDS[node_type] = tuple(
+            fld.name
+            for fld in fields(node)
+            if fld.name not in ("start", "end", "parent")
+        )
+    for name in child_fields:
+        if node_type is StateParameterNode and name == "value":
+            value = _PARAMETER_VALUE.__get__(node)
+        else:
+            value = getattr(node, name)
+        if isinstance(value, AstNode):
+            value = _moved(value, moved, shift)
+        elif type(value) is list and value and isinstance(value[0], AstNode):
+            value = [_moved(item, moved, shift) for item in value]
+        elif isinstance(value, _LazyValue):
+            value = value.moved(shift.document, lines)
+        elif isinstance(value, yaml.Token):
+            value = shift.token(value)
+        setattr(moved, name, value)
+    return moved
+
+
+def reparse(
+    tree: Tree,
+    document: str,
+    start_line: int,
+    old_end_line: int,
+    new_end_line: int,
+) -> Tree:
+    """
+    Generate the Abstract Syntax Tree of an edited SLS file by re-parsing only
+    the top level blocks affected by the edit.
+
+    The edit replaced the lines ``start_line`` to ``old_end_line`` of the
+    document from which ``tree`` was generated with the lines ``start_line``
+    to ``new_end_line`` of ``document``. The nodes of the unaffected blocks
+    are copied from ``tree`` (which is left untouched) and moved to their new
+    position.
+
+    Whenever the affected blocks cannot be isolated, the whole document is
+    parsed again, so that the result is always equal to ``parse(document)``.
+    Like for :py:func:`parse`, the tree of a content that has already been
+    parsed is taken from :py:data:`PARSE_CACHE`, e.g. after undoing an edit.
+
+    :param tree: the AST of the document before the edit
+    :param document: the content of the SLS file after the edit
+    :param start_line: the first line touched by the edit
+    :param old_end_line: the last line touched by the edit before it
+    :param new_end_line: the last line touched by the edit after it
+    :return: the generated AST
+    """
+    return PARSE_CACHE.get_or_parse(
+        document,
+        lambda: _reparse(
+            tree, document, start_line, old_end_line, new_end_line
+        ),
+    )
+
+
+def _reparse(
+    tree: Tree,
+    document: str,
+    start_line: int,
+    old_end_line: int,
+    new_end_line: int,
+) -> Tree:
+    """
+    Implementation of :py:func:`reparse`, bypassing the cache.
+    """
+    nodes = _top_level_nodes(tree)
+    if not tree.complete or not nodes or not _splits_lines_at_lf(document):
+        return Parser(document).parse()
+
+    start_lines = [cast(Position, node.start).line for node in nodes]
+    # the block preceding the edited line is re-parsed too, as the edit might
+    # have turned the following block into its continuation
+    first = max(bisect_left(start_lines, start_line) - 1, 0)
+    last = bisect_right(start_lines, old_end_line)
+    line_delta = new_end_line - old_end_line
+
+    region_start = start_lines[first] if first > 0 else 0
+    region_offset = _line_offset(document, region_start)
+    region_end = (
+        _line_offset(document, start_lines[last] + line_delta)
+        if last < len(nodes)
+        else len(document)
+    )
+
+    region = Parser(document[region_offset:region_end]).parse_blocks()
+    prefix, suffix = nodes[:first], nodes[last:]
+    unaffected = prefix + suffix
+    if (
+        region is None
+        or region.includes is not None
+        and any(isinstance(node, IncludesNode) for node in unaffected)
+        or region.extend is not None
+        and any(isinstance(node, ExtendNode) for node in unaffected)
+    ):
+        return Parser(document).parse()
+
+    new_tree = Tree(start=tree.start)
+    # the text of the suffix did not change, so all of its marks move by the
+    # same number of characters, taken from the first one
+    suffix_line = start_lines[last] + line_delta if suffix else 0
+    suffix_shift = _Shift(document, line_delta, None, suffix_line, region_end)
+    children = (
+        [_moved(node, new_tree, _Shift(document, 0, 0)) for node in prefix]
+        + [
+            _moved(
+                node, new_tree, _Shift(document, region_start, region_offset)
+            )
+            for node in _top_level_nodes(region)
+        ]
+        + [_moved(node, new_tree, suffix_shift) for node in suffix]
+    )
+    if not children or len(children) != len(prefix) + len(suffix) + len(
+        region.get_children()
+    ):
+        # some of the re-parsed nodes do not start a block at the first column
+        return Parser(document).parse()
+
+    first_offset = _line_offset(
+        document, cast(Position, children[0].start).line
+    )
+    if _PREAMBLE.fullmatch(
+        document, 0, first_offset
+    ) is None or _DOCUMENT_MARKER.search(document, first_offset):
+        # the top level is not a single block mapping, e.g. a flow mapping or
+        # multiple yaml documents
+        return Parser(document).parse()
+
+    for node in children:
+        if isinstance(node, IncludesNode):
+            new_tree.includes = node
+        elif isinstance(node, ExtendNode):
+            new_tree.extend = node
+        else:
+            new_tree.states.append(cast(StateNode, node))
+
+    if suffix:
+        assert tree.end is not None
+        new_tree.end = Position(
+            line=tree.end.line + line_delta, col=tree.end.col
+        )
+    elif region.end is not None:
+        new_tree.end = Position(
+            line=region.end.line + region_start, col=region.end.col
+        )
+    new_tree.index_state_ids()
+    return new_tree
@@ -4,45 +4,84 @@ Language Server Protocol implementation
 
 import logging
 import re
+from concurrent.futures import Executor, ThreadPoolExecutor
 from os.path import basename
-from typing import Dict, List, Optional, Sequence, Tuple, Union, cast
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+)
 
 from lsprotocol.types import (
     TEXT_DOCUMENT_COMPLETION,
     INITIALIZE,
+    INITIALIZED,
     TEXT_DOCUMENT_DID_OPEN,
     TEXT_DOCUMENT_DEFINITION,
     TEXT_DOCUMENT_DOCUMENT_SYMBOL,
+    TEXT_DOCUMENT_REFERENCES,
+    WORKSPACE_DID_CHANGE_WATCHED_FILES,
+    WORKSPACE_SYMBOL,
     CompletionItem,
     CompletionList,
     CompletionOptions,
     CompletionParams,
     DeclarationParams,
+    DidChangeWatchedFilesParams,
+    DidChangeWatchedFilesRegistrationOptions,
     DidOpenTextDocumentParams,
     DocumentSymbol,
     DocumentSymbolParams,
+    FileChangeType,
+    FileSystemWatcher,
     InitializeParams,
+    InitializedParams,
     Location,
+    Position,
+    Range,
+    ReferenceParams,
+    Registration,
+    RegistrationParams,
     SymbolInformation,
+    TextEdit,
+    WatchKind,
+    WorkspaceSymbolParams,
 )
 from pygls.server import LanguageServer
 
 from salt_lsp import __version__
 from salt_lsp import utils
 from salt_lsp.base_types import StateNameCompletion
+from salt_lsp.disk_cache import DiskTreeCache
+from salt_lsp.indexer import WorkspaceIndexer
 from salt_lsp.workspace import SaltLspProto, SlsFileWorkspace
 from salt_lsp.parser import (
     IncludesNode,
+    AstNode,
     RequisiteNode,
+    StateNode,
     StateParameterNode,
-    Tree,
 )
 
+#: number of threads parsing the documents
+PARSE_WORKERS = 4
+
+#: maximum number of modules returned by an include completion
+MAX_INCLUDE_COMPLETIONS = 100
+
+#: custom request returning the memory usage of the server
+MEMORY_USAGE = "salt_lsp/memoryUsage"
+
 
 class SaltServer(LanguageServer):
     """Experimental language server for salt states"""
 
     LINE_START_REGEX = re.compile(r"^(\s*)\b", re.MULTILINE)
+    INCLUDE_PREFIX_REGEX = re.compile(r"[^\s'\"-][^\s'\"]*$|$")
 
     def __init__(self) -> None:
         super().__init__(
@@ -54,6 +93,11 @@ class SaltServer(LanguageServer):
         self.logger: logging.Logger = logging.getLogger()
         self._state_names: List[str] = []
         self.integration_tests: bool = False
+        self.tree_cache: Optional[DiskTreeCache] = None
+        self.index_workspace: bool = True
+        self.parse_delay: float = 0.0
+        self.parse_executor: Optional[Executor] = None
+        self.memory_budget: Optional[int] = None
 
     @property
     def workspace(self) -> SlsFileWorkspace:
@@ -68,6 +112,10 @@ class SaltServer(LanguageServer):
         state_name_completions: Dict[str, StateNameCompletion],
         log_level: int = logging.DEBUG,
         integration_tests: bool = False,
+        tree_cache: Optional[DiskTreeCache] = None,
+        index_workspace: bool = True,
+        parse_delay: float = 0.0,
+        memory_budget: Optional[int] = None,
     ) -> None:
         """Further initialisation, called after
         setup_salt_server_capabilities."""
@@ -76,6 +124,86 @@ class SaltServer(LanguageServer):
         self.logger = logging.getLogger(self.__class__.__name__)
         self.logger.setLevel(log_level)
         self.integration_tests = integration_tests
+        self.tree_cache = tree_cache
+        self.index_workspace = index_workspace
+        self.parse_delay = parse_delay
+        self.memory_budget = memory_budget
+        # parsing is pure Python, so the threads do not parse in parallel,
+        # but the event loop keeps answering requests in the meantime and a
+        # small document is not stuck behind a large one
+        self.parse_executor = ThreadPoolExecutor(
+            max_workers=PARSE_WORKERS, thread_name_prefix="salt_lsp-parse"
+        )
+
+    async def index(self) -> None:
+        """Parses all SLS files in the workspace in the background and reports
+        the progress to the client if it supports it.
+        """
+        progress = None
+        token = "salt_lsp/indexing"
+        window = self.client_capabilities.window
+        if window is not None and window.work_done_progress:
+            try:
+                await self.progress.create_async(token)
+                progress = self.progress
+            except Exception as err:  # pylint: disable=broad-except
+                self.logger.debug("Cannot report the progress: %s", err)
+
+        indexed = await WorkspaceIndexer(
+            self.workspace, self.tree_cache, progress, token
+        ).run()
+        self.logger.debug("Indexed %d files", indexed)
+        self.logger.info("Memory usage: %s", self.memory_usage())
+
+    def memory_usage(self) -> Dict[str, Optional[int]]:
+        """Returns the resident size of the server, the estimated size of the
+        documents that are not open in the editor and their budget in bytes.
+        """
+        return {
+            "resident": utils.resident_memory(),
+            "loaded": self.workspace.loaded_size,
+            "budget": self.workspace.memory_budget,
+        }
+
+    async def watch_files(self) -> None:
+        """Asks the client to notify the server about created, changed and
+        deleted SLS files and directories, so that the files of the included
+        modules do not need to be checked on the file system anymore.
+        """
+        workspace = self.client_capabilities.workspace
+        if (
+            workspace is None
+            or workspace.did_change_watched_files is None
+            or not workspace.did_change_watched_files.dynamic_registration
+        ):
+            return
+        options = DidChangeWatchedFilesRegistrationOptions(
+            watchers=[
+                FileSystemWatcher(glob_pattern="**/*.sls"),
+                # directories with any number of modules in them
+                FileSystemWatcher(
+                    glob_pattern="**", kind=WatchKind.Create | WatchKind.Delete
+                ),
+            ]
+        )
+        try:
+            await self.register_capability_async(
+                RegistrationParams(
+                    registrations=[
+                        Registration(
+                            id="salt_lsp/watched_files",
+                            method=WORKSPACE_DID_CHANGE_WATCHED_FILES,
+                            register_options=options,
+                        )
+                    ]
+                )
+            )
+        except Exception as err:  # pylint: disable=broad-except
+            self.logger.debug("Cannot watch the files: %s", err)
+            return
+        self.workspace.include_resolver.validate = False
+        self.workspace.root_finder.validate = False
+        self.workspace.module_index.validate = False
 
     def complete_state_name(
         self, params: CompletionParams
@@ -89,8 +217,10 @@ class SaltServer(LanguageServer):
         doc = self.workspace.get_text_document(params.text_document.uri)
         contents = doc.source
         ind = doc.offset_at_position(params.position)
+        # the state name is on the line of the position
+        line_start = doc.line_offsets.line_start(params.position.line)
         last_match = utils.get_last_element_of_iterator(
-            SaltServer.LINE_START_REGEX.finditer(contents, 0, ind)
+            SaltServer.LINE_START_REGEX.finditer(contents, line_start, ind)
         )
         if last_match is None:
             self.logger.debug(
@@ -107,7 +237,62 @@ class SaltServer(LanguageServer):
             return completer.provide_subname_completion()
         return []
 
-    def find_id_in_doc_and_includes(
+    def complete_include(self, params: CompletionParams) -> CompletionList:
+        """Complete the included module at the current position.
+
+        Only the modules starting with the typed text are returned, those
+        closest to the document first. The client asks again as the user
+        types if there are more than :py:data:`MAX_INCLUDE_COMPLETIONS`.
+        """
+        uri = params.text_document.uri
+        file_path = utils.FileUri(uri).path
+        doc = self.workspace.get_text_document(uri)
+        position = params.position
+        line_start = doc.line_offsets.line_start(position.line)
+        before = doc.source[line_start : doc.offset_at_position(position)]
+        match = SaltServer.INCLUDE_PREFIX_REGEX.search(before)
+        prefix = match.group() if match is not None else ""
+
+        root = self.workspace.root_finder.get_root(file_path)
+        includes = (
+            self.workspace.module_index.modules(
+                root,
+                prefix,
+                near=file_path,
+                limit=MAX_INCLUDE_COMPLETIONS + 1,
+            )
+            if root is not None
+            else []
+        )
+        # the typed text is replaced, the client would only replace the
+        # word after the last dot
+        edit_range = Range(
+            start=Position(
+                line=position.line,
+                character=position.character
+                - utils.to_client_units(prefix, doc.position_codec.encoding),
+            ),
+            end=position,
+        )
+        # right after the dash of a list item
+        space = " " if before.endswith("-") else ""
+        return CompletionList(
+            is_incomplete=len(includes) > MAX_INCLUDE_COMPLETIONS,
+            items=[
+                CompletionItem(
+                    label=include,
+                    sort_text=f"{rank:05}",
+                    text_edit=TextEdit(
+                        range=edit_range, new_text=f"{space}{include}"
+                    ),
+                )
+                for rank, include in enumerate(
+                    includes[:MAX_INCLUDE_COMPLETIONS]
+                )
+            ],
+        )
+
+    async def find_id_in_doc_and_includes(
         self, id_to_find: str, starting_uri: str
     ) -> Optional[Location]:
         """Finds the first matching location of the given id in the document or
@@ -116,13 +301,15 @@ class SaltServer(LanguageServer):
         This function searches for the `id_to_find` starting in
         `starting_uri`. If it does not find it in there, then it will continue
         to search in the includes and returns the first match that it finds.
+        The evicted includes are only read again until the match is found.
         """
         self.logger.debug(
             "Request to find id '%s' starting in uri '%s'",
             id_to_find,
             starting_uri,
         )
-        if (tree := self.workspace.trees.get(starting_uri)) is None:
+        await self.workspace.load(starting_uri)
+        if starting_uri not in self.workspace.trees:
             self.logger.error(
                 "Cannot search in '%s', no tree present", starting_uri
             )
@@ -132,21 +319,24 @@ class SaltServer(LanguageServer):
 
         # FIXME: need to take ordering into account:
         # https://docs.saltproject.io/en/latest/ref/states/compiler_ordering.html#the-include-statement
-        trees_and_uris_to_search: Sequence[
-            Tuple[Tree, Union[str, utils.FileUri]]
-        ] = [(tree, starting_uri)] + [
-            (t, inc)
-            for inc in inc_of_uri
-            if (t := self.workspace.trees.get(inc)) is not None
+        uris_to_search: List[Union[str, utils.FileUri]] = [
+            starting_uri,
+            *inc_of_uri,
         ]
-
-        for tree, uri in trees_and_uris_to_search:
+        for uri in uris_to_search:
+            # an evicted include is only read again if the id was not found
+            # in the previous ones
+            await self.workspace.load(uri)
+            if (tree := self.workspace.trees.get(uri)) is None:
+                continue
             self.logger.debug("Searching in '%s'", uri)
-            matching_states = [
-                state
-                for state in tree.states
-                if state.identifier == id_to_find
-            ]
+            matching_states = tree.state_ids.get(id_to_find, [])
+            if len(matching_states) > 1:
+                self.logger.debug(
+                    "Ignoring '%s', the id is declared %d times",
+                    uri,
+                    len(matching_states),
+                )
             if len(matching_states) != 1:
                 continue
 
@@ -160,6 +350,58 @@ class SaltServer(LanguageServer):
 
         return None
 
+    async def find_references(
+        self, uri: str, node: AstNode, include_declaration: bool
+    ) -> Optional[List[Location]]:
+        """Finds the requisites in the workspace that refer to the state
+        declared at or referenced by the given node.
+
+        :param uri: the URI of the document containing the node
+        :param node: a state or a requisite
+        :param include_declaration: whether the declaration of the state is
+            returned as well
+        """
+        declaration: Optional[Location] = None
+        modules: Optional[Set[Optional[str]]]
+        if isinstance(node, StateNode) and node.identifier is not None:
+            # requisites refer to states by their ID or their name
+            references = [node.identifier] + [
+                parameter.value
+                for call in node.states
+                for parameter in call.parameters
+                if parameter.name == "name"
+                and isinstance(parameter.value, str)
+            ]
+            modules = {None} | {
+                call.name.split(".")[0]
+                for call in node.states
+                if call.name is not None
+            }
+            if (lsp_range := utils.ast_node_to_range(node)) is not None:
+                declaration = Location(uri=uri, range=lsp_range)
+        elif isinstance(node, RequisiteNode) and node.reference is not None:
+            references = [node.reference]
+            modules = None if node.module is None else {None, node.module}
+            if include_declaration:
+                declaration = await self.find_id_in_doc_and_includes(
+                    node.reference, uri
+                )
+        else:
+            return None
+
+        locations = (
+            [declaration]
+            if include_declaration and declaration is not None
+            else []
+        )
+        requisite_index = self.workspace.requisite_index
+        for reference in references:
+            for ref_uri, requisite in requisite_index.find(reference, modules):
+                if (lsp_range := utils.ast_node_to_range(requisite)) is None:
+                    continue
+                locations.append(Location(uri=ref_uri, range=lsp_range))
+        return locations
+
 
 def setup_salt_server_capabilities(server: SaltServer, log_level: Optional[int]) -> None:
     """Adds the completion, goto definition and document symbol capabilities to
@@ -173,58 +415,66 @@ def setup_salt_server_capabilities(server: SaltServer, log_level: Optional[int])
         server.lsp.setup_custom_workspace(log_level)  # type: ignore
         server.logger.debug("Replaced workspace with SlsFileWorkspace")
 
+    @server.feature(INITIALIZED)
+    async def initialized(
+        salt_server: SaltServer, params: InitializedParams
+    ) -> None:
+        """Watch the files and index the workspace once the client accepts
+        requests.
+        """
+        del params  # not needed
+        await salt_server.watch_files()
+        if salt_server.index_workspace:
+            await salt_server.index()
+
     @server.feature(
         TEXT_DOCUMENT_COMPLETION,
         CompletionOptions(trigger_characters=["-", "."]),
     )
-    def completions(
+    async def completions(
         salt_server: SaltServer, params: CompletionParams
     ) -> Optional[CompletionList]:
         """Returns completion items."""
         if (
             params.context is not None
             and params.context.trigger_character == "."
-        ):
+        ) and (state_names := salt_server.complete_state_name(params)):
             return CompletionList(
                 is_incomplete=False,
                 items=[
                     CompletionItem(label=sub_name, documentation=docs)
-                    for sub_name, docs in salt_server.complete_state_name(
-                        params
-                    )
+                    for sub_name, docs in state_names
                 ],
             )
 
+        await salt_server.workspace.wait_parsed(params.text_document.uri)
         if (
-            tree := salt_server.workspace.trees.get(params.text_document.uri)
+            index := salt_server.workspace.span_indexes.get(
+                params.text_document.uri
+            )
         ) is None:
             return None
 
-        path = utils.construct_path_to_position(tree, params.position)
+        path = index.path_to_position(params.position)
         if (
             path
             and isinstance(path[-1], IncludesNode)
             or basename(params.text_document.uri) == "top.sls"
             and isinstance(path[-1], StateParameterNode)
         ):
-            file_path = utils.FileUri(params.text_document.uri).path
-            includes = utils.get_sls_includes(file_path)
-            return CompletionList(
-                is_incomplete=False,
-                items=[
-                    CompletionItem(label=f" {include}") for include in includes
-                ],
-            )
+            return salt_server.complete_include(params)
         return None
 
     @server.feature(TEXT_DOCUMENT_DEFINITION)
-    def goto_definition(
+    async def goto_definition(
         salt_server: SaltServer, params: DeclarationParams
     ) -> Optional[Location]:
         uri = params.text_document.uri
-        if (tree := salt_server.workspace.trees.get(uri)) is None:
+        # the states can be in any document
+        await salt_server.workspace.wait_parsed()
+        if (index := salt_server.workspace.span_indexes.get(uri)) is None:
             return None
-        path = utils.construct_path_to_position(tree, params.position)
+        path = index.path_to_position(params.position)
 
         # Going to definition is only handled on requisites ids
         if not isinstance(path[-1], RequisiteNode):
@@ -233,10 +483,48 @@ def setup_salt_server_capabilities(server: SaltServer, log_level: Optional[int])
         if (id_to_find := path[-1].reference) is None:
             return None
 
-        return salt_server.find_id_in_doc_and_includes(id_to_find, uri)
+        return await salt_server.find_id_in_doc_and_includes(id_to_find, uri)
+
+    @server.feature(TEXT_DOCUMENT_REFERENCES)
+    async def references(
+        salt_server: SaltServer, params: ReferenceParams
+    ) -> Optional[List[Location]]:
+        uri = params.text_document.uri
+        # the states can be in any document
+        await salt_server.workspace.wait_parsed()
+        if (index := salt_server.workspace.span_indexes.get(uri)) is None:
+            return None
+        path = index.path_to_position(params.position)
+
+        # References are found for states ids and requisites
+        if not path:
+            return None
+        return await salt_server.find_references(
+            uri, path[-1], params.context.include_declaration
+        )
+
+    @server.feature(WORKSPACE_DID_CHANGE_WATCHED_FILES)
+    def did_change_watched_files(
+        salt_server: SaltServer, params: DidChangeWatchedFilesParams
+    ) -> None:
+        """Drops the files of the included modules, the top directories and
+        the modules that the changes affect.
+        """
+        created_or_deleted = False
+        for change in params.changes:
+            if utils.is_valid_file_uri(change.uri):
+                path = utils.FileUri(change.uri).path
+                salt_server.workspace.include_resolver.invalidate(path)
+                salt_server.workspace.root_finder.invalidate(path)
+                salt_server.workspace.module_index.invalidate(path)
+                created_or_deleted |= change.type != FileChangeType.Changed
+        if created_or_deleted:
+            # a top.sls may have been created or deleted, on its own or
+            # with its directory
+            salt_server.workspace.update_top_paths()
 
     @server.feature(TEXT_DOCUMENT_DID_OPEN)
-    def did_open(
+    async def did_open(
         salt_server: SaltServer, params: DidOpenTextDocumentParams
     ) -> None:
         """Text document did open notification.
@@ -252,14 +540,29 @@ def setup_salt_server_capabilities(server: SaltServer, log_level: Optional[int])
             params.text_document.uri,
         )
         # Ensure the document is finished loading
-        salt_server.workspace.get_text_document(params.text_document.uri)
+        await salt_server.workspace.wait_parsed(params.text_document.uri)
         # Notify the testing client
         salt_server.send_notification("saltLsp/loadingFinished")
 
     @server.feature(TEXT_DOCUMENT_DOCUMENT_SYMBOL)
-    def document_symbol(
+    async def document_symbol(
         salt_server: SaltServer, params: DocumentSymbolParams
     ) -> Optional[Union[List[DocumentSymbol], List[SymbolInformation]]]:
-        return salt_server.workspace.document_symbols.get(
-            params.text_document.uri, []
-        )
+        uri = params.text_document.uri
+        await salt_server.workspace.wait_parsed(uri)
+        return await salt_server.workspace.get_document_symbols(uri) or []
+
+    @server.feature(WORKSPACE_SYMBOL)
+    async def workspace_symbol(
+        salt_server: SaltServer, params: WorkspaceSymbolParams
+    ) -> List[SymbolInformation]:
+        await salt_server.workspace.wait_parsed()
+        return salt_server.workspace.symbol_index.search(params.query)
+
+    @server.feature(MEMORY_USAGE)
+    def memory_usage(
+        salt_server: SaltServer, params: object
+    ) -> Dict[str, Optional[int]]:
+        """Reports the memory usage, to tune the memory budget."""
+        del params  # not needed
+        return salt_server.memory_usage()
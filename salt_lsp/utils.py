@@ -4,45 +4,43 @@ Utility functions to extract data from the files
 
 from __future__ import annotations
 
+import bisect
 from collections.abc import MutableMapping
+from itertools import accumulate
+import operator
 import os
 import os.path
-import shlex
-import subprocess
+import re
+import sys
 from typing import (
+    Any,
+    Callable,
     Dict,
     Generic,
     Iterator,
     List,
     NewType,
     Optional,
+    Tuple,
     TypeVar,
     Union,
+    cast,
 )
 from urllib.parse import urlparse, ParseResult
 
-from lsprotocol.types import Position, Range
+from lsprotocol.types import Position, PositionEncodingKind, Range
 
 from salt_lsp import parser
-from salt_lsp.parser import AstNode, Tree
+from salt_lsp.parser import AstMapNode, AstNode, Tree
 
 
 def get_git_root(path: str) -> Optional[str]:
     """Get the root of the git repository to which `path` belongs.
 
-    If git is not installed or `path` is not in a git repository, then `None`
-    is returned.
+    The closest directory containing ``.git`` is looked up without running
+    git. If `path` is not in a git repository, then `None` is returned.
     """
-    res = subprocess.run(
-        shlex.split("git rev-parse --show-toplevel"),
-        cwd=os.path.dirname(path) if not os.path.isdir(path) else path,
-        check=False,
-        capture_output=True,
-    )
-    if res.returncode == 0:
-        return str(res.stdout.strip(), encoding="utf-8")
-    else:
-        return None
+    return RootFinder().get_git_root(path)
 
 
 def get_top(path: str) -> Optional[str]:
@@ -63,49 +61,346 @@ def get_root(path: str) -> Optional[str]:
     return root or get_git_root(path)
 
 
-def get_sls_includes(path: str) -> List[str]:
+class RootFinder:
+    """Finds the top directory, the closest one containing a ``top.sls``, and
+    the root of the git repository of files and directories.
+
+    Without validation, the result for every directory is cached and
+    :py:meth:`invalidate` must be called whenever a ``top.sls``, a ``.git``
+    or a directory is created or deleted, e.g. on
+    ``workspace/didChangeWatchedFiles`` notifications. With validation,
+    nothing is cached.
+    """
+
+    def __init__(self, validate: bool = True) -> None:
+        #: whether every lookup checks the file system again
+        self.validate = validate
+        #: the top directory of every directory that was looked up
+        self._tops: Dict[str, Optional[str]] = {}
+        #: the git repository root of every directory that was looked up
+        self._git_roots: Dict[str, Optional[str]] = {}
+
+    def _find(
+        self,
+        path: str,
+        is_marker: Callable[[str], bool],
+        marker: str,
+        found_dirs: Dict[str, Optional[str]],
+    ) -> Optional[str]:
+        """Returns the closest directory that contains the marker, starting
+        at the path if it is a directory or at its directory otherwise.
+        """
+        directory = os.path.abspath(path)
+        if not os.path.isdir(directory):
+            directory = os.path.dirname(directory)
+        visited = []
+        found: Optional[str] = None
+        while True:
+            if not self.validate and directory in found_dirs:
+                found = found_dirs[directory]
+                break
+            visited.append(directory)
+            if is_marker(os.path.join(directory, marker)):
+                found = directory
+                break
+            parent = os.path.dirname(directory)
+            if parent == directory:
+                break
+            directory = parent
+        if not self.validate:
+            found_dirs.update(dict.fromkeys(visited, found))
+        return found
+
+    def get_top(self, path: str) -> Optional[str]:
+        """Returns the closest directory containing a ``top.sls``."""
+        return self._find(path, os.path.isfile, "top.sls", self._tops)
+
+    def get_git_root(self, path: str) -> Optional[str]:
+        """Returns the root of the git repository, ``.git`` is a file in
+        worktrees and submodules.
+        """
+        return self._find(path, os.path.exists, ".git", self._git_roots)
+
+    def get_root(self, path: str) -> Optional[str]:
+        """Returns the top directory or the git repository root."""
+        return self.get_top(path) or self.get_git_root(path)
+
+    def invalidate(self, path: str) -> None:
+        """Drops the cached directories that a created or deleted file or
+        directory may affect.
+        """
+        name = os.path.basename(path)
+        if name == "top.sls":
+            self._drop(self._tops, os.path.dirname(path))
+        elif name == ".git":
+            self._drop(self._git_roots, os.path.dirname(path))
+        if not os.path.isfile(path):
+            # possibly a directory with any number of files in it
+            self._drop(self._tops, path)
+            self._drop(self._git_roots, path)
+
+    @staticmethod
+    def _drop(found_dirs: Dict[str, Optional[str]], directory: str) -> None:
+        """Drops the cached directory and the cached directories below it."""
+        prefix = os.path.join(directory, "")
+        for cached in [
+            cached
+            for cached in found_dirs
+            if cached == directory or cached.startswith(prefix)
+        ]:
+            del found_dirs[cached]
+
+    def clear(self) -> None:
+        """Drops all cached directories."""
+        self._tops.clear()
+        self._git_roots.clear()
+
+
+def get_sls_includes(
+    path: str, root_finder: Optional[RootFinder] = None
+) -> List[str]:
+    """Returns the dotted names of the SLS files in the top directory or the
+    git repository of the path.
+
+    :param root_finder: finds the top directory, a new one that does not
+        cache anything is used if not set
+    """
     sls_files = []
-    top = get_root(path)
+    top = (root_finder or RootFinder()).get_root(path)
     if not top:
         return []
     for root, _, files in os.walk(top):
-        base = root[len(top) + 1 :].replace(os.path.sep, ".")
-        sls_files += [
-            base + (file[:-4] if file != "init.sls" else "")
-            for file in files
-            if file.endswith(".sls")
-        ]
+        base = os.path.relpath(root, top).split(os.sep) if root != top else []
+        for file in files:
+            if not file.endswith(".sls"):
+                continue
+            parts = base + [file[:-4]] if file != "init.sls" else base
+            if parts:
+                sls_files.append(".".join(parts))
     return sls_files
 
 
-def construct_path_to_position(tree: Tree, pos: Position) -> List[AstNode]:
-    found_node = None
-    parser_pos = parser.Position(line=pos.line, col=pos.character)
+class SpanIndex:
+    """Index of the spans of the nodes of a tree to find the node containing
+    a position.
 
-    def visitor(node: AstNode) -> bool:
-        if node.start <= parser_pos and (
-            node.end is None or parser_pos <= node.end
-        ):
-            nonlocal found_node
-            found_node = node
-        return True
+    The children of a node are sorted by their start the first time a lookup
+    descends into the node. A lookup then only does a binary search over the
+    children on each level of the tree instead of visiting the whole tree.
+    """
 
-    tree.visit(visitor)
+    def __init__(self, tree: Tree) -> None:
+        #: the indexed tree, which must not be modified afterwards
+        self.tree = tree
+        self._children: Dict[
+            int, Tuple[List[parser.Position], List[Tuple[int, AstNode]]]
+        ] = {}
+
+    def _sorted_children(
+        self, node: AstMapNode
+    ) -> Tuple[List[parser.Position], List[Tuple[int, AstNode]]]:
+        """Returns the starts of the children of the node and the children
+        with their index in :py:meth:`AstMapNode.get_children`, both sorted by
+        the start.
+        """
+        if (children := self._children.get(id(node))) is None:
+            ranked = [
+                (rank, child)
+                for rank, child in enumerate(node.get_children())
+                if child.start is not None
+            ]
+            starts = cast(
+                List[parser.Position], [child.start for _, child in ranked]
+            )
+            # the children are usually in the order of the document already
+            if any(map(operator.gt, starts, starts[1:])):
+                ranked.sort(key=lambda item: (item[1].start, item[0]))
+                starts = cast(
+                    List[parser.Position],
+                    [child.start for _, child in ranked],
+                )
+            children = (starts, ranked)
+            self._children[id(node)] = children
+        return children
+
+    def find(self, pos: parser.Position) -> Optional[AstNode]:
+        """Returns the deepest node containing the position, the last one in
+        the order of :py:meth:`AstNode.visit` if several do.
+        """
+        found: Optional[AstNode] = None
+        if _contains(self.tree, pos):
+            found = self.tree
+
+        node: AstNode = self.tree
+        while isinstance(node, AstMapNode):
+            starts, children = self._sorted_children(node)
+            # siblings do not overlap apart from their bounds, so the
+            # children containing the position precede the insertion point
+            best: Optional[AstNode] = None
+            best_rank = -1
+            i = bisect.bisect_right(starts, pos) - 1
+            while i >= 0 and _contains(children[i][1], pos):
+                rank, child = children[i]
+                if rank > best_rank:
+                    best, best_rank = child, rank
+                i -= 1
+            if best is None:
+                break
+            node = found = best
+        return found
+
+    def path_to_position(self, pos: Position) -> List[AstNode]:
+        """Returns the node containing the position and all its ancestors,
+        starting with the tree.
+        """
+        node = self.find(parser.Position(line=pos.line, col=pos.character))
+        context: List[AstNode] = []
+        while node:
+            context.append(node)
+            node = node.parent
+        context.reverse()
+        return context
+
+
+def _contains(node: AstNode, pos: parser.Position) -> bool:
+    return (
+        node.start is not None
+        and node.start <= pos
+        and (node.end is None or pos <= node.end)
+    )
 
-    if not found_node:
-        return []
 
-    context: List[AstNode] = []
-    node: Optional[AstNode] = found_node
-    while node:
-        context.insert(0, node)
-        node = node.parent
-    return context
+def construct_path_to_position(tree: Tree, pos: Position) -> List[AstNode]:
+    """Returns the node of the tree containing the position and all its
+    ancestors, starting with the tree.
+
+    Use a :py:class:`SpanIndex` to look up several positions in one tree.
+    """
+    return SpanIndex(tree).path_to_position(pos)
 
 
 def position_to_index(text: str, line: int, column: int) -> int:
-    split = text.splitlines(keepends=True)
-    return sum([len(l) for i, l in enumerate(split) if i < line]) + column
+    return sum(map(len, text.splitlines(keepends=True)[:line])) + column
+
+
+#: the characters ending the lines split by :py:meth:`str.splitlines`
+LINE_ENDINGS = "\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029"
+
+_LINE_END = re.compile(f"\r\n|[{LINE_ENDINGS}]")
+
+
+class LineOffsets:
+    """The offsets at which the lines of a text start, for the conversion
+    between positions and offsets. The lines are split like
+    :py:meth:`str.splitlines` does, a line ending at the end of the text
+    starts an empty last line.
+
+    A change of the text only scans the changed lines. The offsets of the
+    lines after them are shifted lazily, only once a change is made
+    elsewhere, so that typing on a line does not touch the following lines.
+    """
+
+    def __init__(self, text: str) -> None:
+        self._starts = list(
+            accumulate(map(len, text.splitlines(keepends=True)), initial=0)
+        )
+        if text and text[-1] not in LINE_ENDINGS:
+            # the end of the last line does not start another one
+            self._starts.pop()
+        self._length = len(text)
+        #: the offsets from this index on are off by the shift
+        self._shift_from = len(self._starts)
+        self._shift = 0
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def _apply_shift(self) -> None:
+        if self._shift:
+            self._starts[self._shift_from :] = [
+                start + self._shift
+                for start in self._starts[self._shift_from :]
+            ]
+        self._shift_from = len(self._starts)
+        self._shift = 0
+
+    def line_start(self, line: int) -> int:
+        """Returns the offset of the start of the line, the length of the text
+        for the lines after the last one.
+        """
+        if line >= len(self._starts):
+            return self._length
+        start = self._starts[line]
+        return start + self._shift if line >= self._shift_from else start
+
+    def line_at(self, offset: int) -> int:
+        """Returns the line containing the offset."""
+        self._apply_shift()
+        return max(bisect.bisect_right(self._starts, offset) - 1, 0)
+
+    def replace(
+        self, text: str, start_line: int, end_line: int, delta: int
+    ) -> None:
+        """Updates the offsets once a range of the text was replaced.
+
+        :param text: the new text
+        :param start_line: the line of the start of the replaced range
+        :param end_line: the line of the end of the replaced range, which is
+            before its line ending
+        :param delta: the length of the new text minus the old one
+        """
+        # a line ending at the end of the previous line can merge with the
+        # inserted text, e.g. \r with \n
+        first = max(start_line - 1, 0)
+        old_end = min(end_line + 2, len(self._starts))
+        scan_start = self.line_start(first)
+        scan_end = (
+            self.line_start(end_line + 1) + delta
+            if end_line + 1 < len(self._starts)
+            else len(text)
+        )
+        if self._shift and not first < self._shift_from <= old_end:
+            self._apply_shift()
+            shift = delta
+        else:
+            shift = self._shift + delta
+
+        new_starts = [
+            match.end()
+            for match in _LINE_END.finditer(text, scan_start, scan_end)
+        ]
+        self._starts[first + 1 : old_end] = new_starts
+        self._shift_from = first + 1 + len(new_starts)
+        self._shift = shift if self._shift_from < len(self._starts) else 0
+        self._length = len(text)
+
+
+def to_client_units(text: str, encoding: Optional[str]) -> int:
+    """Returns the length of the text in the code units of the position
+    encoding of the client, UTF-16 if it is not set.
+    """
+    if encoding == PositionEncodingKind.Utf32 or text.isascii():
+        return len(text)
+    if encoding == PositionEncodingKind.Utf8:
+        return len(text.encode("utf-8", errors="surrogatepass"))
+    return len(text.encode("utf-16-le", errors="surrogatepass")) // 2
+
+
+def from_client_units(text: str, units: int, encoding: Optional[str]) -> int:
+    """Returns the number of characters at the start of the text that span
+    the code units of the position encoding of the client, at most the
+    length of the text. A character is only counted if all its code units
+    are.
+    """
+    if encoding == PositionEncodingKind.Utf32 or text.isascii():
+        return min(units, len(text))
+    codec, width = (
+        ("utf-8", 1)
+        if encoding == PositionEncodingKind.Utf8
+        else ("utf-16-le", 2)
+    )
+    encoded = text.encode(codec, errors="surrogatepass")
+    return len(encoded[: units * width].decode(codec, errors="ignore"))
 
 
 T = TypeVar("T")
@@ -128,32 +423,75 @@ def get_last_element_of_iterator(iterator: Iterator[T]) -> Optional[T]:
 Uri = NewType("Uri", str)
 
 
+#: number of distinct URIs and paths whose parsed URI is cached
+_MAX_PARSED_URIS = 100_000
+
+#: the parsed file:// URI of each URI or path and its canonical string
+_parsed_uris: Dict[str, Tuple[ParseResult, str]] = {}
+
+
+def _parse_uri(uri: str) -> Tuple[ParseResult, str]:
+    """
+    Returns the parsed file:// URI of a URI or a path and its canonical
+    string, which is interned. Both are computed once per distinct string.
+    """
+    if (parsed := _parsed_uris.get(uri)) is not None:
+        return parsed
+    parse_res = urlparse(uri)
+    if parse_res.scheme not in ("", "file"):
+        raise ValueError(f"Invalid uri scheme {parse_res.scheme}")
+    if parse_res.scheme == "":
+        parse_res = urlparse("file://" + parse_res.path)
+    if len(_parsed_uris) >= _MAX_PARSED_URIS:
+        _parsed_uris.clear()
+    parsed = _parsed_uris[uri] = (parse_res, sys.intern(parse_res.geturl()))
+    return parsed
+
+
 class FileUri:
     """Simple class for handling file:// URIs"""
 
     def __init__(self, uri: Union[str, Uri, FileUri]) -> None:
-        self._parse_res: ParseResult = (
-            uri._parse_res if isinstance(uri, FileUri) else urlparse(uri)
-        )
-        if self._parse_res.scheme not in ("", "file"):
-            raise ValueError(f"Invalid uri scheme {self._parse_res.scheme}")
-        if self._parse_res.scheme == "":
-            self._parse_res = urlparse("file://" + self._parse_res.path)
+        self._parse_res: ParseResult
+        self._uri: str
+        if isinstance(uri, FileUri):
+            self._parse_res, self._uri = uri._parse_res, uri._uri
+        else:
+            self._parse_res, self._uri = _parse_uri(uri)
 
     @property
     def path(self) -> str:
         return self._parse_res.path
 
     def __str__(self) -> str:
-        return self._parse_res.geturl()
+        return self._uri
 
 
 U = Union[Uri, FileUri, str]
 
 
+def canonical_uri(uri: U) -> str:
+    """
+    Returns the canonical file:// URI of a URI, a path or a FileUri, which
+    is the same string object for all of them.
+
+    :raises ValueError: if the URI is not a file:// URI
+    """
+    if isinstance(uri, FileUri):
+        return uri._uri  # pylint: disable=protected-access
+    return _parse_uri(uri)[1]
+
+
+#: marks the keys that a :py:class:`UriDict` does not contain
+_MISSING: Any = object()
+
+
 class UriDict(Generic[T], MutableMapping):
     """Dictionary that stores elements assigned to paths which are then
     transparently accessible via their Uri or the path or the FileUri.
+
+    The elements are stored by their canonical URI, which most callers pass
+    already, so that these lookups take a single probe of the dictionary.
     """
 
     def __init__(self, *args, **kwargs):
@@ -161,7 +499,9 @@ class UriDict(Generic[T], MutableMapping):
         self.update(dict(*args, **kwargs))
 
     def __getitem__(self, key: U) -> T:
-        return self._data[self._key_gen(key)]
+        if (value := self._lookup(key)) is _MISSING:
+            raise KeyError(key)
+        return value
 
     def __setitem__(self, key: U, value: T) -> None:
         self._data[self._key_gen(key)] = value
@@ -175,8 +515,93 @@ class UriDict(Generic[T], MutableMapping):
     def __len__(self):
         return len(self._data)
 
+    def __contains__(self, key: object) -> bool:
+        return self._lookup(cast(U, key)) is not _MISSING
+
+    def get(self, key: U, default=None):
+        if (value := self._lookup(key)) is _MISSING:
+            return default
+        return value
+
+    def _lookup(self, key: U) -> Any:
+        if isinstance(key, FileUri):
+            return self._data.get(canonical_uri(key), _MISSING)
+        # canonical URIs are found right away, other keys are normalized
+        if (value := self._data.get(key, _MISSING)) is _MISSING:
+            value = self._data.get(canonical_uri(key), _MISSING)
+        return value
+
     def _key_gen(self, key: U) -> str:
-        return str(FileUri(key))
+        return canonical_uri(key)
+
+
+class _PathTrieNode(Generic[T]):
+    __slots__ = ("children", "value", "has_value")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, _PathTrieNode[T]] = {}
+        self.value: Optional[T] = None
+        self.has_value = False
+
+
+class PathTrie(Generic[T]):
+    """Trie of the components of absolute paths, which finds the longest of
+    its paths that contains a path in the number of components of that path.
+    """
+
+    def __init__(self) -> None:
+        self._root: _PathTrieNode[T] = _PathTrieNode()
+        self._len = 0
+
+    @staticmethod
+    def _components(path: str) -> List[str]:
+        return [part for part in path.split("/") if part not in ("", ".")]
+
+    def insert(self, path: str, value: T) -> None:
+        """Assigns a value to a path, replacing its previous value."""
+        node = self._root
+        for part in self._components(path):
+            node = node.children.setdefault(part, _PathTrieNode())
+        if not node.has_value:
+            self._len += 1
+        node.value, node.has_value = value, True
+
+    def remove(self, path: str) -> None:
+        """Drops the value of a path if it has one."""
+        nodes = [self._root]
+        parts = self._components(path)
+        for part in parts:
+            if (child := nodes[-1].children.get(part)) is None:
+                return
+            nodes.append(child)
+        if not nodes[-1].has_value:
+            return
+        nodes[-1].value, nodes[-1].has_value = None, False
+        self._len -= 1
+        # prune the nodes that lead nowhere anymore
+        for part, parent, node in zip(
+            reversed(parts), reversed(nodes[:-1]), reversed(nodes)
+        ):
+            if node.has_value or node.children:
+                break
+            del parent.children[part]
+
+    def longest_prefix(self, path: str) -> Optional[T]:
+        """Returns the value of the longest path that the path is or is in,
+        None if there is none.
+        """
+        node = self._root
+        found = node.value if node.has_value else None
+        for part in self._components(path):
+            if (child := node.children.get(part)) is None:
+                break
+            node = child
+            if node.has_value:
+                found = node.value
+        return found
+
+    def __len__(self) -> int:
+        return self._len
 
 
 def is_valid_file_uri(uri: str) -> bool:
@@ -197,3 +622,23 @@ def ast_node_to_range(node: AstNode) -> Optional[Range]:
     if node.start is None or node.end is None:
         return None
     return Range(start=node.start.to_lsp_pos(), end=node.end.to_lsp_pos())
+
+
+def resident_memory() -> Optional[int]:
+    """
+    Returns the resident set size of the process in bytes, or its peak where
+    the current size is not available, None if neither is.
+    """
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        # not available on Windows
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # in kilobytes, except on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
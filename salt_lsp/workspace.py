@@ -2,36 +2,330 @@
 contents utilizing the existing Workspace implementation from pygls.
 
 """
-from logging import WARNING, getLogger, Logger, DEBUG
-from pathlib import Path
-import sys
-from typing import List, Optional, Union
+import asyncio
+import os.path
+from collections import OrderedDict
+from concurrent.futures import CancelledError, Executor, Future
+from logging import WARNING, getLogger, Logger
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
 from lsprotocol import types
 from pygls.protocol import LanguageServerProtocol
-from pygls.workspace import Workspace
+from pygls.workspace import TextDocument, Workspace
 
 from salt_lsp.base_types import CompletionsDict, SLS_LANGUAGE_ID
-from salt_lsp.utils import UriDict, FileUri, get_top
-from salt_lsp.parser import parse, Tree
+from salt_lsp.disk_cache import DiskTreeCache
+from salt_lsp.include_graph import IncludeGraph, IncludeResolver, ModuleIndex
+from salt_lsp.index import RequisiteIndex, WorkspaceSymbolIndex
+from salt_lsp.utils import (
+    UriDict,
+    FileUri,
+    LINE_ENDINGS,
+    LineOffsets,
+    PathTrie,
+    RootFinder,
+    SpanIndex,
+    canonical_uri,
+    from_client_units,
+    is_valid_file_uri,
+    to_client_units,
+)
+from salt_lsp.parser import parse, reparse, Tree
 from salt_lsp.document_symbols import tree_to_document_symbols
 
 
-if sys.version_info[1] <= 8:
+T = TypeVar("T")
 
-    def is_relative_to(p1: Path, p2: Path) -> bool:
-        # stolen from CPython's source
-        """Return True if the path is relative to another path or False."""
+#: estimated memory used by a tracked document per character of its content,
+#: for its tree, its span index and its source
+DOCUMENT_BYTES_PER_CHAR = 14
+
+#: the lines changed in a document: the first line, the end of the changed
+#: lines before and after the change
+ChangedLines = Tuple[int, int, int]
+
+
+def merge_changed_lines(
+    first: ChangedLines, second: ChangedLines
+) -> ChangedLines:
+    """Returns the lines changed by two consecutive changes of a document.
+
+    :param first: the lines changed by the first change
+    :param second: the lines changed by the second change, in the document
+        after the first change
+    :return: the changed lines of the document before the first change and
+        of the document after the second change
+    """
+    start, old_end, new_end = first
+    second_start, second_old_end, second_new_end = second
+    return (
+        min(start, second_start),
+        # the lines after the first change moved by new_end - old_end
+        max(old_end, second_old_end - (new_end - old_end)),
+        # as did the lines after the second change
+        (
+            new_end + second_new_end - second_old_end
+            if new_end >= second_old_end
+            else second_new_end
+        ),
+    )
+
+
+def parse_document(
+    source: str,
+    base: Union[None, Tree, "Future[Tree]"] = None,
+    lines: Optional[ChangedLines] = None,
+    tree_cache: Optional[DiskTreeCache] = None,
+    path: Optional[str] = None,
+) -> Tree:
+    """Parses a document, this runs in the parse executor.
+
+    :param source: the content of the document
+    :param base: the tree that ``lines`` changed, or the job parsing it
+    :param lines: the lines changed since ``base``, the document is parsed
+        from scratch if not set
+    :param tree_cache: the disk cache to load the tree from
+    :param path: the path of the document in the disk cache
+    """
+    if isinstance(base, Future):
         try:
-            p1.relative_to(p2)
-            return True
-        except ValueError:
-            return False
+            base = base.result()
+        # the failure of the job is reported when it finishes
+        except (CancelledError, Exception):  # pylint: disable=broad-except
+            base = None
+    if base is not None and lines is not None:
+        tree = reparse(base, source, *lines)
+    elif tree_cache is not None and path is not None:
+        tree = tree_cache.parse(path, source)
+    else:
+        tree = parse(source)
+    return tree
+
+
+def read_document(
+    path: str,
+    tree_cache: Optional[DiskTreeCache] = None,
+) -> Optional[Tuple[str, Tree]]:
+    """Reads and parses a file, this runs in the parse executor.
+
+    :return: the content of the file and its tree, None if the file cannot be
+        read
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as sls_file:
+            source = sls_file.read(-1)
+    except (OSError, UnicodeDecodeError) as err:
+        getLogger(__name__).warning("Cannot read '%s': %s", path, err)
+        return None
+    return source, parse_document(source, tree_cache=tree_cache, path=path)
+
+
+class DocumentSymbols(
+    Mapping[Union[str, FileUri], List[types.DocumentSymbol]]
+):
+    """The document symbols of the tracked documents.
+
+    They are only built when they are looked up, e.g. for the outline of an
+    open document, and cached per document and version, so that the files
+    loaded via includes or by the workspace indexer only cost a parse.
+    """
+
+    def __init__(
+        self,
+        trees: Mapping[Union[str, FileUri], Tree],
+        versions: UriDict[int],
+        state_name_completions: CompletionsDict,
+    ) -> None:
+        self._trees = trees
+        self._versions = versions
+        self._state_name_completions = state_name_completions
+        #: the version of each document and its document symbols
+        self._cache: UriDict[
+            Tuple[Optional[int], List[types.DocumentSymbol]]
+        ] = UriDict()
+        #: the tree whose document symbols are being built in an executor
+        self._building: UriDict[Tree] = UriDict()
+
+    def __getitem__(
+        self, uri: Union[str, FileUri]
+    ) -> List[types.DocumentSymbol]:
+        tree = self._trees[uri]
+        if (symbols := self._cached(uri)) is not None:
+            return symbols
+        symbols = tree_to_document_symbols(tree, self._state_name_completions)
+        self._cache[uri] = (self._versions.get(uri), symbols)
+        return symbols
+
+    def _cached(
+        self, uri: Union[str, FileUri]
+    ) -> Optional[List[types.DocumentSymbol]]:
+        cached = self._cache.get(uri)
+        if cached is not None and cached[0] == self._versions.get(uri):
+            return cached[1]
+        return None
+
+    async def build(
+        self, uri: Union[str, FileUri], tree: Tree, executor: Executor
+    ) -> List[types.DocumentSymbol]:
+        """Like looking the document symbols up, but builds them in the
+        executor if they are not cached.
+
+        :param tree: the current tree of the document
+        """
+        if (symbols := self._cached(uri)) is not None:
+            return symbols
+        version = self._versions.get(uri)
+        self._building[uri] = tree
+        try:
+            symbols = await asyncio.get_running_loop().run_in_executor(
+                executor,
+                tree_to_document_symbols,
+                tree,
+                self._state_name_completions,
+            )
+        finally:
+            # the document changed in the meantime if it was invalidated
+            current = self._building.get(uri) is tree
+            if current:
+                del self._building[uri]
+        if current and self._versions.get(uri) == version:
+            self._cache[uri] = (version, symbols)
+        return symbols
+
+    def __iter__(self) -> Iterator[Union[str, FileUri]]:
+        return iter(self._trees)
 
-else:
+    def __len__(self) -> int:
+        return len(self._trees)
 
-    def is_relative_to(p1: Path, p2: Path) -> bool:
-        return p1.is_relative_to(p2)
+    def invalidate(self, uri: Union[str, FileUri]) -> None:
+        """Drops the cached document symbols of a document."""
+        self._cache.pop(uri, None)
+        self._building.pop(uri, None)
+
+
+class _ReloadingView(Mapping[Union[str, FileUri], T]):
+    """Read-only view of something derived from the tracked documents, e.g.
+    their trees, that transparently reloads the evicted documents.
+    """
+
+    def __init__(self, workspace: "SlsFileWorkspace", data: UriDict[T]):
+        self._workspace = workspace
+        self._data = data
+
+    def __getitem__(self, uri: Union[str, FileUri]) -> T:
+        # pylint: disable=protected-access
+        self._workspace._use(uri)
+        return self._data[uri]
+
+    def __contains__(self, uri: object) -> bool:
+        # pylint: disable=protected-access
+        return uri in self._data or self._workspace._is_evicted(uri)
+
+    def __iter__(self) -> Iterator[str]:
+        # pylint: disable=protected-access
+        yield from self._data
+        yield from self._workspace._evicted
+
+    def __len__(self) -> int:
+        # pylint: disable=protected-access
+        return len(self._data) + len(self._workspace._evicted)
+
+
+class SlsTextDocument(TextDocument):
+    """Text document keeping the offsets of its lines, so that neither the
+    conversion of positions to offsets nor an incremental change splits the
+    whole document into lines.
+
+    The columns are converted between the position encoding of the client
+    and characters within their line only.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._line_offsets: Optional[LineOffsets] = None
+
+    @property
+    def line_offsets(self) -> LineOffsets:
+        """The offsets of the lines, built when they are first needed."""
+        if self._line_offsets is None:
+            self._line_offsets = LineOffsets(self.source)
+        return self._line_offsets
+
+    def line_text(self, line: int) -> str:
+        """Returns the text of a line without its line ending."""
+        offsets = self.line_offsets
+        return self.source[
+            offsets.line_start(line) : offsets.line_start(line + 1)
+        ].rstrip(LINE_ENDINGS)
+
+    def _line_and_offset(self, position: types.Position) -> Tuple[int, int]:
+        """Returns the line and the offset of a position in client units,
+        clamped to the end of its line and to the end of the document.
+        """
+        offsets = self.line_offsets
+        if position.line >= len(offsets):
+            return len(offsets) - 1, len(self.source)
+        column = from_client_units(
+            self.line_text(position.line),
+            position.character,
+            self.position_codec.encoding,
+        )
+        return position.line, offsets.line_start(position.line) + column
+
+    def offset_at_position(self, client_position: types.Position) -> int:
+        return self._line_and_offset(client_position)[1]
+
+    def position_at_offset(self, offset: int) -> types.Position:
+        """Returns the position of an offset in client units."""
+        offsets = self.line_offsets
+        line = offsets.line_at(offset)
+        return types.Position(
+            line=line,
+            character=to_client_units(
+                self.source[offsets.line_start(line) : offset],
+                self.position_codec.encoding,
+            ),
+        )
+
+    def _apply_incremental_change(
+        self, change: types.TextDocumentContentChangeEvent_Type1
+    ) -> None:
+        start_line, start = self._line_and_offset(change.range.start)
+        end_line, end = self._line_and_offset(change.range.end)
+        if end < start:
+            end_line, end = start_line, start
+        source = self.source
+        self._source = source[:start] + change.text + source[end:]
+        self.line_offsets.replace(
+            self._source, start_line, end_line, len(change.text) - end + start
+        )
+
+    def _apply_full_change(
+        self, change: types.TextDocumentContentChangeEvent
+    ) -> None:
+        super()._apply_full_change(change)
+        self._line_offsets = None
+
+
+class _ParseJob(NamedTuple):
+    #: the version of the document that is parsed
+    version: Optional[int]
+    future: "Future[Tree]"
+    #: done once the result is applied to the workspace
+    applied: "asyncio.Future[Tree]"
 
 
 class SlsFileWorkspace(Workspace):
@@ -43,21 +337,99 @@ class SlsFileWorkspace(Workspace):
     """
 
     def __init__(
-        self, state_name_completions: CompletionsDict, *args, log_level: Optional[int] = None, **kwargs
+        self,
+        state_name_completions: CompletionsDict,
+        *args,
+        log_level: Optional[int] = None,
+        tree_cache: Optional[DiskTreeCache] = None,
+        parse_delay: float = 0.0,
+        parse_executor: Optional[Executor] = None,
+        memory_budget: Optional[int] = None,
+        **kwargs,
     ) -> None:
         #: dictionary containing the parsed contents of all tracked documents
         self._trees: UriDict[Tree] = UriDict()
 
-        #: document symbols of all tracked documents
-        self._document_symbols: UriDict[List[types.DocumentSymbol]] = UriDict()
+        #: version of the document that each tree was parsed from
+        self._tree_versions: UriDict[int] = UriDict()
 
-        #: included FileUris of every tracked document
-        self._includes: UriDict[List[FileUri]] = UriDict()
+        #: seconds without changes after which a changed document is parsed
+        self.parse_delay = parse_delay
+
+        #: the changed documents that are not parsed yet, with the lines
+        #: changed since their tree was parsed or None to parse them anew
+        self._pending_changes: UriDict[Optional[ChangedLines]] = UriDict()
+
+        #: the scheduled parse of every pending document
+        self._parse_timers: UriDict[asyncio.TimerHandle] = UriDict()
+
+        #: runs the parse jobs off the event loop if set
+        self._parse_executor = parse_executor
+
+        #: the running parse job of each document
+        self._parse_jobs: UriDict[_ParseJob] = UriDict()
+
+        #: the running resolution of the includes of each document
+        self._include_tasks: Dict[str, asyncio.Task] = {}
+
+        #: the running reload of each evicted or closed document
+        self._load_tasks: Dict[str, asyncio.Task] = {}
+
+        #: span index of the tree of every tracked document
+        self._span_indexes: UriDict[SpanIndex] = UriDict()
+
+        #: the trees and span indexes that reload the evicted documents
+        self._tree_view = _ReloadingView(self, self._trees)
+        self._span_index_view = _ReloadingView(self, self._span_indexes)
+
+        #: index of the symbols of all tracked documents
+        self._symbol_index = WorkspaceSymbolIndex()
+
+        #: index of the requisites of all tracked documents by their target
+        self._requisite_index = RequisiteIndex()
+
+        #: document symbols of all tracked documents, built on demand
+        self._document_symbols = DocumentSymbols(
+            self._tree_view, self._tree_versions, state_name_completions
+        )
+
+        #: graph of the includes of all tracked documents
+        self._include_graph = IncludeGraph()
+
+        #: cache of the files that the included modules resolve to
+        self._include_resolver = IncludeResolver()
+
+        #: cache of the top directories and git roots of the directories
+        self._root_finder = RootFinder()
+
+        #: the modules of the root directories to complete includes
+        self._module_index = ModuleIndex()
 
         #: top path corresponding to every workspace folder
         self._top_paths: UriDict[Optional[FileUri]] = UriDict()
+
+        #: the URI and top path of every workspace folder by its path
+        self._folder_trie: PathTrie[Tuple[FileUri, Optional[FileUri]]] = (
+            PathTrie()
+        )
         self._state_name_completions = state_name_completions
 
+        #: cache of the trees of the files loaded from the disk
+        self._tree_cache = tree_cache
+
+        #: estimated bytes that the documents which are not open in the
+        #: editor may use, unlimited if not set
+        self.memory_budget = memory_budget
+
+        #: estimated size of each document that is not open in the editor,
+        #: least recently used first, the open ones are never evicted
+        self._loaded_sizes: OrderedDict[str, int] = OrderedDict()
+        self._loaded_size = 0
+
+        #: the documents whose tree was evicted to stay within the budget,
+        #: they are still in the indexes and the include graph
+        self._evicted: Set[str] = set()
+
         self.logger: Logger = getLogger(self.__class__.__name__)
         # FIXME: make this configurable
         self.logger.setLevel(log_level or WARNING)
@@ -65,112 +437,423 @@ class SlsFileWorkspace(Workspace):
         super().__init__(*args, **kwargs)
 
     @property
-    def trees(self) -> UriDict[Tree]:
+    def trees(self) -> Mapping[Union[str, FileUri], Tree]:
         """A dictionary which contains the parsed :ref:`Tree` for each document
-        tracked by the workspace.
+        tracked by the workspace. The evicted documents are read and parsed
+        again when they are looked up.
         """
-        return self._trees
+        return self._tree_view
 
     @property
-    def document_symbols(self) -> UriDict[List[types.DocumentSymbol]]:
-        """The document symbols of each SLS files in the workspace."""
+    def span_indexes(self) -> Mapping[Union[str, FileUri], SpanIndex]:
+        """The :ref:`SpanIndex` of the tree of each document, to find the
+        nodes at positions in it.
+        """
+        return self._span_index_view
+
+    @property
+    def symbol_index(self) -> WorkspaceSymbolIndex:
+        """The index of the symbols of all documents in the workspace."""
+        return self._symbol_index
+
+    @property
+    def requisite_index(self) -> RequisiteIndex:
+        """The index of the requisites of all documents in the workspace by
+        the states that they refer to.
+        """
+        return self._requisite_index
+
+    @property
+    def document_symbols(self) -> DocumentSymbols:
+        """The document symbols of each SLS files in the workspace, they are
+        only built once they are looked up.
+        """
         return self._document_symbols
 
     @property
-    def includes(self) -> UriDict[List[FileUri]]:
-        """The list of includes of each SLS file in the workspace."""
-        return self._includes
+    def includes(self) -> IncludeGraph:
+        """The list of the direct and indirect includes of each SLS file in
+        the workspace.
+        """
+        return self._include_graph
 
-    def _resolve_includes(
-        self, text_document_uri: Union[str, FileUri]
-    ) -> None:
-        if (
-            (tree := self._trees[text_document_uri]) is None
-            or tree.includes is None
-            or len(tree.includes.includes) == 0
+    @property
+    def include_resolver(self) -> IncludeResolver:
+        """The cache of the files that the included modules resolve to. The
+        server disables its validation once the client watches the files.
+        """
+        return self._include_resolver
+
+    @property
+    def root_finder(self) -> RootFinder:
+        """The cache of the top directories and git roots. The server disables
+        its validation once the client watches the files.
+        """
+        return self._root_finder
+
+    @property
+    def module_index(self) -> ModuleIndex:
+        """The index of the modules of the root directories. The server
+        disables its validation once the client watches the files.
+        """
+        return self._module_index
+
+    @property
+    def sls_roots(self) -> List[str]:
+        """The paths of the state trees in the workspace: the top path of
+        every workspace folder or the folder itself if it has no top path.
+        The root path is used if there are no workspace folders.
+        """
+        roots = [
+            (
+                top_path.path
+                if (top_path := self._top_paths.get(folder_uri)) is not None
+                else FileUri(folder_uri).path
+            )
+            for folder_uri in self._folders
+        ]
+        if not roots and self.root_path:
+            roots.append(self.root_path)
+        return roots
+
+    @property
+    def loaded_size(self) -> int:
+        """The estimated bytes used by the documents that are not open in the
+        editor, see :py:attr:`memory_budget`.
+        """
+        return self._loaded_size
+
+    def _direct_includes(self, uri: Union[str, FileUri]) -> List[FileUri]:
+        if (tree := self.trees.get(uri)) is None or tree.includes is None:
+            return []
+
+        top = self._get_top_of_document(uri)
+        return [
+            FileUri(f)
+            for incl in tree.includes.includes
+            if (f := self._include_resolver.resolve(top, incl.value))
+            is not None
+        ]
+
+    def _is_tracked(self, uri: Union[str, FileUri]) -> bool:
+        """Whether the document has a tree or is about to get one."""
+        return (
+            uri in self._trees
+            or uri in self._pending_changes
+            or uri in self._parse_jobs
+            or self._is_evicted(uri)
+        )
+
+    def _is_evicted(self, uri: object) -> bool:
+        if not self._evicted or not isinstance(uri, (str, FileUri)):
+            return False
+        try:
+            return canonical_uri(uri) in self._evicted
+        except ValueError:
+            return False
+
+    def _add_loaded(self, uri: Union[str, FileUri], source: str) -> None:
+        """Tracks a document that is not open in the editor and evicts the
+        least recently used ones if they exceed the memory budget.
+        """
+        key = canonical_uri(uri)
+        size = len(source) * DOCUMENT_BYTES_PER_CHAR
+        self._loaded_size += size - self._loaded_sizes.pop(key, 0)
+        self._loaded_sizes[key] = size
+        self._evict()
+
+    def _forget_loaded(self, uri: Union[str, FileUri]) -> None:
+        if not self._loaded_sizes and not self._evicted:
+            return
+        key = canonical_uri(uri)
+        self._loaded_size -= self._loaded_sizes.pop(key, 0)
+        self._evicted.discard(key)
+
+    def _evict(self) -> None:
+        if self.memory_budget is None:
+            return
+        # the document that was just used is kept in any case
+        while (
+            self._loaded_size > self.memory_budget
+            and len(self._loaded_sizes) > 1
         ):
+            key, size = self._loaded_sizes.popitem(last=False)
+            self._loaded_size -= size
+            self.logger.debug("evicting document '%s'", key)
+            self._unload(key)
+            super().remove_text_document(key)
+
+    def _unload(self, key: str) -> None:
+        """Drops the tree of a document, which stays in the indexes and the
+        include graph until it is reloaded from the disk.
+        """
+        self._evicted.add(key)
+        self._trees.pop(key, None)
+        self._span_indexes.pop(key, None)
+        self._tree_versions.pop(key, None)
+        self._document_symbols.invalidate(key)
+        self._symbol_index.flush(key)
+        self._requisite_index.flush(key)
+
+    def _use(self, uri: Union[str, FileUri]) -> None:
+        """Marks a document as used, reading and parsing it again if it was
+        evicted.
+        """
+        if not self._loaded_sizes and not self._evicted:
             return
+        key = canonical_uri(uri)
+        if key in self._loaded_sizes:
+            self._loaded_sizes.move_to_end(key)
+            return
+        if key not in self._evicted:
+            return
+        self.logger.debug("reloading the evicted document '%s'", key)
+        self._reload(key, read_document(FileUri(key).path, self._tree_cache))
+
+    async def load(self, uri: Union[str, FileUri]) -> None:
+        """Like :py:meth:`_use`, but reads and parses an evicted document in
+        the parse executor. Await this before accessing the tree of a
+        document that is not open in the editor from a request handler.
+        """
+        key = canonical_uri(uri)
+        if key in self._evicted and key not in self._load_tasks:
+            self._schedule_load(key)
+        if (task := self._load_tasks.get(key)) is not None:
+            await asyncio.wait([task])
+        self._use(key)
 
-        ws_folder = self._get_workspace_of_document(text_document_uri)
+    async def _load(self, key: str) -> None:
+        self.logger.debug("reloading the evicted document '%s'", key)
+        loaded = await asyncio.get_running_loop().run_in_executor(
+            self._parse_executor,
+            read_document,
+            FileUri(key).path,
+            self._tree_cache,
+        )
+        # the document may have been opened or reloaded in the meantime
+        if key in self._evicted:
+            self._reload(key, loaded)
+
+    def _schedule_load(self, key: str) -> None:
         if (
-            ws_folder in self._top_paths
-            and self._top_paths[ws_folder] is not None
+            self._parse_executor is None
+            or (loop := self._running_loop()) is None
         ):
-            top_path = self._top_paths[ws_folder]
-        else:
-            top_path = ws_folder
+            self._use(key)
+            return
+        task = loop.create_task(self._load(key))
+        self._load_tasks[key] = task
+        task.add_done_callback(lambda _: self._load_tasks.pop(key, None))
 
-        assert top_path is not None
+    def _reload(self, key: str, loaded: Optional[Tuple[str, Tree]]) -> None:
+        """Puts the content read from the disk back in place of an evicted or
+        closed document.
+        """
+        self._evicted.discard(key)
+        if loaded is None:
+            self._include_graph.remove(key)
+            self._symbol_index.remove(key)
+            self._requisite_index.remove(key)
+            return
+        self._add_included_file(FileUri(key), *loaded)
+        # the file may have been changed since it was evicted
+        self._include_graph.set_includes(key, self._direct_includes(key))
 
-        self._includes[text_document_uri] = [
-            FileUri(f)
-            for incl in tree.includes.includes
-            if (f := incl.get_file(FileUri(top_path).path)) is not None
-        ]
+    def _add_included_file(
+        self, uri: FileUri, source: str, tree: Tree
+    ) -> bool:
+        if self._is_tracked(uri):
+            return False
+        super().put_text_document(
+            types.TextDocumentItem(
+                uri=str(uri),
+                language_id=SLS_LANGUAGE_ID,
+                version=0,
+                text=source,
+            )
+        )
+        added = self._set_tree(str(uri), tree, 0)
+        self._add_loaded(uri, source)
+        return added
 
-        new_includes = self._includes[text_document_uri]
+    def _untracked_includes(self, uri: FileUri) -> List[FileUri]:
+        """Updates the includes of the document in the include graph and
+        returns the included documents that are not tracked yet.
+        """
+        includes = self._direct_includes(uri)
+        self._include_graph.set_includes(uri, includes)
+        untracked = [inc for inc in includes if not self._is_tracked(inc)]
+        for inc in untracked:
+            self.logger.debug(
+                "Adding file '%s' via includes of '%s'", inc, uri
+            )
+        return untracked
 
-        # now try to re-read all the trees if they are not present:
-        for inc in self._includes[text_document_uri]:
-            if inc not in self._trees:
-                self.logger.debug(
-                    "Adding file '%s' via includes of '%s'",
-                    inc,
-                    text_document_uri,
-                )
-                with open(inc.path, "r") as inc_file:
-                    self.put_text_document(
-                        types.TextDocumentItem(
-                            uri=str(inc),
-                            language_id=SLS_LANGUAGE_ID,
-                            version=0,
-                            text=inc_file.read(-1),
-                        )
-                    )
-                self._resolve_includes(inc)
+    def _warn_about_include_cycle(self, uri: Union[str, FileUri]) -> None:
+        if cycle := self._include_graph.cycle(uri):
+            self.logger.warning(
+                "'%s' is part of an include cycle: %s", uri, ", ".join(cycle)
+            )
 
-            if inc in self._trees and self._includes.get(inc):
-                new_includes += self._includes[inc]
+    def _resolve_includes(
+        self, text_document_uri: Union[str, FileUri]
+    ) -> None:
+        """Updates the includes of the document in the include graph and
+        loads the files that it includes directly or indirectly and that are
+        not tracked yet.
+        """
+        documents = [FileUri(text_document_uri)]
+        while documents:
+            for inc in self._untracked_includes(documents.pop()):
+                loaded = read_document(inc.path, self._tree_cache)
+                if loaded is not None and self._add_included_file(
+                    inc, *loaded
+                ):
+                    documents.append(inc)
+        self._warn_about_include_cycle(text_document_uri)
 
-        assert len(new_includes) >= len(self._includes[text_document_uri])
-        self._includes[text_document_uri] = new_includes
+    async def _resolve_includes_async(self, text_document_uri: str) -> None:
+        """Like :py:meth:`_resolve_includes`, but reads and parses the
+        included files in the parse executor.
+        """
+        loop = asyncio.get_running_loop()
+        documents = [FileUri(text_document_uri)]
+        while documents:
+            untracked = self._untracked_includes(documents.pop())
+            results = await asyncio.gather(
+                *(
+                    loop.run_in_executor(
+                        self._parse_executor,
+                        read_document,
+                        inc.path,
+                        self._tree_cache,
+                    )
+                    for inc in untracked
+                )
+            )
+            for inc, loaded in zip(untracked, results):
+                if loaded is not None and self._add_included_file(
+                    inc, *loaded
+                ):
+                    documents.append(inc)
+        self._warn_about_include_cycle(text_document_uri)
+
+    def _set_tree(
+        self,
+        uri: str,
+        tree: Tree,
+        version: Optional[int] = None,
+    ) -> bool:
+        if (
+            version is not None
+            and (current := self._tree_versions.get(uri)) is not None
+            and current > version
+        ):
+            self.logger.debug(
+                "not replacing version %d of '%s' by the older version %d",
+                current,
+                uri,
+                version,
+            )
+            return False
+        if version is not None:
+            self._tree_versions[uri] = version
+        self._trees[uri] = tree
+        self._span_indexes[uri] = SpanIndex(tree)
+        self._symbol_index.update(uri, tree)
+        self._requisite_index.update(uri, tree)
+        self._document_symbols.invalidate(uri)
+        return True
 
     def _update_text_document(
         self,
-        text_document: Union[
-            types.TextDocumentItem, types.VersionedTextDocumentIdentifier
-        ],
+        uri: str,
+        version: Optional[int],
+        tree: Optional[Tree] = None,
     ) -> None:
-        self.logger.debug("updating document '%s'", text_document.uri)
-        uri = text_document.uri
-        tree = parse(self.get_text_document(uri).source)
-        self._trees[uri] = tree
+        self.logger.debug("updating document '%s'", uri)
+        if tree is None:
+            tree = parse(self.get_text_document(uri).source)
+        if self._trees.get(uri) is tree:
+            # the parse cache returned the current tree: the content did not
+            # change, so neither did anything that is derived from it
+            self.logger.debug("document '%s' did not change", uri)
+            return
+        if not self._set_tree(uri, tree, version):
+            return
+        self._schedule_includes(uri)
 
-        self._document_symbols[uri] = tree_to_document_symbols(
-            tree, self._state_name_completions
+    def _schedule_includes(self, uri: str) -> None:
+        if (
+            self._parse_executor is None
+            or (loop := self._running_loop()) is None
+        ):
+            self._resolve_includes(uri)
+            return
+        task = loop.create_task(self._resolve_includes_async(uri))
+        self._include_tasks[canonical_uri(uri)] = task
+        task.add_done_callback(
+            lambda _: self._include_tasks.pop(canonical_uri(uri), None)
         )
 
-        self._resolve_includes(text_document.uri)
-
-    def _get_workspace_of_document(self, uri: Union[str, FileUri]) -> FileUri:
-        for workspace_uri in self._folders:
-            if is_relative_to(
-                Path(FileUri(uri).path), Path(FileUri(workspace_uri).path)
-            ):
-                return FileUri(workspace_uri)
-
-        return self.root_uri
+    def _get_top_of_document(self, uri: Union[str, FileUri]) -> str:
+        """Returns the path of the directory that the includes of a document
+        are relative to: the top path of the innermost workspace folder
+        containing the document, the folder itself if it has no top path or
+        the root path if no folder contains the document.
+        """
+        found = self._folder_trie.longest_prefix(FileUri(uri).path)
+        if found is None:
+            assert self.root_uri is not None
+            return FileUri(self.root_uri).path
+        folder_uri, top_path = found
+        return (top_path if top_path is not None else folder_uri).path
 
     def add_folder(self, folder: types.WorkspaceFolder) -> None:
         super().add_folder(folder)
-        top_path = get_top(FileUri(folder.uri).path)
-        self._top_paths[FileUri(folder.uri)] = (
+        folder_uri = FileUri(folder.uri)
+        top_path = self._root_finder.get_top(folder_uri.path)
+        self._top_paths[folder_uri] = (
             FileUri(top_path) if top_path is not None else None
         )
+        self._folder_trie.insert(
+            folder_uri.path, (folder_uri, self._top_paths[folder_uri])
+        )
+        self._refresh_includes(folder_uri.path)
 
     def remove_folder(self, folder_uri: Union[str, FileUri]) -> None:
         super().remove_folder(str(folder_uri))
         self._top_paths.pop(FileUri(folder_uri))
+        self._folder_trie.remove(FileUri(folder_uri).path)
+        self._refresh_includes(FileUri(folder_uri).path)
+
+    def update_top_paths(self) -> None:
+        """Looks up the top path of every workspace folder again, e.g. after
+        a ``top.sls`` was created or deleted, and resolves the includes of
+        the folders whose top path changed.
+        """
+        for folder_uri in list(self._top_paths):
+            folder = FileUri(folder_uri)
+            top_path = self._root_finder.get_top(folder.path)
+            current = self._top_paths[folder]
+            if top_path == (current.path if current is not None else None):
+                continue
+            self._top_paths[folder] = (
+                FileUri(top_path) if top_path is not None else None
+            )
+            self._folder_trie.insert(
+                folder.path, (folder, self._top_paths[folder])
+            )
+            self._refresh_includes(folder.path)
+
+    def _refresh_includes(self, path: str) -> None:
+        """Resolves the includes of the loaded documents below a directory
+        again, as their top path may have changed.
+        """
+        prefix = os.path.join(path, "")
+        for uri in list(self._trees):
+            if is_valid_file_uri(uri) and FileUri(uri).path.startswith(prefix):
+                self._schedule_includes(uri)
 
     def update_text_document(
         self,
@@ -178,12 +861,220 @@ class SlsFileWorkspace(Workspace):
         change: types.TextDocumentContentChangeEvent,
     ) -> None:
         super().update_text_document(text_doc, change)
-        self._update_text_document(text_doc)
+        uri = text_doc.uri
+
+        lines: Optional[ChangedLines] = None
+        if uri in self._trees and isinstance(
+            change, types.TextDocumentContentChangeEvent_Type1
+        ):
+            # only re-parse the blocks touched by the changes
+            lines = (
+                change.range.start.line,
+                change.range.end.line,
+                change.range.start.line + change.text.count("\n"),
+            )
+            if uri in self._pending_changes:
+                pending = self._pending_changes[uri]
+                lines = (
+                    merge_changed_lines(pending, lines)
+                    if pending is not None
+                    else None
+                )
+        self._pending_changes[uri] = lines
+        self._schedule_parse(uri)
+
+    def _running_loop(self) -> Optional[asyncio.AbstractEventLoop]:
+        try:
+            return asyncio.get_running_loop()
+        except RuntimeError:
+            return None
+
+    def _schedule_parse(self, uri: str) -> None:
+        """Parses the document once it has not been changed for
+        :py:attr:`parse_delay` seconds, right away without an event loop.
+        """
+        if (timer := self._parse_timers.pop(uri, None)) is not None:
+            timer.cancel()
+        if (loop := self._running_loop()) is None:
+            self.parse_pending(uri)
+        elif self.parse_delay > 0:
+            self._parse_timers[uri] = loop.call_later(
+                self.parse_delay, self._parse_later, uri
+            )
+        else:
+            self._parse_later(uri)
+
+    def _parse_later(self, uri: str) -> None:
+        if self._parse_executor is None:
+            self.parse_pending(uri)
+        else:
+            self._start_parse_job(uri)
+
+    def _start_parse_job(self, uri: str, opened: bool = False) -> None:
+        """Parses the pending changes of the document in the parse executor.
+
+        The job of the previous version of the document is superseded: it is
+        cancelled unless it is already running, in which case its tree is
+        only used as the base of the new job.
+
+        :param opened: whether the document has just been opened, so that it
+            is most likely identical to the file on the disk
+        """
+        if (timer := self._parse_timers.pop(uri, None)) is not None:
+            timer.cancel()
+        if uri not in self._pending_changes:
+            return
+        assert self._parse_executor is not None
+        lines = self._pending_changes.pop(uri)
+        document = self.get_text_document(uri)
+
+        base: Union[None, Tree, Future[Tree]] = self._trees.get(uri)
+        if (previous := self._parse_jobs.get(uri)) is not None:
+            base = None if previous.future.cancel() else previous.future
+        future = self._parse_executor.submit(
+            parse_document,
+            document.source,
+            base,
+            lines,
+            self._tree_cache if opened else None,
+            FileUri(uri).path if opened and is_valid_file_uri(uri) else None,
+        )
+        job = _ParseJob(document.version, future, asyncio.wrap_future(future))
+        self._parse_jobs[uri] = job
+        job.applied.add_done_callback(
+            lambda _: self._apply_parse_job(uri, job)
+        )
+
+    def _apply_parse_job(self, uri: str, job: _ParseJob) -> None:
+        if self._parse_jobs.get(uri) is not job:
+            self.logger.debug("discarding the superseded parse of '%s'", uri)
+            return
+        del self._parse_jobs[uri]
+        if job.future.cancelled():
+            return
+        if (err := job.future.exception()) is not None:
+            self.logger.error("Cannot parse '%s': %s", uri, err)
+            return
+        self._update_text_document(uri, job.version, job.future.result())
+
+    async def get_document_symbols(
+        self, uri: str
+    ) -> Optional[List[types.DocumentSymbol]]:
+        """Returns the document symbols of a document like
+        :py:attr:`document_symbols`, but reads an evicted document and builds
+        the symbols in the parse executor.
+
+        :return: the document symbols, None if the document is not tracked
+        """
+        await self.load(uri)
+        if (tree := self._trees.get(uri)) is None:
+            return None
+        if self._parse_executor is None:
+            return self._document_symbols[uri]
+        return await self._document_symbols.build(
+            uri, tree, self._parse_executor
+        )
+
+    async def wait_parsed(self, uri: Optional[str] = None) -> None:
+        """Waits until the latest version of a document, or of all documents
+        if no URI is passed, is parsed and its includes are resolved.
+
+        Pending changes are parsed right away.
+        """
+        uris = (
+            [uri]
+            if uri is not None
+            else list(
+                set(self._pending_changes)
+                | set(self._parse_jobs)
+                | set(self._include_tasks)
+                | set(self._load_tasks)
+            )
+        )
+        for doc_uri in uris:
+            if doc_uri in self._pending_changes:
+                self._parse_later(doc_uri)
+            if (job := self._parse_jobs.get(doc_uri)) is not None:
+                # the callbacks of the job, which apply its result, run first
+                await asyncio.wait([job.applied])
+            for tasks in (self._include_tasks, self._load_tasks):
+                if (task := tasks.get(canonical_uri(doc_uri))) is not None:
+                    await asyncio.wait([task])
+
+    def parse_pending(self, uri: Optional[str] = None) -> None:
+        """Parses the changes of a document that are still pending, or the
+        changes of all documents if no URI is passed, synchronously.
+
+        This must be called before using anything derived from the trees of
+        the changed documents without an event loop, use
+        :py:meth:`wait_parsed` otherwise.
+        """
+        for doc_uri in list(self._pending_changes) if uri is None else [uri]:
+            if (timer := self._parse_timers.pop(doc_uri, None)) is not None:
+                timer.cancel()
+            if doc_uri not in self._pending_changes:
+                continue
+            lines = self._pending_changes.pop(doc_uri)
+            if (job := self._parse_jobs.pop(doc_uri, None)) is not None:
+                # the changes are relative to the document of the job
+                job.future.cancel()
+                lines = None
+            document = self.get_text_document(doc_uri)
+            tree = None
+            if (
+                lines is not None
+                and (old_tree := self._trees.get(doc_uri)) is not None
+            ):
+                tree = reparse(old_tree, document.source, *lines)
+            self._update_text_document(doc_uri, document.version, tree)
+
+    def _drop_pending(self, uri: str) -> None:
+        self._pending_changes.pop(uri, None)
+        if (timer := self._parse_timers.pop(uri, None)) is not None:
+            timer.cancel()
+        if (job := self._parse_jobs.pop(uri, None)) is not None:
+            job.future.cancel()
+
+    def _create_text_document(
+        self,
+        doc_uri: str,
+        source: Optional[str] = None,
+        version: Optional[int] = None,
+        language_id: Optional[str] = None,
+    ) -> SlsTextDocument:
+        return SlsTextDocument(
+            doc_uri,
+            source=source,
+            version=version,
+            language_id=language_id,
+            sync_kind=self._sync_kind,
+            position_codec=self._position_codec,
+        )
+
+    def get_text_document(self, doc_uri: str) -> SlsTextDocument:
+        if self._is_evicted(doc_uri):
+            self._use(doc_uri)
+        return cast(SlsTextDocument, super().get_text_document(doc_uri))
 
     def remove_text_document(self, doc_uri: str) -> None:
         super().remove_text_document(doc_uri)
-        self._document_symbols.pop(FileUri(doc_uri))
-        self._trees.pop(FileUri(doc_uri))
+        self._drop_pending(doc_uri)
+        self._forget_loaded(doc_uri)
+        if is_valid_file_uri(doc_uri) and os.path.isfile(
+            FileUri(doc_uri).path
+        ):
+            # the closed document goes back to its content on the disk, it
+            # keeps its place in the indexes until it is read again
+            self._unload(canonical_uri(doc_uri))
+            self._schedule_load(canonical_uri(doc_uri))
+            return
+        self._tree_versions.pop(FileUri(doc_uri), None)
+        self._document_symbols.invalidate(doc_uri)
+        self._trees.pop(FileUri(doc_uri), None)
+        self._span_indexes.pop(FileUri(doc_uri), None)
+        self._symbol_index.remove(doc_uri)
+        self._requisite_index.remove(doc_uri)
+        self._include_graph.remove(doc_uri)
 
     def put_text_document(
         self,
@@ -191,7 +1082,63 @@ class SlsFileWorkspace(Workspace):
         notebook_uri: Optional[str] = None,
     ) -> None:
         super().put_text_document(text_document, notebook_uri)
-        self._update_text_document(text_document)
+        self._forget_loaded(text_document.uri)
+        # the document was replaced, so were its changes
+        self._drop_pending(text_document.uri)
+        self._tree_versions.pop(text_document.uri, None)
+        if self._parse_executor is not None and self._running_loop():
+            self._pending_changes[text_document.uri] = None
+            self._start_parse_job(text_document.uri, opened=True)
+            return
+        tree = None
+        if self._tree_cache is not None and is_valid_file_uri(
+            text_document.uri
+        ):
+            # the document has just been opened, so it is most likely
+            # identical to the file on the disk
+            tree = self._tree_cache.parse(
+                FileUri(text_document.uri).path,
+                self.get_text_document(text_document.uri).source,
+            )
+        self._update_text_document(
+            text_document.uri, text_document.version, tree
+        )
+
+    def put_indexed_document(self, uri: str, source: str, tree: Tree) -> bool:
+        """Adds a document parsed by the workspace indexer, unless the
+        document is already tracked as it may have been modified since.
+
+        The includes of the document are not resolved, call
+        :py:meth:`resolve_includes` once all documents have been added so
+        that the included files do not need to be read again.
+
+        :return: whether the document was added
+        """
+        if self._is_tracked(uri):
+            return False
+        super().put_text_document(
+            types.TextDocumentItem(
+                uri=uri, language_id=SLS_LANGUAGE_ID, version=0, text=source
+            )
+        )
+        self._set_tree(uri, tree, 0)
+        # the included files are loaded later, but the document may be
+        # evicted before that
+        self._include_graph.set_includes(uri, self._direct_includes(uri))
+        self._add_loaded(uri, source)
+        return True
+
+    async def resolve_includes(self, uri: Union[str, FileUri]) -> None:
+        """Resolves the includes of a document that was added via
+        :py:meth:`put_indexed_document`, the included files that are not
+        tracked yet are read and parsed in the parse executor.
+        """
+        if uri not in self._trees:
+            return
+        if self._parse_executor is None:
+            self._resolve_includes(uri)
+        else:
+            await self._resolve_includes_async(canonical_uri(uri))
 
 
 class SaltLspProto(LanguageServerProtocol):
@@ -215,4 +1162,8 @@ class SaltLspProto(LanguageServerProtocol):
                 self._server._text_document_sync_kind,
                 old_ws.folders.values(),
                 log_level=log_level,
+                tree_cache=getattr(self._server, "tree_cache", None),
+                parse_delay=getattr(self._server, "parse_delay", 0.0),
+                parse_executor=getattr(self._server, "parse_executor", None),
+                memory_budget=getattr(self._server, "memory_budget", None),
             )
@@ -8,11 +8,13 @@ from lsprotocol.types import (
     InitializeParams,
     DidOpenTextDocumentParams,
     TextDocumentItem,
+    WorkspaceFolder,
 )
 import pytest
 import pytest_lsp
 
 from salt_lsp.base_types import StateNameCompletion, SLS_LANGUAGE_ID
+from salt_lsp.workspace import SlsFileWorkspace
 
 
 MODULE_DOCS = {
@@ -512,6 +514,8 @@ def pickled_states(_pickled_path, state_completions):
             "--log-level",
             "debug",
             "--integration-tests",
+            "--no-disk-cache",
+            "--no-index",
         ]
     ),
     params=(None,),
@@ -632,6 +636,16 @@ bar:
     yield workspace_path
 
 
+@pytest.fixture
+def workspace(sample_workspace: Path, state_completions) -> SlsFileWorkspace:
+    uri = f"file://{sample_workspace}"
+    return SlsFileWorkspace(
+        state_completions,
+        uri,
+        workspace_folders=[WorkspaceFolder(uri=uri, name="sample")],
+    )
+
+
 @contextlib.asynccontextmanager
 async def open_file(
     client: pytest_lsp.LanguageClient, file_path: Path
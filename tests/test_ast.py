@@ -1,3 +1,5 @@
+import pickle
+
 import yaml
 
 from salt_lsp.parser import *
@@ -855,3 +857,47 @@ ilmehtar:
             ),
         ],
     )
+
+
+def test_nodes_have_no_instance_dict():
+    content = """include:
+  - foo
+
+extend:
+  bar:
+    file.managed: []
+
+baz:
+  pkg.installed:
+    - pkgs:
+      - vim
+    - require:
+      - file: bar
+"""
+    tree = parse(content)
+    nodes = []
+    tree.visit(lambda node: nodes.append(node) or True)
+    nodes += tree.includes.includes
+    nodes += tree.states[0].states[0].parameters[0].value
+
+    assert {type(node) for node in nodes} == {
+        Tree,
+        IncludesNode,
+        IncludeNode,
+        ExtendNode,
+        StateNode,
+        StateCallNode,
+        StateParameterNode,
+        RequisitesNode,
+        RequisiteNode,
+        TokenNode,
+    }
+    for node in nodes:
+        assert not hasattr(node, "__dict__"), type(node)
+    assert pickle.loads(pickle.dumps(tree)) == tree
+
+
+def test_position_ordering():
+    assert Position(line=1, col=5) < Position(line=2, col=0)
+    assert Position(line=1, col=5) > Position(line=1, col=4)
+    assert Position(line=1, col=5) <= Position(line=1, col=5)
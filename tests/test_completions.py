@@ -69,3 +69,36 @@ async def test_complete_of_file(
     ]
     completions = [(item.label, item.documentation) for item in items]
     assert completions == expected_completions
+
+
+@pytest.mark.asyncio
+async def test_complete_include(
+    client: LanguageClient, sample_workspace: Path
+):
+    sls = sample_workspace / "new.sls"
+    sls.write_text("include:\n  - ba\n  - opensuse.\n")
+    async with open_file(client, sls):
+        results = await client.text_document_completion_async(
+            params=CompletionParams(
+                position=Position(line=1, character=6),
+                text_document=TextDocumentIdentifier(uri=f"file://{sls}"),
+            )
+        )
+        assert isinstance(results, CompletionList)
+        assert not results.is_incomplete
+        assert [item.label for item in results.items] == ["bar", "baz"]
+        assert results.items[0].text_edit.range.start.character == 4
+
+        results = await client.text_document_completion_async(
+            params=CompletionParams(
+                position=Position(line=2, character=13),
+                text_document=TextDocumentIdentifier(uri=f"file://{sls}"),
+                context=CompletionContext(
+                    trigger_kind=CompletionTriggerKind.TriggerCharacter,
+                    trigger_character=".",
+                ),
+            )
+        )
+        assert isinstance(results, CompletionList)
+        assert [item.label for item in results.items] == ["opensuse.base"]
+        assert results.items[0].text_edit.new_text == "opensuse.base"
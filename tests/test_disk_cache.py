@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+import salt_lsp.parser
+from salt_lsp.disk_cache import DiskTreeCache, default_cache_dir
+from salt_lsp.parser import AST_VERSION, Parser, ParseCache
+
+VALUES_SLS = """packages:
+  pkg.installed:
+    - pkgs:
+      - vim
+      - git
+    - refresh: True
+"""
+
+
+@pytest.fixture(autouse=True)
+def parse_cache(monkeypatch):
+    cache = ParseCache()
+    monkeypatch.setattr(salt_lsp.parser, "PARSE_CACHE", cache)
+    return cache
+
+
+@pytest.fixture
+def sls_file(tmp_path):
+    path = tmp_path / "values.sls"
+    path.write_text(VALUES_SLS)
+    return str(path)
+
+
+def test_default_cache_dir(monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", "/var/cache/user")
+    assert default_cache_dir() == "/var/cache/user/salt_lsp"
+
+    monkeypatch.setenv("HOME", "/home/user")
+    monkeypatch.setenv("XDG_CACHE_HOME", "relative/paths/are/ignored")
+    assert default_cache_dir() == "/home/user/.cache/salt_lsp"
+
+
+def test_trees_are_loaded_from_the_disk(tmp_path, sls_file, parse_cache):
+    cache = DiskTreeCache(str(tmp_path / "cache"))
+    tree = cache.parse(sls_file, VALUES_SLS)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert f"-{AST_VERSION}-" in os.path.basename(cache.directory)
+
+    # a new server
+    parse_cache.clear()
+    cache = DiskTreeCache(str(tmp_path / "cache"))
+    loaded = cache.parse(sls_file, VALUES_SLS)
+
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert loaded is not tree
+    assert loaded == Parser(VALUES_SLS, lazy_values=False).parse()
+    assert loaded.states[0].states[0].parameters[0].value[0].parent
+
+
+def test_modified_files_are_parsed_again(tmp_path, sls_file, parse_cache):
+    cache = DiskTreeCache(str(tmp_path / "cache"))
+    cache.parse(sls_file, VALUES_SLS)
+    stat = os.stat(sls_file)
+
+    os.utime(sls_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+    assert cache.load(sls_file, VALUES_SLS) is None
+
+    os.utime(sls_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert cache.load(sls_file, VALUES_SLS) is not None
+    assert cache.load(sls_file, VALUES_SLS.upper()) is None
+
+
+def test_corrupted_entries_are_ignored(tmp_path, sls_file):
+    cache = DiskTreeCache(str(tmp_path / "cache"))
+    cache.parse(sls_file, VALUES_SLS)
+    (entry,) = os.listdir(cache.directory)
+    with open(os.path.join(cache.directory, entry), "r+b") as entry_file:
+        entry_file.truncate(100)
+
+    assert cache.load(sls_file, VALUES_SLS) is None
+
+
+def test_unwritable_cache_directory(tmp_path, sls_file):
+    (tmp_path / "cache").write_text("not a directory")
+    cache = DiskTreeCache(str(tmp_path / "cache"))
+
+    assert cache.parse(sls_file, VALUES_SLS) == Parser(VALUES_SLS).parse()
@@ -5,6 +5,8 @@ from lsprotocol.types import (
     Location,
     Range,
     Position,
+    ReferenceContext,
+    ReferenceParams,
     TextDocumentIdentifier,
 )
 import pytest
@@ -72,3 +74,43 @@ async def test_find_id_in_include(
             end=Position(line=6, character=0),
         ),
     )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("opened_file", ("foo.sls",), indirect=True)
+async def test_find_references(client: LanguageClient, opened_file: Path):
+    results = await client.text_document_references_async(
+        params=ReferenceParams(
+            position=Position(line=7, character=8),
+            text_document=TextDocumentIdentifier(uri=f"file://{opened_file}"),
+            context=ReferenceContext(include_declaration=True),
+        )
+    )
+    assert results is not None
+    assert sorted(
+        (location.uri.rsplit("/", 1)[-1], location.range.start.line)
+        for location in results
+    ) == [("bar.sls", 6), ("foo.sls", 7), ("quo.sls", 0)]
+    assert results[0] == Location(
+        uri=f"file://{opened_file.parent / 'quo.sls'}",
+        range=Range(
+            start=Position(line=0, character=0),
+            end=Position(line=6, character=0),
+        ),
+    )
+
+    # from the declaration of the state
+    results = await client.text_document_references_async(
+        params=ReferenceParams(
+            position=Position(line=0, character=3),
+            text_document=TextDocumentIdentifier(
+                uri=f"file://{opened_file.parent / 'quo.sls'}"
+            ),
+            context=ReferenceContext(include_declaration=False),
+        )
+    )
+    assert results is not None
+    assert sorted(location.uri.rsplit("/", 1)[-1] for location in results) == [
+        "bar.sls",
+        "foo.sls",
+    ]
@@ -0,0 +1,289 @@
+import os
+import os.path
+
+import pytest
+
+from salt_lsp.include_graph import IncludeGraph, IncludeResolver, ModuleIndex
+from salt_lsp.parser import IncludeNode
+
+
+def _uri(name: str) -> str:
+    return f"file:///srv/salt/{name}.sls"
+
+
+def _closure(graph: IncludeGraph, name: str):
+    return [str(uri).rsplit("/", 1)[-1][:-4] for uri in graph[_uri(name)]]
+
+
+def test_closure_order_without_duplicates():
+    graph = IncludeGraph()
+    graph.set_includes(_uri("top"), [_uri("a"), _uri("b"), _uri("a")])
+    graph.set_includes(_uri("a"), [_uri("c"), _uri("shared")])
+    graph.set_includes(_uri("b"), [_uri("shared"), _uri("d")])
+    graph.set_includes(_uri("c"), [_uri("shared")])
+
+    assert _closure(graph, "top") == ["a", "b", "c", "shared", "d"]
+    assert _closure(graph, "b") == ["shared", "d"]
+    assert graph.get(_uri("shared")) is None
+    assert graph.included_by(_uri("shared")) == {
+        _uri("a"),
+        _uri("b"),
+        _uri("c"),
+    }
+    assert graph.cycle(_uri("top")) == []
+
+
+def test_cycles():
+    graph = IncludeGraph()
+    graph.set_includes(_uri("a"), [_uri("b")])
+    graph.set_includes(_uri("b"), [_uri("c"), _uri("leaf")])
+    graph.set_includes(_uri("c"), [_uri("a"), _uri("d")])
+    graph.set_includes(_uri("self"), [_uri("self"), _uri("a")])
+
+    assert _closure(graph, "a") == ["b", "c", "leaf", "d"]
+    assert _closure(graph, "c") == ["a", "d", "b", "leaf"]
+    assert _closure(graph, "self") == ["a", "b", "c", "leaf", "d"]
+    assert graph.cycle(_uri("b")) == [_uri("a"), _uri("b"), _uri("c")]
+    assert graph.cycle(_uri("self")) == [_uri("self")]
+
+    # breaking the cycle
+    graph.set_includes(_uri("c"), [_uri("d")])
+    assert _closure(graph, "c") == ["d"]
+    assert _closure(graph, "a") == ["b", "c", "leaf", "d"]
+    assert graph.cycle(_uri("a")) == []
+
+
+def test_changes_only_invalidate_the_including_documents():
+    graph = IncludeGraph()
+    graph.set_includes(_uri("a"), [_uri("b")])
+    graph.set_includes(_uri("b"), [_uri("c")])
+    graph.set_includes(_uri("other"), [_uri("d")])
+    assert _closure(graph, "a") == ["b", "c"]
+    other = graph[_uri("other")]
+
+    graph.set_includes(_uri("c"), [_uri("d")])
+    assert graph[_uri("other")] is other
+    assert _closure(graph, "a") == ["b", "c", "d"]
+
+    # unchanged includes keep the closures
+    closure = graph[_uri("a")]
+    graph.set_includes(_uri("c"), [_uri("d")])
+    assert graph[_uri("a")] is closure
+
+    graph.remove(_uri("b"))
+    assert _closure(graph, "a") == ["b"]
+    assert _uri("b") not in graph
+
+
+def test_long_chains():
+    graph = IncludeGraph()
+    for i in range(5000):
+        graph.set_includes(_uri(str(i)), [_uri(str(i + 1))])
+    assert len(graph[_uri("0")]) == 5000
+
+    graph.set_includes(_uri("5000"), [_uri("0")])
+    assert len(graph[_uri("2500")]) == 5000
+    assert len(graph.cycle(_uri("0"))) == 5001
+
+
+def _no_file_system(*args):
+    raise AssertionError("unexpected file system access")
+
+
+def test_resolver_without_validation(tmp_path, monkeypatch):
+    (tmp_path / "top.sls").write_text("")
+    (tmp_path / "foo").mkdir()
+    (tmp_path / "foo" / "init.sls").write_text("")
+    top = str(tmp_path / "top.sls")
+    resolver = IncludeResolver(validate=False)
+
+    assert resolver.resolve(top, "foo") == str(tmp_path / "foo" / "init.sls")
+    assert resolver.resolve(top, "foo.bar") is None
+    with monkeypatch.context() as patch:
+        for function in ("stat", "lstat"):
+            patch.setattr(os, function, _no_file_system)
+        for function in ("exists", "isdir", "abspath"):
+            patch.setattr(os.path, function, _no_file_system)
+        assert resolver.resolve(top, "foo") == str(
+            tmp_path / "foo" / "init.sls"
+        )
+        assert resolver.resolve(top, "foo.bar") is None
+
+    (tmp_path / "foo" / "bar.sls").write_text("")
+    assert resolver.resolve(top, "foo.bar") is None
+    resolver.invalidate(str(tmp_path / "foo" / "bar.sls"))
+    assert resolver.resolve(top, "foo.bar") == str(
+        tmp_path / "foo" / "bar.sls"
+    )
+
+    (tmp_path / "foo" / "bar.sls").unlink()
+    (tmp_path / "foo" / "bar").mkdir()
+    (tmp_path / "foo" / "bar" / "init.sls").write_text("")
+    resolver.invalidate(str(tmp_path / "foo" / "bar"))
+    assert resolver.resolve(top, "foo.bar") == str(
+        tmp_path / "foo" / "bar" / "init.sls"
+    )
+
+    # only the modules below a deleted directory are dropped
+    (tmp_path / "foo" / "bar" / "init.sls").unlink()
+    (tmp_path / "foo" / "bar").rmdir()
+    resolver.invalidate(str(tmp_path / "foo" / "bar"))
+    assert resolver.resolve(top, "foo.bar") is None
+    with monkeypatch.context() as patch:
+        patch.setattr(IncludeNode, "get_file", _no_file_system)
+        assert resolver.resolve(top, "foo") == str(
+            tmp_path / "foo" / "init.sls"
+        )
+
+
+@pytest.mark.parametrize(
+    "path", ("qux.sls", "foo/qux.sls", "foo/qux/init.sls")
+)
+def test_resolver_with_validation(tmp_path, monkeypatch, path):
+    (tmp_path / "foo").mkdir()
+    for directory in (tmp_path, tmp_path / "foo"):
+        # modified long enough ago to be trusted
+        os.utime(directory, ns=(0, 0))
+    resolver = IncludeResolver()
+    module = path[:-4].replace("/init", "").replace("/", ".")
+
+    assert resolver.resolve(str(tmp_path), module) is None
+    with monkeypatch.context() as patch:
+        patch.setattr(IncludeNode, "get_file", _no_file_system)
+        assert resolver.resolve(str(tmp_path), module) is None
+
+    (tmp_path / path).parent.mkdir(exist_ok=True)
+    (tmp_path / path).write_text("")
+    assert resolver.resolve(str(tmp_path), module) == str(tmp_path / path)
+
+    (tmp_path / path).unlink()
+    assert resolver.resolve(str(tmp_path), module) is None
+
+
+def _sls_tree(root, *paths: str) -> None:
+    for path in paths:
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_text("")
+
+
+def test_module_index_without_validation(tmp_path, monkeypatch):
+    _sls_tree(
+        tmp_path,
+        "top.sls",
+        "init.sls",
+        "foo.sls",
+        "foo/init.sls",
+        "foo/bar.sls",
+        "foo/baz/init.sls",
+        "foo/baz/qux.sls",
+        "foobar.sls",
+        "foo/README.md",
+    )
+    index = ModuleIndex(validate=False)
+    modules = [
+        "foo",
+        "foo.bar",
+        "foo.baz",
+        "foo.baz.qux",
+        "foobar",
+        "top",
+    ]
+    assert index.modules(str(tmp_path)) == modules
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "scandir", _no_file_system)
+        patch.setattr(os, "stat", _no_file_system)
+        assert index.modules(str(tmp_path)) == modules
+        assert index.modules(str(tmp_path), "foo") == modules[:5]
+        assert index.modules(str(tmp_path), "foo.") == modules[1:4]
+        assert index.modules(str(tmp_path), "foo.ba") == modules[1:4]
+        assert index.modules(str(tmp_path), "foo.baz") == modules[2:4]
+        assert index.modules(str(tmp_path), "foo.qux") == []
+        assert index.modules(str(tmp_path), "bar") == []
+
+    # one of the two files of foo is left
+    (tmp_path / "foo.sls").unlink()
+    index.invalidate(str(tmp_path / "foo.sls"))
+    assert index.modules(str(tmp_path), "foo") == modules[:5]
+
+    _sls_tree(tmp_path, "new/deep/state.sls")
+    assert index.modules(str(tmp_path), "new") == []
+    index.invalidate(str(tmp_path / "new" / "deep" / "state.sls"))
+    assert index.modules(str(tmp_path), "new") == ["new.deep.state"]
+
+    for path in ("foo/baz/qux.sls", "foo/baz/init.sls"):
+        (tmp_path / path).unlink()
+    (tmp_path / "foo" / "baz").rmdir()
+    index.invalidate(str(tmp_path / "foo" / "baz"))
+    assert index.modules(str(tmp_path), "foo") == ["foo", "foo.bar", "foobar"]
+
+    # directories are told from files without looking at their extension
+    _sls_tree(tmp_path, "conf.d/site.sls")
+    index.invalidate(str(tmp_path / "conf.d"))
+    assert index.modules(str(tmp_path), "conf") == ["conf.d.site"]
+    (tmp_path / "conf.d" / "site.sls").unlink()
+    (tmp_path / "conf.d").rmdir()
+    index.invalidate(str(tmp_path / "conf.d"))
+    assert index.modules(str(tmp_path), "conf") == []
+
+
+def test_module_index_with_validation(tmp_path, monkeypatch):
+    _sls_tree(tmp_path, "foo/bar.sls", "qux.sls")
+    for directory in (tmp_path, tmp_path / "foo"):
+        # modified long enough ago to be trusted
+        os.utime(directory, ns=(0, 0))
+    index = ModuleIndex()
+
+    assert index.modules(str(tmp_path)) == ["foo.bar", "qux"]
+    with monkeypatch.context() as patch:
+        patch.setattr(os, "scandir", _no_file_system)
+        assert index.modules(str(tmp_path)) == ["foo.bar", "qux"]
+
+    _sls_tree(tmp_path, "foo/baz.sls", "new/init.sls")
+    assert index.modules(str(tmp_path), "foo.") == ["foo.bar", "foo.baz"]
+    assert index.modules(str(tmp_path), "n") == ["new"]
+
+    (tmp_path / "qux.sls").unlink()
+    assert index.modules(str(tmp_path)) == ["foo.bar", "foo.baz", "new"]
+
+
+def test_module_index_ranks_the_closest_modules_first(tmp_path):
+    _sls_tree(
+        tmp_path,
+        "top.sls",
+        "a.sls",
+        "db/postgres.sls",
+        "web/init.sls",
+        "web/nginx.sls",
+        "web/apache/init.sls",
+        "web/apache/mods.sls",
+        "webapp.sls",
+    )
+    index = ModuleIndex(validate=False)
+    root = str(tmp_path)
+    near = str(tmp_path / "web" / "apache" / "mods.sls")
+
+    assert index.modules(root, near=near) == [
+        "web.apache",
+        "web",
+        "web.nginx",
+        "a",
+        "db.postgres",
+        "top",
+        "webapp",
+    ]
+    assert index.modules(root, "web", near) == [
+        "web.apache",
+        "web",
+        "web.nginx",
+        "webapp",
+    ]
+    assert index.modules(root, "web.n", near) == ["web.nginx"]
+    assert index.modules(root, "db.", near) == ["db.postgres"]
+    assert index.modules(root, "web", near, limit=2) == ["web.apache", "web"]
+    assert index.modules(root, "web", "/srv/salt/web/init.sls") == [
+        "web",
+        "web.apache",
+        "web.apache.mods",
+        "web.nginx",
+        "webapp",
+    ]
@@ -0,0 +1,204 @@
+import gc
+
+from lsprotocol import types
+
+from salt_lsp.index import RequisiteIndex, WorkspaceSymbolIndex
+from salt_lsp.parser import parse
+
+FOO_SLS = """include:
+  - base.users
+
+/etc/nginx/nginx.conf:
+  file.managed:
+    - source: salt://nginx/nginx.conf
+
+nginx:
+  pkg.installed: []
+  service.running: []
+"""
+
+BAR_SLS = """include:
+  - nginx
+
+NGINX_LOGS:
+  file.directory:
+    - name: /var/log/nginx
+"""
+
+
+def _names(symbols):
+    return [
+        (symbol.name, symbol.location.uri.rsplit("/", 1)[-1])
+        for symbol in symbols
+    ]
+
+
+def test_prefix_matches_come_first():
+    index = WorkspaceSymbolIndex()
+    index.update("file:///srv/salt/foo.sls", parse(FOO_SLS))
+    index.update("file:///srv/salt/bar.sls", parse(BAR_SLS))
+
+    assert _names(index.search("nginx")) == [
+        ("nginx", "foo.sls"),
+        ("nginx", "bar.sls"),
+        ("NGINX_LOGS", "bar.sls"),
+        ("/etc/nginx/nginx.conf", "foo.sls"),
+    ]
+    assert _names(index.search("ngi")) == _names(index.search("nginx"))
+
+
+def test_symbols():
+    index = WorkspaceSymbolIndex()
+    index.update("file:///srv/salt/foo.sls", parse(FOO_SLS))
+
+    symbols = index.search("")
+    assert [symbol.name for symbol in symbols] == [
+        "/etc/nginx/nginx.conf",
+        "base.users",
+        "file.managed",
+        "nginx",
+        "pkg.installed",
+        "service.running",
+    ]
+    assert symbols[1].kind == types.SymbolKind.String
+    assert symbols[4].container_name == "nginx"
+    assert symbols[4].location == types.Location(
+        uri="file:///srv/salt/foo.sls",
+        range=types.Range(
+            start=types.Position(line=8, character=2),
+            end=types.Position(line=8, character=19),
+        ),
+    )
+
+
+def test_short_queries_and_limit():
+    index = WorkspaceSymbolIndex()
+    index.update("file:///srv/salt/foo.sls", parse(FOO_SLS))
+
+    assert [symbol.name for symbol in index.search("d")] == [
+        "file.managed",
+        "pkg.installed",
+    ]
+    assert len(index.search("", limit=2)) == 2
+    assert index.search("nothing") == []
+
+
+def test_updates_and_removals():
+    index = WorkspaceSymbolIndex()
+    index.update("file:///srv/salt/foo.sls", parse(FOO_SLS))
+    index.update("file:///srv/salt/bar.sls", parse(BAR_SLS))
+    assert len(index.search("nginx")) == 4
+
+    index.update("/srv/salt/foo.sls", parse("apache:\n  pkg.installed: []\n"))
+    assert _names(index.search("nginx")) == [
+        ("nginx", "bar.sls"),
+        ("NGINX_LOGS", "bar.sls"),
+    ]
+    assert _names(index.search("pkg")) == [("pkg.installed", "foo.sls")]
+
+    index.remove("file:///srv/salt/bar.sls")
+    assert index.search("nginx") == []
+    assert _names(index.search("")) == [
+        ("apache", "foo.sls"),
+        ("pkg.installed", "foo.sls"),
+    ]
+
+
+def test_many_documents():
+    index = WorkspaceSymbolIndex()
+    for i in range(100):
+        index.update(
+            f"file:///srv/salt/state_{i}.sls",
+            parse(f"state_{i}:\n  test.nop: []\n"),
+        )
+    assert len(index.search("state_", limit=1000)) == 100
+    assert [symbol.name for symbol in index.search("te_9")] == [
+        "state_9",
+    ] + [f"state_9{i}" for i in range(10)]
+
+    for i in range(0, 100, 2):
+        index.remove(f"file:///srv/salt/state_{i}.sls")
+    assert len(index.search("state_", limit=1000)) == 50
+    assert len(index.search("test.nop", limit=1000)) == 50
+
+
+def test_limited_substring_matches_are_the_first_names():
+    index = WorkspaceSymbolIndex()
+    for i in range(1000):
+        index.update(
+            f"file:///srv/salt/state_{i}.sls",
+            parse(f"state_{i}:\n  test.nop: []\n"),
+        )
+    # the names containing rare trigrams are sorted, the others are scanned
+    assert [symbol.name for symbol in index.search("te_99", limit=3)] == [
+        "state_99",
+        "state_990",
+        "state_991",
+    ]
+    assert [symbol.name for symbol in index.search("ate_1", limit=3)] == [
+        "state_1",
+        "state_10",
+        "state_100",
+    ]
+
+
+REQUISITES_SLS = """nginx:
+  service.running:
+    - watch:
+      - file: /etc/nginx/nginx.conf
+      - pkg: nginx
+    - require:
+      - sls: base.users
+      - nginx_conf
+"""
+
+
+def test_requisite_index():
+    index = RequisiteIndex()
+    index.update("file:///srv/salt/foo.sls", parse(REQUISITES_SLS))
+    index.update("file:///srv/salt/bar.sls", parse(BAR_SLS))
+
+    def find(reference, modules=None):
+        return [
+            (uri.rsplit("/", 1)[-1], node.module, node.start.line)
+            for uri, node in index.find(reference, modules)
+        ]
+
+    assert find("nginx") == [("foo.sls", "pkg", 4)]
+    assert find("nginx", {None, "file"}) == []
+    assert find("nginx_conf", {None}) == [("foo.sls", None, 7)]
+    assert find("base.users") == [("foo.sls", "sls", 6)]
+
+    index.update(
+        "file:///srv/salt/bar.sls",
+        parse("bar:\n  test.nop:\n    - require:\n      - pkg: nginx\n"),
+    )
+    assert find("nginx") == [("foo.sls", "pkg", 4), ("bar.sls", "pkg", 3)]
+
+    index.remove("file:///srv/salt/foo.sls")
+    assert find("nginx") == [("bar.sls", "pkg", 3)]
+    assert find("base.users") == []
+
+
+def test_indexes_do_not_keep_the_trees():
+    uri = "file:///srv/salt/foo.sls"
+    tree = parse(REQUISITES_SLS)
+    symbols, requisites = WorkspaceSymbolIndex(), RequisiteIndex()
+    for index in (symbols, requisites):
+        index.update(uri, tree)
+        index.flush(uri)
+
+    reachable = set()
+    objects = [symbols, requisites]
+    while objects:
+        obj = objects.pop()
+        if id(obj) in reachable or isinstance(obj, type):
+            continue
+        reachable.add(id(obj))
+        objects.extend(gc.get_referents(obj))
+    assert id(tree) not in reachable
+
+    assert _names(symbols.search("nginx")) == [("nginx", "foo.sls")]
+    assert [
+        node.start.line for _, node in requisites.find("nginx", {"pkg"})
+    ] == [4]
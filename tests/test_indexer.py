@@ -0,0 +1,132 @@
+from concurrent.futures import ThreadPoolExecutor
+import gc
+from pathlib import Path
+
+from lsprotocol.types import (
+    TextDocumentItem,
+    WorkDoneProgressBegin,
+    WorkDoneProgressEnd,
+    WorkDoneProgressReport,
+)
+import pytest
+
+import salt_lsp.indexer
+from salt_lsp.base_types import SLS_LANGUAGE_ID
+from salt_lsp.indexer import WorkspaceIndexer, find_sls_files, parse_files
+from salt_lsp.parser import Parser
+from salt_lsp.workspace import SlsFileWorkspace
+
+SLS_FILES = [
+    "bar.sls",
+    "baz.sls",
+    "dns/server/init.sls",
+    "foo.sls",
+    "opensuse/base.sls",
+    "opensuse/init.sls",
+    "quo.sls",
+    "top.sls",
+]
+
+
+class RecordingProgress:
+    def __init__(self) -> None:
+        self.values = []
+
+    def begin(self, token, value: WorkDoneProgressBegin) -> None:
+        self.values.append(value)
+
+    report = end = begin
+
+
+def test_find_sls_files(sample_workspace: Path):
+    (sample_workspace / ".git").mkdir()
+    (sample_workspace / ".git" / "stash.sls").write_text("")
+    (sample_workspace / "README").write_text("")
+
+    assert sorted(
+        find_sls_files(
+            [str(sample_workspace), str(sample_workspace / "opensuse")]
+        )
+    ) == [str(sample_workspace / path) for path in SLS_FILES]
+
+
+def test_broken_files_are_skipped(sample_workspace: Path):
+    (sample_workspace / "broken.sls").write_bytes(b"\xff\xfe")
+
+    assert [
+        path
+        for path, _, _ in parse_files(
+            [
+                str(sample_workspace / "broken.sls"),
+                str(sample_workspace / "foo.sls"),
+            ]
+        )
+    ] == [str(sample_workspace / "foo.sls")]
+
+
+def test_garbage_collector_is_paused_while_parsing(
+    sample_workspace: Path, monkeypatch
+):
+    enabled = []
+
+    class RecordingParser(Parser):
+        def parse(self):
+            enabled.append(gc.isenabled())
+            return super().parse()
+
+    monkeypatch.setattr(salt_lsp.indexer, "Parser", RecordingParser)
+    assert len(parse_files([str(sample_workspace / "foo.sls")])) == 1
+    assert enabled == [False]
+    assert gc.isenabled()
+
+    gc.disable()
+    try:
+        parse_files([str(sample_workspace / "foo.sls")])
+        assert not gc.isenabled()
+    finally:
+        gc.enable()
+
+
+@pytest.mark.asyncio
+async def test_workspace_is_indexed(workspace, sample_workspace: Path):
+    opened = f"file://{sample_workspace}/quo.sls"
+    workspace.put_text_document(
+        TextDocumentItem(
+            uri=opened, language_id=SLS_LANGUAGE_ID, version=3, text=""
+        )
+    )
+    progress = RecordingProgress()
+
+    assert await WorkspaceIndexer(workspace, progress=progress).run() == 7
+
+    for path in SLS_FILES:
+        assert f"file://{sample_workspace}/{path}" in workspace.trees
+    # the opened document was not replaced by the file on the disk
+    assert workspace.get_text_document(opened).version == 3
+    assert workspace.trees[opened].states == []
+    assert [
+        str(uri)
+        for uri in workspace.includes[f"file://{sample_workspace}/foo.sls"]
+    ] == [
+        f"file://{sample_workspace}/bar.sls",
+        f"file://{sample_workspace}/baz.sls",
+        f"file://{sample_workspace}/quo.sls",
+    ]
+
+    assert isinstance(progress.values[0], WorkDoneProgressBegin)
+    assert progress.values[-2] == WorkDoneProgressReport(
+        message="8/8 files", percentage=100
+    )
+    assert progress.values[-1] == WorkDoneProgressEnd(
+        message="Indexed 7 files"
+    )
+
+
+@pytest.mark.asyncio
+async def test_workspace_without_folders(sample_workspace, state_completions):
+    workspace = SlsFileWorkspace(
+        state_completions, f"file://{sample_workspace}"
+    )
+    with ThreadPoolExecutor() as executor:
+        indexer = WorkspaceIndexer(workspace, executor=executor)
+        assert await indexer.run() == len(SLS_FILES)
@@ -1,11 +1,23 @@
+import dataclasses
+import random
+from typing import List, Tuple
+
+import pytest
+
+import salt_lsp.parser
 from salt_lsp.parser import (
+    LIBYAML_AVAILABLE,
+    AstNode,
+    Parser,
     RequisiteNode,
     RequisitesNode,
     StateCallNode,
     StateNode,
     StateParameterNode,
+    TokenNode,
     Tree,
     parse,
+    reparse,
 )
 from salt_lsp.utils import construct_path_to_position
 
@@ -136,3 +148,285 @@ def test_path_before_target():
     assert path[1].identifier == "/srv/git/salt-states"
     assert isinstance(path[2], StateCallNode)
     assert path[2].name == "file.symlink"
+
+
+def _apply_edit(
+    document: str, start: Tuple[int, int], end: Tuple[int, int], text: str
+) -> str:
+    lines = document.split("\n")
+
+    def offset(pos: Tuple[int, int]) -> int:
+        return sum(len(line) + 1 for line in lines[: pos[0]]) + pos[1]
+
+    return document[: offset(start)] + text + document[offset(end) :]
+
+
+@pytest.mark.parametrize(
+    "start,end,text",
+    (
+        pytest.param((3, 8), (3, 19), "salt-minion", id="replace_value"),
+        pytest.param((5, 11), (5, 11), "\n      - vim", id="add_line"),
+        pytest.param((10, 0), (17, 0), "", id="remove_state"),
+        pytest.param((0, 0), (0, 0), "include:\n  - foo\n\n", id="prepend"),
+        pytest.param((24, 27), (24, 27), "\n    - mode: 600", id="last"),
+        pytest.param((19, 4), (19, 5), "- name: foo", id="first_param"),
+        pytest.param((10, 0), (10, 0), "foo", id="edit_state_id"),
+        pytest.param((10, 24), (10, 25), "", id="remove_colon"),
+        pytest.param((12, 15), (12, 15), "'", id="unterminated_quote"),
+        pytest.param(
+            (17, 0), (17, 0), "new:\n  pkg.installed: []\n", id="add_state"
+        ),
+    ),
+)
+def test_reparse_matches_full_parse(start, end, text):
+    new_document = _apply_edit(MASTER_DOT_SLS, start, end, text)
+
+    tree = reparse(
+        MASTER_DOT_SLS_TREE,
+        new_document,
+        start[0],
+        end[0],
+        start[0] + text.count("\n"),
+    )
+
+    assert tree == Parser(new_document).parse()
+    assert tree.end == Parser(new_document).parse().end
+    assert _token_marks(tree) == _token_marks(Parser(new_document).parse())
+    assert MASTER_DOT_SLS_TREE == Parser(MASTER_DOT_SLS).parse()
+
+
+def _token_marks(node: AstNode) -> List[Tuple[str, int, int, int, int]]:
+    """
+    Returns the type, start and end lines and indexes of the tokens of the
+    node and of its children.
+    """
+    if isinstance(node, TokenNode):
+        return [
+            (
+                type(node.token).__name__,
+                node.token.start_mark.line,
+                node.token.start_mark.index,
+                node.token.end_mark.line,
+                node.token.end_mark.index,
+            )
+        ]
+    marks = []
+    for fld in dataclasses.fields(node):
+        value = getattr(node, fld.name) if fld.name != "parent" else None
+        for child in value if isinstance(value, list) else [value]:
+            if isinstance(child, AstNode):
+                marks.extend(_token_marks(child))
+    return marks
+
+
+@pytest.mark.parametrize("seed", (4242, 99, 156, 166, 205, 219, 326, 381))
+def test_reparse_random_edits(seed):
+    rng = random.Random(seed)
+    snippets = ("", "\n", "x", ":", "  ", "- ", "'", "[", "#", "\n\nfoo:\n")
+    document = MASTER_DOT_SLS
+    tree = MASTER_DOT_SLS_TREE
+
+    for _ in range(200):
+        lines = document.split("\n")
+        start_line = rng.randrange(len(lines))
+        end_line = min(start_line + rng.choice((0, 0, 1, 2)), len(lines) - 1)
+        start_col = rng.randrange(len(lines[start_line]) + 1)
+        end_col = (
+            rng.randrange(start_col, len(lines[end_line]) + 1)
+            if end_line == start_line
+            else rng.randrange(len(lines[end_line]) + 1)
+        )
+        text = rng.choice(snippets)
+        new_document = _apply_edit(
+            document, (start_line, start_col), (end_line, end_col), text
+        )
+        try:
+            expected = Parser(new_document).parse()
+        except (AttributeError, IndexError):
+            # the parser cannot handle every broken document
+            document = MASTER_DOT_SLS
+            tree = MASTER_DOT_SLS_TREE
+            continue
+
+        tree = reparse(
+            tree,
+            new_document,
+            start_line,
+            end_line,
+            start_line + text.count("\n"),
+        )
+        assert tree == expected, new_document
+        assert tree.end == expected.end, new_document
+        assert tree.state_ids == expected.state_ids, new_document
+        assert _token_marks(tree) == _token_marks(expected), new_document
+        document = new_document
+
+
+@pytest.mark.skipif(not LIBYAML_AVAILABLE, reason="libyaml is not available")
+@pytest.mark.parametrize(
+    "document",
+    (
+        pytest.param(MASTER_DOT_SLS, id="master"),
+        pytest.param(MASTER_DOT_SLS.rstrip(), id="no_final_newline"),
+        pytest.param(MASTER_DOT_SLS.replace("\n", "\r\n"), id="crlf"),
+        pytest.param(
+            _apply_edit(MASTER_DOT_SLS, (12, 15), (12, 15), "'"),
+            id="scanner_error",
+        ),
+        pytest.param("foo:\n\tpkg.installed: []\n", id="tab"),
+        pytest.param("foo:\n  pkg.installed: []\n]", id="stray_bracket"),
+        pytest.param("{foo: a ? b}", id="question_mark_in_flow"),
+    ),
+)
+def test_libyaml_tokens_match_pure_python(document):
+    libyaml_parser = Parser(document, use_libyaml=True)
+    python_parser = Parser(document, use_libyaml=False)
+
+    tree = libyaml_parser.parse()
+    expected = python_parser.parse()
+
+    assert tree == expected
+    assert tree.end == expected.end
+    assert tree.complete == expected.complete
+    assert (
+        Parser(document, use_libyaml=True).parse_blocks()
+        == Parser(document, use_libyaml=False).parse_blocks()
+    )
+
+
+def test_parse_without_libyaml(monkeypatch):
+    monkeypatch.setattr(salt_lsp.parser, "LIBYAML_AVAILABLE", False)
+    monkeypatch.delattr("yaml.CBaseLoader", raising=False)
+
+    assert Parser(MASTER_DOT_SLS, use_libyaml=True).parse() == (
+        MASTER_DOT_SLS_TREE
+    )
+
+
+VALUES_SLS = """packages:
+  pkg.installed:
+    - pkgs:
+      - vim
+      - 'git'
+      - |
+        multi
+        line
+
+    - refresh: True
+
+/etc/motd:
+  file.managed:
+    - contents:
+      - Welcome
+      # comment
+      - !!str 42
+"""
+
+
+def _value_tokens(tree):
+    return [
+        (node.start, node.end, node.token.start_mark.line)
+        for state in tree.states
+        for call in state.states
+        for param in call.parameters
+        if isinstance(param.value, list)
+        for node in param.value
+    ]
+
+
+@pytest.mark.parametrize(
+    "document",
+    (
+        pytest.param(MASTER_DOT_SLS, id="master"),
+        pytest.param(VALUES_SLS, id="values"),
+        pytest.param(VALUES_SLS.replace("\n", "\r\n"), id="crlf"),
+    ),
+)
+def test_lazy_values_match_eager_values(document):
+    tree = Parser(document).parse()
+    expected = Parser(document, lazy_values=False).parse()
+
+    assert tree == expected
+    assert _value_tokens(tree) == _value_tokens(expected)
+
+
+def test_lazy_values_are_built_on_access():
+    tree = parse(VALUES_SLS)
+    pkgs = tree.states[0].states[0].parameters[0]
+
+    value = salt_lsp.parser._PARAMETER_VALUE.__get__(pkgs)
+    assert isinstance(value, salt_lsp.parser._LazyValue)
+    assert pkgs.value is pkgs.value
+    assert all(node.parent is pkgs for node in pkgs.value)
+    assert tree.states[0].states[0].parameters[1].value == "True"
+
+
+def test_lazy_values_are_moved_by_reparse():
+    tree = parse(VALUES_SLS)
+    new_document = "include:\n  - foo\n\n" + VALUES_SLS
+
+    new_tree = reparse(tree, new_document, 0, 0, 3)
+
+    contents = new_tree.states[1].states[0].parameters[0]
+    assert isinstance(
+        salt_lsp.parser._PARAMETER_VALUE.__get__(contents),
+        salt_lsp.parser._LazyValue,
+    )
+    assert new_tree == Parser(new_document, lazy_values=False).parse()
+    assert _value_tokens(new_tree) == _value_tokens(
+        Parser(new_document, lazy_values=False).parse()
+    )
+
+
+def test_parse_cache(monkeypatch):
+    cache = salt_lsp.parser.ParseCache(maxsize=2)
+    monkeypatch.setattr(salt_lsp.parser, "PARSE_CACHE", cache)
+
+    tree = parse(MASTER_DOT_SLS)
+    assert parse(MASTER_DOT_SLS) is tree
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    parse(VALUES_SLS)
+    parse("foo:\n  pkg.installed: []\n")
+    assert len(cache) == 2
+    # the least recently used tree got evicted
+    assert parse(MASTER_DOT_SLS) is not tree
+    assert (cache.hits, cache.misses) == (1, 4)
+
+
+def test_reparse_uses_the_parse_cache(monkeypatch):
+    monkeypatch.setattr(
+        salt_lsp.parser, "PARSE_CACHE", salt_lsp.parser.ParseCache()
+    )
+    tree = parse(MASTER_DOT_SLS)
+    new_document = _apply_edit(MASTER_DOT_SLS, (3, 8), (3, 19), "vim")
+    new_tree = reparse(tree, new_document, 3, 3, 3)
+
+    # undo the edit
+    assert reparse(new_tree, MASTER_DOT_SLS, 3, 3, 3) is tree
+    assert parse(new_document) is new_tree
+
+
+def test_state_ids():
+    document = """foo:
+  pkg.installed: []
+
+include:
+  - bar
+
+baz:
+  file.managed: []
+
+foo:
+  service.running: []
+"""
+    tree = parse(document)
+
+    assert list(tree.state_ids) == ["foo", "baz"]
+    assert tree.state_ids["baz"] == [tree.states[1]]
+    assert tree.state_ids["foo"] == [tree.states[0], tree.states[2]]
+
+    new_document = _apply_edit(document, (9, 0), (9, 3), "qux")
+    new_tree = reparse(tree, new_document, 9, 9, 9)
+    assert new_tree.state_ids["qux"] == [new_tree.states[2]]
+    assert new_tree.state_ids["foo"] == [new_tree.states[0]]
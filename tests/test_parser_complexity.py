@@ -0,0 +1,59 @@
+"""
+Check that the time to parse a document grows linearly with its size.
+"""
+
+import math
+import timeit
+
+from salt_lsp.parser import Parser
+
+#: the largest exponent of the growth of the parse time with the size that
+#: is accepted, a quadratic parser gets close to 2
+MAX_EXPONENT = 1.3
+
+#: the numbers of states of the parsed documents
+SIZES = (500, 1000, 2000, 4000)
+
+
+def _generate_sls(states: int) -> str:
+    """
+    Generate a document where half of the states are separate state
+    declarations and the other half are parameters and requisites of a single
+    huge state.
+    """
+    many_states = "".join(
+        f"state_{i}:\n"
+        "  pkg.installed:\n"
+        f"    - name: package_{i}\n"
+        "    - require:\n"
+        f"      - file: /etc/foo/{i}.conf\n"
+        for i in range(states // 2)
+    )
+    huge_state = "huge:\n  file.managed:\n" + "".join(
+        f"    - param_{i}: value\n"
+        "    - watch:\n"
+        f"      - pkg: package_{i}\n"
+        for i in range(states - states // 2)
+    )
+    return many_states + huge_state
+
+
+def test_parse_time_grows_linearly():
+    log_sizes = []
+    log_times = []
+    for states in SIZES:
+        document = _generate_sls(states)
+        elapsed = min(
+            timeit.repeat(lambda: Parser(document).parse(), number=1, repeat=3)
+        )
+        log_sizes.append(math.log(states))
+        log_times.append(math.log(elapsed))
+
+    # least squares fit of log(time) = exponent * log(size) + constant
+    mean_size = sum(log_sizes) / len(log_sizes)
+    mean_time = sum(log_times) / len(log_times)
+    exponent = sum(
+        (size - mean_size) * (time - mean_time)
+        for size, time in zip(log_sizes, log_times)
+    ) / sum((size - mean_size) ** 2 for size in log_sizes)
+    assert exponent < MAX_EXPONENT, exponent
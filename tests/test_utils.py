@@ -1,19 +1,31 @@
 import os
+import random
 
 import pytest
 from lsprotocol import types
 
 from salt_lsp.utils import (
     ast_node_to_range,
+    canonical_uri,
+    from_client_units,
     get_git_root,
     get_last_element_of_iterator,
+    get_sls_includes,
     get_top,
     is_valid_file_uri,
+    position_to_index,
+    resident_memory,
+    to_client_units,
     FileUri,
+    LINE_ENDINGS,
+    LineOffsets,
+    PathTrie,
+    RootFinder,
+    SpanIndex,
     UriDict,
     Uri,
 )
-from salt_lsp.parser import IncludeNode, Position
+from salt_lsp.parser import IncludeNode, Position, parse
 
 
 def test_last_element_of_range():
@@ -45,6 +57,15 @@ class TestFileUri:
         assert str(FileUri("/foo/bar")) == "file:///foo/bar"
         assert str(FileUri(FileUri("/foo/bar"))) == "file:///foo/bar"
 
+    def test_canonical_uri_is_interned(self):
+        canonical = canonical_uri("/foo/bar")
+        assert canonical == "file:///foo/bar"
+        for uri in ("/foo/bar", "file:///foo/bar", FileUri("/foo/bar")):
+            assert canonical_uri(uri) is canonical
+            assert str(FileUri(uri)) is canonical
+        with pytest.raises(ValueError):
+            canonical_uri("http://foo.bar.xyz")
+
 
 def test_is_valid_file_uri_accepts_paths():
     assert is_valid_file_uri("/path/to/foo")
@@ -128,6 +149,69 @@ def test_get_top_recurses_into_parent_dirs(tmp_path):
     assert get_top(init_sls) == str(tmp_path)
 
 
+def test_get_sls_includes(tmp_path):
+    for path in ("top.sls", "init.sls", "foo/init.sls", "foo/bar/baz.sls"):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text("")
+
+    assert sorted(get_sls_includes(str(tmp_path / "foo" / "init.sls"))) == [
+        "foo",
+        "foo.bar.baz",
+        "top",
+    ]
+
+
+def test_get_git_root_of_worktree(tmp_path):
+    # worktrees and submodules have a .git file
+    (tmp_path / ".git").write_text("gitdir: /srv/repo/.git/worktrees/wt\n")
+    (tmp_path / "foo").mkdir()
+    assert get_git_root(str(tmp_path / "foo" / "init.sls")) == str(tmp_path)
+
+
+def test_root_finder_caches_the_directories(tmp_path, monkeypatch):
+    foo_dir = tmp_path / "foo"
+    foo_dir.mkdir()
+    (tmp_path / ".git").mkdir()
+    finder = RootFinder(validate=False)
+    assert finder.get_top(str(foo_dir / "init.sls")) is None
+    assert finder.get_root(str(foo_dir / "init.sls")) == str(tmp_path)
+
+    def isfile(path):
+        raise AssertionError(f"{path} was looked up again")
+
+    monkeypatch.setattr(os.path, "isfile", isfile)
+    monkeypatch.setattr(os.path, "exists", isfile)
+    assert finder.get_top(str(foo_dir / "bar.sls")) is None
+    assert finder.get_root(str(foo_dir)) == str(tmp_path)
+    monkeypatch.undo()
+
+    # a new top.sls is only found once the finder is told about it
+    (foo_dir / "top.sls").write_text("")
+    assert finder.get_top(str(foo_dir)) is None
+    finder.invalidate(str(foo_dir / "top.sls"))
+    assert finder.get_top(str(foo_dir)) == str(foo_dir)
+    assert finder.get_git_root(str(foo_dir)) == str(tmp_path)
+
+    (foo_dir / "top.sls").unlink()
+    finder.invalidate(str(foo_dir / "top.sls"))
+    assert finder.get_top(str(foo_dir)) is None
+
+    # a deleted directory is dropped whatever its name
+    conf_dir = tmp_path / "nginx.conf.d"
+    conf_dir.mkdir()
+    (conf_dir / "top.sls").write_text("")
+    assert finder.get_top(str(conf_dir / "site.sls")) == str(conf_dir)
+    (conf_dir / "top.sls").unlink()
+    conf_dir.rmdir()
+    finder.invalidate(str(conf_dir))
+    assert finder.get_top(str(conf_dir / "site.sls")) is None
+
+    # nothing is cached with validation
+    finder.validate = True
+    (tmp_path / "top.sls").write_text("")
+    assert finder.get_top(str(foo_dir)) == str(tmp_path)
+
+
 class TestUriDict:
     def test_getter(self):
         p = "/foo/bar"
@@ -151,3 +235,171 @@ class TestUriDict:
         ):
             d[key] = 42 + i
             assert d[p] == 42 + i
+
+    def test_contains_and_get(self):
+        p = "/foo/bar"
+        d = UriDict({p: 1})
+
+        for key in (p, FileUri(p), f"file://{p}"):
+            assert key in d
+            assert d.get(key) == 1
+        assert "/foo/baz" not in d
+        assert d.get("/foo/baz") is None
+        assert d.get("/foo/baz", 2) == 2
+
+
+def test_path_trie():
+    trie = PathTrie()
+    assert trie.longest_prefix("/srv/salt/foo.sls") is None
+
+    trie.insert("/srv/salt", 1)
+    trie.insert("/srv/salt/formulas/nginx/", 2)
+    trie.insert("/srv/salt2", 3)
+    assert len(trie) == 3
+
+    assert trie.longest_prefix("/srv/salt/foo.sls") == 1
+    assert trie.longest_prefix("/srv/salt") == 1
+    assert trie.longest_prefix("/srv/salt/formulas/nginx/init.sls") == 2
+    assert trie.longest_prefix("/srv/salt/formulas/nginx2/init.sls") == 1
+    assert trie.longest_prefix("/srv/salt2/foo.sls") == 3
+    assert trie.longest_prefix("/srv/pillar/foo.sls") is None
+
+    trie.remove("/srv/salt")
+    trie.remove("/srv/salt/formulas")
+    assert len(trie) == 2
+    assert trie.longest_prefix("/srv/salt/foo.sls") is None
+    assert trie.longest_prefix("/srv/salt/formulas/nginx/init.sls") == 2
+
+    trie.remove("/srv/salt/formulas/nginx")
+    assert trie.longest_prefix("/srv/salt/formulas/nginx/init.sls") is None
+    assert trie._root.children.keys() == {"srv"}
+    assert trie._root.children["srv"].children.keys() == {"salt2"}
+
+
+SPAN_INDEX_SLS = """/etc/foo.conf:
+  file.managed:
+    - source: salt://foo.conf
+    - require:
+      - pkg: foo
+    - mode: '0644'
+
+extend:
+  foo:
+    pkg.installed:
+      - version: 1.0
+
+include:
+  - bar
+  - baz
+
+broken:
+  file.
+"""
+
+
+def test_span_index_finds_the_same_nodes_as_a_visit():
+    tree = parse(SPAN_INDEX_SLS)
+    index = SpanIndex(tree)
+
+    for line, text in enumerate(SPAN_INDEX_SLS.splitlines() + ["", ""]):
+        for col in range(len(text) + 2):
+            pos = Position(line=line, col=col)
+            found = None
+
+            def visitor(node):
+                nonlocal found
+                if (
+                    node.start is not None
+                    and node.start <= pos
+                    and (node.end is None or pos <= node.end)
+                ):
+                    found = node
+                return True
+
+            tree.visit(visitor)
+            assert index.find(pos) is found
+
+
+def test_span_index_path_to_position():
+    tree = parse(SPAN_INDEX_SLS)
+    path = SpanIndex(tree).path_to_position(
+        types.Position(line=14, character=5)
+    )
+
+    assert path[0] is tree
+    assert path[-1] is tree.includes
+    assert [node.parent for node in path[1:]] == path[:-1]
+
+
+def test_resident_memory():
+    before = resident_memory()
+    assert before is not None and before > 0
+    data = b"x" * (64 * 2**20)
+    assert resident_memory() >= before + len(data) // 2
+
+
+def test_position_to_index():
+    text = "foo:\r\n  bar: baz\n\nqux\n"
+    assert position_to_index(text, 0, 2) == 2
+    assert position_to_index(text, 1, 2) == 8
+    assert position_to_index(text, 3, 0) == text.index("qux")
+    assert position_to_index(text, 4, 0) == len(text)
+
+
+def _line_starts(offsets: LineOffsets):
+    return [offsets.line_start(line) for line in range(len(offsets))]
+
+
+def _random_position(rnd: random.Random, text: str):
+    """Returns the offset and the line of a random position, which is before
+    the line ending of its line.
+    """
+    lines = text.splitlines(keepends=True) or [""]
+    line = rnd.randrange(len(lines))
+    start = sum(map(len, lines[:line]))
+    return start + rnd.randint(0, len(lines[line].rstrip(LINE_ENDINGS))), line
+
+
+def test_line_offsets_follow_the_changes():
+    rnd = random.Random(42)
+    alphabet = "ab \n\r\u2028é"
+    for _ in range(500):
+        text = "".join(rnd.choices(alphabet, k=rnd.randint(0, 30)))
+        offsets = LineOffsets(text)
+        for _ in range(10):
+            (start, start_line), (end, end_line) = sorted(
+                (_random_position(rnd, text), _random_position(rnd, text))
+            )
+            new_text = "".join(rnd.choices(alphabet, k=rnd.randint(0, 5)))
+            text = text[:start] + new_text + text[end:]
+            offsets.replace(
+                text, start_line, end_line, len(new_text) - end + start
+            )
+
+            assert _line_starts(offsets) == _line_starts(LineOffsets(text))
+            lines = text.splitlines(keepends=True)
+            if not text or text.endswith(("\n", "\r", "\u2028")):
+                lines.append("")
+            assert len(offsets) == len(lines)
+            for line, offset in enumerate(_line_starts(offsets)):
+                assert offsets.line_at(offset) == line
+
+
+@pytest.mark.parametrize(
+    "encoding,units",
+    (
+        (types.PositionEncodingKind.Utf16, 6),
+        (types.PositionEncodingKind.Utf8, 9),
+        (types.PositionEncodingKind.Utf32, 5),
+        (None, 6),
+    ),
+)
+def test_client_units(encoding, units):
+    text = "# é😋x"
+    assert to_client_units(text, encoding) == units
+    assert from_client_units(text, units, encoding) == 5
+    assert from_client_units(text, units - 1, encoding) == 4
+    # in the middle of the emoji, except for UTF-32
+    assert from_client_units(text, units - 2, encoding) == 3
+    assert from_client_units(text, units + 10, encoding) == 5
+    assert from_client_units("foo", 2, encoding) == 2
@@ -0,0 +1,530 @@
+import asyncio
+import threading
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from pathlib import Path
+
+from lsprotocol.types import (
+    Position,
+    Range,
+    TextDocumentContentChangeEvent_Type1,
+    TextDocumentContentChangeEvent_Type2,
+    TextDocumentItem,
+    VersionedTextDocumentIdentifier,
+    WorkspaceFolder,
+)
+import pytest
+
+import salt_lsp.parser
+import salt_lsp.workspace
+from salt_lsp.base_types import SLS_LANGUAGE_ID
+from salt_lsp.disk_cache import DiskTreeCache
+from salt_lsp.parser import ParseCache, parse
+from salt_lsp.workspace import SlsFileWorkspace
+
+
+def _open(workspace: SlsFileWorkspace, path: Path) -> str:
+    uri = f"file://{path}"
+    workspace.put_text_document(
+        TextDocumentItem(
+            uri=uri,
+            language_id=SLS_LANGUAGE_ID,
+            version=0,
+            text=path.read_text(),
+        )
+    )
+    return uri
+
+
+def test_unchanged_document_is_not_processed_again(
+    workspace, sample_workspace
+):
+    uri = _open(workspace, sample_workspace / "opensuse" / "base.sls")
+    tree = workspace.trees[uri]
+    symbols = workspace.document_symbols[uri]
+
+    workspace.update_text_document(
+        VersionedTextDocumentIdentifier(uri=uri, version=1),
+        TextDocumentContentChangeEvent_Type2(
+            text=(sample_workspace / "opensuse" / "base.sls").read_text()
+        ),
+    )
+
+    assert workspace.trees[uri] is tree
+    assert workspace.document_symbols[uri] is symbols
+
+
+def test_document_symbols_are_built_on_demand(
+    workspace, sample_workspace, monkeypatch
+):
+    built = []
+
+    def tree_to_document_symbols(tree, state_name_completions):
+        built.append(tree)
+        return []
+
+    monkeypatch.setattr(
+        salt_lsp.workspace,
+        "tree_to_document_symbols",
+        tree_to_document_symbols,
+    )
+    uri = _open(workspace, sample_workspace / "foo.sls")
+    # neither the opened document nor its includes need document symbols yet
+    assert len(workspace.trees) == 4
+    assert not built
+
+    symbols = workspace.document_symbols[uri]
+    assert workspace.document_symbols[uri] is symbols
+    assert built == [workspace.trees[uri]]
+
+    _insert(workspace, uri, 1, 0, "nginx:\n  pkg.installed: []\n")
+    assert workspace.document_symbols[uri] is not symbols
+    assert built[1:] == [workspace.trees[uri]]
+
+
+def test_opened_files_are_loaded_from_the_disk_cache(
+    sample_workspace, state_completions, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(salt_lsp.parser, "PARSE_CACHE", ParseCache())
+    uri = f"file://{sample_workspace}"
+    cache = DiskTreeCache(str(tmp_path / "cache"))
+
+    def open_workspace() -> SlsFileWorkspace:
+        workspace = SlsFileWorkspace(
+            state_completions,
+            uri,
+            workspace_folders=[WorkspaceFolder(uri=uri, name="sample")],
+            tree_cache=cache,
+        )
+        _open(workspace, sample_workspace / "foo.sls")
+        return workspace
+
+    tree = open_workspace().trees[f"{uri}/quo.sls"]
+    assert (cache.hits, cache.misses) == (0, 4)
+
+    # simulate a restart of the server
+    salt_lsp.parser.PARSE_CACHE.clear()
+    workspace = open_workspace()
+    assert (cache.hits, cache.misses) == (4, 4)
+    assert workspace.trees[f"{uri}/quo.sls"] == tree
+
+
+def test_include_cycles(workspace, sample_workspace):
+    (sample_workspace / "baz.sls").write_text("include:\n  - foo\n")
+    (sample_workspace / "quo.sls").write_text("include:\n  - quo\n")
+
+    uri = _open(workspace, sample_workspace / "foo.sls")
+
+    assert [str(include) for include in workspace.includes[uri]] == [
+        f"file://{sample_workspace}/bar.sls",
+        f"file://{sample_workspace}/baz.sls",
+        f"file://{sample_workspace}/quo.sls",
+    ]
+    assert [
+        str(include)
+        for include in workspace.includes[f"file://{sample_workspace}/baz.sls"]
+    ] == [
+        f"file://{sample_workspace}/foo.sls",
+        f"file://{sample_workspace}/bar.sls",
+        f"file://{sample_workspace}/quo.sls",
+    ]
+
+
+def test_memory_budget(workspace, sample_workspace):
+    workspace.memory_budget = 0
+    uri = _open(workspace, sample_workspace / "foo.sls")
+    included = [str(include) for include in workspace.includes[uri]]
+    assert included == [
+        f"file://{sample_workspace}/bar.sls",
+        f"file://{sample_workspace}/baz.sls",
+        f"file://{sample_workspace}/quo.sls",
+    ]
+    # only the open document and the last loaded one are kept
+    assert len(workspace._trees) == 2
+    assert len(workspace.trees) == 4
+
+    # the evicted documents are still indexed
+    assert [
+        symbol.location.uri
+        for symbol in workspace.symbol_index.search("/root/.fishrc")
+    ] == [included[2]]
+    assert sorted(
+        ref_uri
+        for ref_uri, _ in workspace.requisite_index.find("/root/.fishrc")
+    ) == [included[0], uri]
+
+    # and read again when they are needed
+    bar = workspace.trees[included[0]]
+    assert list(bar.state_ids) == ["bar"]
+    assert (
+        workspace.get_text_document(included[0]).source
+        == (sample_workspace / "bar.sls").read_text()
+    )
+    assert (
+        workspace.loaded_size
+        == len((sample_workspace / "bar.sls").read_text())
+        * salt_lsp.workspace.DOCUMENT_BYTES_PER_CHAR
+    )
+    assert [str(include) for include in workspace.includes[included[0]]] == [
+        included[2]
+    ]
+
+    # a closed document goes back to its content on the disk
+    workspace.remove_text_document(uri)
+    assert [str(include) for include in workspace.includes[uri]] == included
+    assert list(workspace.trees[uri].state_ids) == ["foo"]
+
+    # and is dropped once it is deleted
+    _open(workspace, sample_workspace / "foo.sls")
+    (sample_workspace / "foo.sls").unlink()
+    workspace.remove_text_document(uri)
+    assert uri not in workspace.includes
+    assert uri not in workspace.trees
+
+
+def _symbols_and_references(workspace: SlsFileWorkspace):
+    return (
+        [
+            (symbol.name, symbol.location)
+            for symbol in workspace.symbol_index.search("")
+        ],
+        sorted(
+            (ref_uri, ref.start, ref.end)
+            for ref_uri, ref in workspace.requisite_index.find("/root/.fishrc")
+        ),
+    )
+
+
+def test_closed_documents_stay_indexed(workspace, sample_workspace):
+    _open(workspace, sample_workspace / "foo.sls")
+    indexed = _symbols_and_references(workspace)
+    assert indexed[0] and indexed[1]
+
+    uri = _open(workspace, sample_workspace / "quo.sls")
+    _insert(workspace, uri, 1, 0, "unsaved:\n  pkg.installed: []\n")
+    assert "unsaved" in [
+        symbol.name for symbol in workspace.symbol_index.search("unsaved")
+    ]
+
+    workspace.remove_text_document(uri)
+    assert _symbols_and_references(workspace) == indexed
+    assert workspace.trees[uri] == parse(
+        (sample_workspace / "quo.sls").read_text()
+    )
+
+
+@pytest.mark.asyncio
+async def test_closed_documents_are_read_in_the_executor(
+    executor_workspace, sample_workspace
+):
+    _open(executor_workspace, sample_workspace / "foo.sls")
+    await executor_workspace.wait_parsed()
+    indexed = _symbols_and_references(executor_workspace)
+
+    uri = _open(executor_workspace, sample_workspace / "bar.sls")
+    await executor_workspace.wait_parsed(uri)
+    executor_workspace.remove_text_document(uri)
+    await executor_workspace.wait_parsed()
+    assert _symbols_and_references(executor_workspace) == indexed
+    assert uri in executor_workspace.trees
+
+
+@pytest.mark.asyncio
+async def test_evicted_documents_are_read_in_the_executor(
+    executor_workspace, sample_workspace, monkeypatch
+):
+    executor_workspace.memory_budget = 0
+    _open(executor_workspace, sample_workspace / "foo.sls")
+    await executor_workspace.wait_parsed()
+    bar = f"file://{sample_workspace}/bar.sls"
+    assert bar not in executor_workspace._trees
+
+    threads = []
+    read_document = salt_lsp.workspace.read_document
+
+    def recording_read_document(*args):
+        threads.append(threading.current_thread())
+        return read_document(*args)
+
+    monkeypatch.setattr(
+        salt_lsp.workspace, "read_document", recording_read_document
+    )
+    await asyncio.gather(
+        executor_workspace.load(bar), executor_workspace.load(bar)
+    )
+    assert bar in executor_workspace._trees
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+
+
+def test_includes_of_nested_workspace_folders(
+    sample_workspace, state_completions
+):
+    formula = sample_workspace / "formulas" / "quo"
+    formula.mkdir(parents=True)
+    (formula / "init.sls").write_text("include:\n  - quo\n")
+    (formula / "quo.sls").write_text("quo: {}\n")
+    (formula / "top.sls").write_text("base:\n  '*':\n    - quo\n")
+    folders = [
+        WorkspaceFolder(uri=f"file://{path}", name=path.name)
+        for path in (sample_workspace, formula)
+    ]
+    workspace = SlsFileWorkspace(
+        state_completions,
+        folders[0].uri,
+        workspace_folders=folders,
+    )
+
+    # the includes resolve in the innermost folder
+    uri = _open(workspace, formula / "init.sls")
+    assert [str(include) for include in workspace.includes[uri]] == [
+        f"file://{formula}/quo.sls"
+    ]
+
+    # and are resolved again when the folders change
+    workspace.remove_folder(folders[1].uri)
+    assert [str(include) for include in workspace.includes[uri]] == [
+        f"file://{sample_workspace}/quo.sls"
+    ]
+
+    # or when a top.sls is created or deleted
+    (formula / "top.sls").unlink()
+    workspace.add_folder(folders[1])
+    assert [str(include) for include in workspace.includes[uri]] == [
+        f"file://{sample_workspace}/quo.sls"
+    ]
+    (formula / "top.sls").write_text("base:\n  '*':\n    - quo\n")
+    workspace.root_finder.invalidate(str(formula / "top.sls"))
+    workspace.update_top_paths()
+    assert [str(include) for include in workspace.includes[uri]] == [
+        f"file://{formula}/quo.sls"
+    ]
+
+
+def _insert(
+    workspace: SlsFileWorkspace, uri: str, version: int, line: int, text: str
+) -> None:
+    workspace.update_text_document(
+        VersionedTextDocumentIdentifier(uri=uri, version=version),
+        TextDocumentContentChangeEvent_Type1(
+            range=Range(
+                start=Position(line=line, character=0),
+                end=Position(line=line, character=0),
+            ),
+            text=text,
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_changes_are_coalesced(workspace, sample_workspace, monkeypatch):
+    reparsed = []
+
+    def reparse(*args):
+        reparsed.append(args[2:])
+        return salt_lsp.parser.reparse(*args)
+
+    monkeypatch.setattr(salt_lsp.workspace, "reparse", reparse)
+    workspace.parse_delay = 60
+    uri = _open(workspace, sample_workspace / "opensuse" / "base.sls")
+    tree = workspace.trees[uri]
+
+    _insert(workspace, uri, 1, 4, "\n")
+    _insert(workspace, uri, 2, 5, "nginx:\n  pkg.installed: []\n")
+    _insert(workspace, uri, 3, 0, "# comment\n")
+    assert workspace.trees[uri] is tree
+
+    # a request needs the tree of the document
+    workspace.parse_pending(uri)
+    assert reparsed == [(0, 4, 8)]
+    assert workspace.trees[uri] == parse(
+        workspace.get_text_document(uri).source
+    )
+    assert "nginx" in workspace.trees[uri].state_ids
+
+    workspace.parse_delay = 0.01
+    _insert(workspace, uri, 4, 0, "apache:\n  pkg.installed: []\n")
+    assert "apache" not in workspace.trees[uri].state_ids
+    await asyncio.sleep(0.1)
+    assert "apache" in workspace.trees[uri].state_ids
+    assert len(reparsed) == 2
+
+
+def test_older_versions_are_not_applied(workspace, sample_workspace):
+    uri = _open(workspace, sample_workspace / "opensuse" / "base.sls")
+    _insert(workspace, uri, 5, 0, "nginx:\n  pkg.installed: []\n")
+    tree = workspace.trees[uri]
+
+    # e.g. the result of a parse that was started before the last change
+    workspace._update_text_document(uri, 4, parse("apache: {}\n"))
+    assert workspace.trees[uri] is tree
+
+
+class ManualExecutor(Executor):
+    """Runs the submitted jobs only when asked to."""
+
+    def __init__(self) -> None:
+        self.jobs = []
+
+    def submit(self, fn, /, *args, **kwargs):
+        future = Future()
+        self.jobs.append((future, lambda: fn(*args, **kwargs)))
+        return future
+
+    def start(self, index: int) -> Future:
+        future, _ = self.jobs[index]
+        assert future.set_running_or_notify_cancel()
+        return future
+
+    def finish(self, index: int) -> None:
+        future, job = self.jobs[index]
+        future.set_result(job())
+
+
+@pytest.fixture
+def executor_workspace(sample_workspace: Path, state_completions):
+    uri = f"file://{sample_workspace}"
+    return SlsFileWorkspace(
+        state_completions,
+        uri,
+        workspace_folders=[WorkspaceFolder(uri=uri, name="sample")],
+        parse_executor=ThreadPoolExecutor(),
+    )
+
+
+@pytest.mark.asyncio
+async def test_documents_are_parsed_in_the_executor(
+    executor_workspace, sample_workspace
+):
+    uri = _open(executor_workspace, sample_workspace / "foo.sls")
+    assert uri not in executor_workspace.trees
+
+    await executor_workspace.wait_parsed(uri)
+    assert executor_workspace.trees[uri] == parse(
+        (sample_workspace / "foo.sls").read_text()
+    )
+    assert [str(inc) for inc in executor_workspace.includes[uri]] == [
+        f"file://{sample_workspace}/bar.sls",
+        f"file://{sample_workspace}/baz.sls",
+        f"file://{sample_workspace}/quo.sls",
+    ]
+    assert f"file://{sample_workspace}/quo.sls" in executor_workspace.trees
+
+
+@pytest.mark.asyncio
+async def test_document_symbols_are_built_in_the_executor(
+    executor_workspace, sample_workspace, state_completions, monkeypatch
+):
+    threads = []
+    tree_to_document_symbols = salt_lsp.workspace.tree_to_document_symbols
+
+    def recording_tree_to_document_symbols(*args):
+        threads.append(threading.current_thread())
+        return tree_to_document_symbols(*args)
+
+    monkeypatch.setattr(
+        salt_lsp.workspace,
+        "tree_to_document_symbols",
+        recording_tree_to_document_symbols,
+    )
+    uri = _open(executor_workspace, sample_workspace / "foo.sls")
+    await executor_workspace.wait_parsed(uri)
+
+    symbols = await executor_workspace.get_document_symbols(uri)
+    assert symbols == tree_to_document_symbols(
+        executor_workspace.trees[uri], state_completions
+    )
+    assert await executor_workspace.get_document_symbols(uri) is symbols
+    assert len(threads) == 1
+    assert threads[0] is not threading.current_thread()
+    assert (
+        await executor_workspace.get_document_symbols("file:///no.sls") is None
+    )
+
+
+@pytest.mark.asyncio
+async def test_indexed_includes_are_read_in_the_executor(
+    executor_workspace, sample_workspace, monkeypatch
+):
+    threads = []
+    read_document = salt_lsp.workspace.read_document
+
+    def recording_read_document(*args):
+        threads.append(threading.current_thread())
+        return read_document(*args)
+
+    monkeypatch.setattr(
+        salt_lsp.workspace, "read_document", recording_read_document
+    )
+    uri = f"file://{sample_workspace}/foo.sls"
+    assert executor_workspace.put_indexed_document(
+        uri, *read_document(str(sample_workspace / "foo.sls"))
+    )
+
+    await executor_workspace.resolve_includes(uri)
+    assert f"file://{sample_workspace}/quo.sls" in executor_workspace.trees
+    # bar.sls, baz.sls and quo.sls, which is included by bar.sls
+    assert len(threads) == 3
+    assert threading.current_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_superseded_parse_jobs(workspace, sample_workspace):
+    uri = _open(workspace, sample_workspace / "opensuse" / "base.sls")
+    workspace._parse_executor = executor = ManualExecutor()
+
+    _insert(workspace, uri, 1, 0, "first:\n  pkg.installed: []\n")
+    # not started yet, so it is cancelled
+    _insert(workspace, uri, 2, 0, "second:\n  pkg.installed: []\n")
+    assert executor.jobs[0][0].cancelled()
+
+    executor.start(1)
+    _insert(workspace, uri, 3, 0, "third:\n  pkg.installed: []\n")
+    # the running job is the base of the next one and its result is dropped
+    executor.start(2)
+    executor.finish(1)
+    await asyncio.sleep(0)
+    assert "second" not in workspace.trees[uri].state_ids
+
+    executor.finish(2)
+    await workspace.wait_parsed(uri)
+    assert workspace.trees[uri] == parse(
+        workspace.get_text_document(uri).source
+    )
+    assert set(workspace.trees[uri].state_ids) >= {"first", "second", "third"}
+
+
+def test_changes_in_utf16_units(workspace, sample_workspace):
+    uri = _open(workspace, sample_workspace / "opensuse" / "base.sls")
+    workspace.update_text_document(
+        VersionedTextDocumentIdentifier(uri=uri, version=1),
+        TextDocumentContentChangeEvent_Type2(
+            text="# 😋 ünïcode\r\nnginx:\n  pkg.installed: []\n"
+        ),
+    )
+    document = workspace.get_text_document(uri)
+    assert document.offset_at_position(Position(line=0, character=5)) == 4
+    assert document.position_at_offset(4) == Position(line=0, character=5)
+    assert document.offset_at_position(Position(line=1, character=2)) == 15
+
+    # replace "😋 ü" and insert a line
+    workspace.update_text_document(
+        VersionedTextDocumentIdentifier(uri=uri, version=2),
+        TextDocumentContentChangeEvent_Type1(
+            range=Range(
+                start=Position(line=0, character=2),
+                end=Position(line=0, character=6),
+            ),
+            text="u\napache: {}\n# ",
+        ),
+    )
+    assert document.source == (
+        "# u\napache: {}\n# nïcode\r\nnginx:\n  pkg.installed: []\n"
+    )
+    assert (
+        document.offset_at_position(Position(line=3, character=2))
+        == document.source.index("nginx:") + 2
+    )
+    assert document.line_text(2) == "# nïcode"
+
+    workspace.parse_pending(uri)
+    assert list(workspace.trees[uri].state_ids) == ["apache", "nginx"]